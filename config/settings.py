@@ -11,7 +11,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import copy
 import os
+import sys
+import tempfile
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -90,6 +93,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'players.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,6 +102,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'players.middleware.ReplicaRoutingMiddleware',
+    'players.middleware.DataLoaderMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -123,6 +129,10 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connections: pooled (psycopg 3 pool) for postgres, persistent with health checks for sqlite.
+# The pool is thread-safe, so sync_to_async and aatomic executor threads share it.
+DB_POOL = os.getenv("DB_POOL", "1") == "1"
+
 if os.getenv("DATABASE_TYPE") == "postgres":
     DATABASES = {
         'default': {
@@ -132,17 +142,78 @@ if os.getenv("DATABASE_TYPE") == "postgres":
             'HOST': os.getenv('POSTGRES_HOST'),
             'PORT': os.getenv('POSTGRES_PORT'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
+    if DB_POOL:
+        from psycopg_pool import ConnectionPool
+
+        # CONN_MAX_AGE must stay 0 with the pool, returning connection to the pool is "close"
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+                'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                'check': ConnectionPool.check_connection,
+            }
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('CONN_MAX_AGE', 60))
 else:
 
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME':os.getenv('POSTGRES_DB')
+            'NAME':os.getenv('POSTGRES_DB'),
+            'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 
+# Player shards: DB_SHARDS is a comma separated list of hosts (host[:port]) for postgres or of database
+# files for sqlite. Player/Boost/PlayerLevel are partitioned by player_id, the Level/Prize catalog is
+# copied to every shard. Without DB_SHARDS everything stays in default.
+for number, shard in enumerate(filter(None, os.getenv("DB_SHARDS", "").split(",")), start=1):
+    shard_settings = copy.deepcopy(DATABASES['default'])
+    if os.getenv("DATABASE_TYPE") == "postgres":
+        host, _, port = shard.strip().partition(":")
+        shard_settings['HOST'] = host
+        shard_settings['PORT'] = port or shard_settings['PORT']
+    else:
+        shard_settings['NAME'] = shard.strip()
+    DATABASES[f'shard_{number}'] = shard_settings
+
+PLAYER_SHARDS = [alias for alias in DATABASES if alias.startswith('shard_')] or ['default']
+
+# `manage.py test`: two sqlite databases the routing tests use as shards (override_settings(PLAYER_SHARDS=...)),
+# other tests keep the unsharded setup
+if sys.argv[1:2] == ['test']:
+    for number in (1, 2):
+        DATABASES[f'test_shard_{number}'] = {'ENGINE': 'django.db.backends.sqlite3',
+                                             'NAME': BASE_DIR / f'test_shard_{number}.sqlite3'}
+
+# Read replicas (of default): DB_REPLICAS is a comma separated list of hosts (host[:port]) for postgres
+# or of database files for sqlite (local testing, run `migrate --database replica_1`).
+for number, replica in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(",")), start=1):
+    replica_settings = copy.deepcopy(DATABASES['default'])
+    replica_settings['TEST'] = {'MIRROR': 'default'}
+    if os.getenv("DATABASE_TYPE") == "postgres":
+        host, _, port = replica.strip().partition(":")
+        replica_settings['HOST'] = host
+        replica_settings['PORT'] = port or replica_settings['PORT']
+    else:
+        replica_settings['NAME'] = replica.strip()
+    DATABASES[f'replica_{number}'] = replica_settings
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias.startswith('replica_')]
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 2))
+REPLICA_READ_YOUR_WRITES_WINDOW = int(os.getenv('REPLICA_READ_YOUR_WRITES_WINDOW', 10))
+
+DATABASE_ROUTERS = ['players.routers.PlayerShardRouter', 'players.routers.PrimaryReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -179,3 +250,123 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOWED_ORIGINS = os.getenv("CORS_ORIGINS").split(",")
 
 CSRF_TRUSTED_ORIGINS = os.getenv("CORS_ORIGINS").split(",")
+
+# Import-time budget of config.asgi in seconds, checked by `manage.py check_import_time`
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "1.5"))
+
+# Admission control per endpoint group (per worker process): concurrent requests, wait queue size,
+# seconds to wait for a slot and (write endpoints) requests in flight per player.
+ADMISSION_LIMITS = {
+    "export": {
+        "limit": int(os.getenv("ADMISSION_EXPORT_LIMIT", 1)),
+        "queue": int(os.getenv("ADMISSION_EXPORT_QUEUE", 2)),
+        "timeout": float(os.getenv("ADMISSION_EXPORT_TIMEOUT", 30)),
+    },
+    "write": {
+        "limit": int(os.getenv("ADMISSION_WRITE_LIMIT", 16)),
+        "queue": int(os.getenv("ADMISSION_WRITE_QUEUE", 64)),
+        "timeout": float(os.getenv("ADMISSION_WRITE_TIMEOUT", 5)),
+        "per_key": int(os.getenv("ADMISSION_WRITE_PER_PLAYER", 2)),
+    },
+}
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'players.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Profile and list responses built from values() rows (PlayerRowsSerializer) instead of serializer trees
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "1") == "1"
+
+# Transactional outbox, delivered by `manage.py dispatch_outbox`
+OUTBOX_SINKS = [{"class": "players.outbox.FileSink", "path": os.getenv("OUTBOX_FILE", os.path.join(BASE_DIR, "outbox.jsonl"))}]
+if os.getenv("OUTBOX_WEBHOOK_URL"):
+    OUTBOX_SINKS.append({"class": "players.outbox.WebhookSink", "url": os.getenv("OUTBOX_WEBHOOK_URL")})
+OUTBOX_SINKS.append({"class": "players.outbox.PushSink"})
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+# seconds a batch being sent is hidden from other dispatchers, longer than the sinks' timeouts
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", 60))
+
+# Archival of history (`manage.py archive_history`): completed PlayerLevel rows older than
+# ARCHIVE_PLAYER_LEVEL_DAYS that are not the player's latest level, and boosts that ended
+# ARCHIVE_BOOST_DAYS ago, are moved to archive tables in chunks.
+ARCHIVE_PLAYER_LEVEL_DAYS = int(os.getenv("ARCHIVE_PLAYER_LEVEL_DAYS", 30))
+ARCHIVE_BOOST_DAYS = int(os.getenv("ARCHIVE_BOOST_DAYS", 1))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", 1000))
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE", 0.1))
+
+# Optimistic concurrency of level up: attempts that lost the Player.version compare-and-swap are retried
+LEVEL_UP_RETRIES = int(os.getenv("LEVEL_UP_RETRIES", 3))
+
+# Idempotency-Key of level up / boost: stored results are replayed for IDEMPOTENCY_TTL_HOURS,
+# a key of a request that did not finish in IDEMPOTENCY_PENDING_TIMEOUT seconds can be reused.
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_PENDING_TIMEOUT = int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", 60))
+
+# Request profiling (players.middleware.ProfilingMiddleware): requests with a signed X-Profile header
+# (`manage.py profile_token`) or a PROFILE_SAMPLE_RATE fraction of all requests are sampled every
+# PROFILE_INTERVAL seconds, folded stacks for flamegraph tools are written to PROFILE_DIR.
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv("PROFILE_TOKEN_MAX_AGE", 3600))
+
+# Batch level up (POST /players/level_up/batch, `manage.py batch_level_up`)
+BATCH_LEVEL_UP_MAX = int(os.getenv("BATCH_LEVEL_UP_MAX", 10000))
+BATCH_LEVEL_UP_CHUNK = int(os.getenv("BATCH_LEVEL_UP_CHUNK", 500))
+
+# Player search ?by=contains (postgres with pg_trgm, index of migration 0007)
+SEARCH_TRIGRAM = os.getenv("SEARCH_TRIGRAM", "0") == "1"
+
+# `manage.py rebuild_player_stats`: players per transaction
+STATS_REBUILD_CHUNK = int(os.getenv("STATS_REBUILD_CHUNK", 1000))
+
+# Server-sent events of players (GET /players/player/<uuid>/events), fed by the outbox PushSink.
+# PostgresBus fans out to every worker with LISTEN/NOTIFY, FileBus through PUSH_FILE polled every PUSH_POLL seconds
+# (processes of one host), LocalBus only inside one process.
+PUSH_BUS = os.getenv("PUSH_BUS", "players.push.PostgresBus" if os.getenv("DATABASE_TYPE") == "postgres"
+                     else "players.push.FileBus")
+PUSH_FILE = os.getenv("PUSH_FILE", os.path.join(tempfile.gettempdir(), "players-push.jsonl"))
+PUSH_FILE_MAX_BYTES = int(os.getenv("PUSH_FILE_MAX_BYTES", 1024 * 1024))
+PUSH_POLL = float(os.getenv("PUSH_POLL", 0.2))
+PUSH_HEARTBEAT = float(os.getenv("PUSH_HEARTBEAT", 15))
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", 100))
+PUSH_MAX_CONNECTIONS = int(os.getenv("PUSH_MAX_CONNECTIONS", 1000))
+PUSH_REPLAY_LIMIT = int(os.getenv("PUSH_REPLAY_LIMIT", 100))
+
+# `manage.py expire_boosts`: sleeps until the next boost end_time, at most BOOST_EXPIRY_POLL seconds
+BOOST_EXPIRY_POLL = float(os.getenv("BOOST_EXPIRY_POLL", 5))
+BOOST_EXPIRY_BATCH = int(os.getenv("BOOST_EXPIRY_BATCH", 500))
+
+# Analytics rollups: rows per day/cohort the counters are spread over, longest report period
+ANALYTICS_SLOTS = int(os.getenv("ANALYTICS_SLOTS", 8))
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", 366))
+
+# Level funnel (GET /players/analytics/funnel, `manage.py level_funnel`): players per chunk, seconds a worker
+# keeps the result
+FUNNEL_CHUNK = int(os.getenv("FUNNEL_CHUNK", 5000))
+FUNNEL_CACHE_TTL = float(os.getenv("FUNNEL_CACHE_TTL", 600))
+
+# Rows per shard the players list version (ETag of GET /players/all) is spread over
+PLAYERS_LIST_SLOTS = int(os.getenv("PLAYERS_LIST_SLOTS", 8))
+
+# GET /players/by_ids: players per request (~37 bytes of the URL each)
+MULTI_GET_MAX = int(os.getenv("MULTI_GET_MAX", 200))
+
+# `manage.py reset_season`: players per transaction, fraction of time the job may keep a transaction open
+SEASON_RESET_CHUNK = int(os.getenv("SEASON_RESET_CHUNK", 500))
+SEASON_RESET_LOAD = float(os.getenv("SEASON_RESET_LOAD", 0.25))
+
+# Versions of cached catalog data (levels) shared by the workers, bumped when it changes.
+# PostgresInvalidationBus: CacheVersion table + NOTIFY; FileInvalidationBus: INVALIDATION_FILE polled
+# every INVALIDATION_POLL seconds (workers of one host).
+INVALIDATION_BUS = os.getenv("INVALIDATION_BUS", "players.invalidation.PostgresInvalidationBus"
+                             if os.getenv("DATABASE_TYPE") == "postgres"
+                             else "players.invalidation.FileInvalidationBus")
+INVALIDATION_FILE = os.getenv("INVALIDATION_FILE", os.path.join(tempfile.gettempdir(), "players-cache-versions.json"))
+INVALIDATION_POLL = float(os.getenv("INVALIDATION_POLL", 0.2))
@@ -1,17 +1,76 @@
 import multiprocessing
 import argparse
-import os
+import logging
+import subprocess
+import sys
+import time
 
 from gunicorn.app.wsgiapp import WSGIApplication
+from uvicorn.workers import UvicornWorker
+
+logger = logging.getLogger("gunicorn.error")
+
+START_TIME = time.monotonic()
 
 parser = argparse.ArgumentParser(description="Start DRF-Game server")
 
-parser.add_argument("--host", type=str,default='0.0.0.0', help="ip address.")
-parser.add_argument("--port", type=str,default="8000", help="port number.")
-parser.add_argument("--workers", type=int, default=1, help="Number of workers.")
+parser.add_argument("--host", type=str, default='0.0.0.0', help="ip address.")
+parser.add_argument("--port", type=str, default="8000", help="port number.")
+parser.add_argument("--workers", type=int, default=(multiprocessing.cpu_count() * 2) + 1,
+                    help="Number of workers (default cpu_count*2+1).")
+parser.add_argument("--preload", action="store_true", help="Load application before forking workers.")
+parser.add_argument("--max-requests", type=int, default=0,
+                    help="Restart worker after this many requests, 0 disables recycling.")
+parser.add_argument("--max-requests-jitter", type=int, default=0,
+                    help="Random jitter added to --max-requests so workers do not restart together.")
+parser.add_argument("--keep-alive", type=int, default=5, help="Seconds to hold idle keep-alive connections.")
+parser.add_argument("--backlog", type=int, default=2048, help="Maximum number of pending connections.")
+parser.add_argument("--timeout", type=int, default=30, help="Worker silent timeout in seconds.")
+parser.add_argument("--graceful-timeout", type=int, default=30,
+                    help="Seconds workers get to finish requests on restart/reload (SIGHUP).")
+parser.add_argument("--loop", type=str, default="auto", choices=["auto", "asyncio", "uvloop"],
+                    help="Event loop implementation.")
+parser.add_argument("--http", type=str, default="auto", choices=["auto", "h11", "httptools"],
+                    help="HTTP parser implementation.")
+parser.add_argument("--reload", action="store_true", help="Restart workers when code changes (development).")
+parser.add_argument("--skip-prestart", action="store_true", help="Do not run pre-start tasks.")
 
 args = parser.parse_args()
 
+
+def worker_class(loop: str, http: str) -> type:
+    """UvicornWorker with selected event loop and HTTP parser"""
+    return type("GameUvicornWorker", (UvicornWorker,), {
+        "CONFIG_KWARGS": {**UvicornWorker.CONFIG_KWARGS, "loop": loop, "http": http},
+    })
+
+
+def when_ready(server):
+    logger.info("Cold start took %.3fs", time.monotonic() - START_TIME)
+
+
+def on_reload(server):
+    server.app.reload_started = time.monotonic()
+    server.app.reload_spawned = 0
+
+
+def pre_fork(server, worker):
+    """Arbiter side: only the workers spawned by the reload are timed, later respawns (max-requests) are not"""
+    reload_started = getattr(server.app, "reload_started", None)
+    if reload_started is None:
+        return
+    worker.reload_started = reload_started
+    server.app.reload_spawned += 1
+    if server.app.reload_spawned >= server.num_workers:
+        server.app.reload_started = None
+
+
+def post_worker_init(worker):
+    reload_started = getattr(worker, "reload_started", None)
+    if reload_started:
+        logger.info("Worker %s restarted in %.3fs after reload", worker.pid, time.monotonic() - reload_started)
+
+
 class StandaloneApplication(WSGIApplication):
     def __init__(self, app_uri, options=None):
         self.options = options or {}
@@ -28,19 +87,38 @@ class StandaloneApplication(WSGIApplication):
             self.cfg.set(key.lower(), value)
 
 
+def prestart():
+    """Idempotent pre-start tasks, skipped inside the command when nothing changed"""
+    started = time.monotonic()
+    result = subprocess.run([sys.executable, "manage.py", "prestart"])
+    if result.returncode:
+        logger.error("Pre-start tasks failed with code %s", result.returncode)
+    logger.info("Pre-start tasks took %.3fs", time.monotonic() - started)
+
+
 def run():
+    application = StandaloneApplication("config.asgi:application", {
+        "bind": "%s:%s" % (args.host, args.port),
+        "workers": args.workers,
+        "worker_class": worker_class(args.loop, args.http),
+        "preload_app": args.preload,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests_jitter,
+        "keepalive": args.keep_alive,
+        "backlog": args.backlog,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "reload": args.reload,
+        "when_ready": when_ready,
+        "on_reload": on_reload,
+        "pre_fork": pre_fork,
+        "post_worker_init": post_worker_init,
+    })
+    application.run()
 
-    options = {
-            "bind": "%s:%s" % (args.host, args.port),
-            "workers": args.workers if args.workers == 1 else ((multiprocessing.cpu_count() * 2) + 1),
-            "worker_class": "uvicorn.workers.UvicornWorker",
-        }
-    StandaloneApplication("config.asgi:application", options).run()
 
 if __name__ == "__main__":
-    try:
-        os.system("python manage.py csu")
-        os.system("python manage.py collectstatic --no-input")
-    except Exception as e:
-        pass
+    logging.basicConfig(level=logging.INFO)
+    if not args.skip_prestart:
+        prestart()
     run()
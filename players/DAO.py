@@ -3,20 +3,87 @@ import collections
 import functools
 import logging
 
-from asyncio import AbstractEventLoop
+from asyncio import AbstractEventLoop, Future
+from contextvars import ContextVar
 from concurrent.futures.process import ProcessPoolExecutor
 from functools import partial
-from typing import Union, Optional, AsyncIterator, Callable, Any, List
+from typing import Union, Optional, AsyncIterator, Callable, Any, List, Dict, Tuple
 from asgiref.sync import sync_to_async
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from concurrent.futures import ThreadPoolExecutor
 from django.db.models.base import ModelBase, Model
+from django.db import connections, router
 from django.db.models import QuerySet
 from players.meta import StaticMethodMaker
 
 logger = logging.getLogger(__name__)
 
 
+class DataLoader:
+    """Request-scoped batching of primary key lookups.
+
+    All loads of one model issued in the same event-loop tick are fetched with a single
+    ``pk IN (...)`` query. Loaded rows (and misses) are kept in an identity map for the scope lifetime.
+    """
+
+    def __init__(self):
+        self._identity: Dict[Tuple[ModelBase, Any], Optional[Model]] = {}
+        self._pending: Dict[Tuple[ModelBase, str], Dict[Any, Future]] = {}
+        self._tasks = set()
+
+    async def load(self, model: ModelBase, pk: Any) -> Optional[Model]:
+        pk = model._meta.pk.to_python(pk)
+        if (model, pk) in self._identity:
+            return self._identity[(model, pk)]
+
+        # batches are per database, resolved in the caller's routing context (shard/replica)
+        batch_key = (model, router.db_for_read(model))
+        loop = asyncio.get_running_loop()
+        if batch_key not in self._pending:
+            self._pending[batch_key] = {}
+            loop.call_soon(self._dispatch, batch_key)
+        batch = self._pending[batch_key]
+        if pk not in batch:
+            batch[pk] = loop.create_future()
+        return await batch[pk]
+
+    def _dispatch(self, batch_key: Tuple[ModelBase, str]) -> None:
+        batch = self._pending.pop(batch_key)
+        task = asyncio.ensure_future(self._fetch(*batch_key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, model: ModelBase, alias: str, batch: Dict[Any, Future]) -> None:
+        try:
+            found = {obj.pk: obj async for obj in model._default_manager.using(alias).filter(pk__in=list(batch))}
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for pk, future in batch.items():
+            self._identity[(model, pk)] = found.get(pk)
+            if not future.done():
+                future.set_result(found.get(pk))
+
+
+current_loader: ContextVar[Optional[DataLoader]] = ContextVar("current_loader", default=None)
+
+
+def loader_scope(fun: Callable) -> Callable:
+    """Run coroutine function with its own DataLoader (e.g. inside a transaction)"""
+
+    @functools.wraps(fun)
+    async def wrapper(*args, **kwargs):
+        token = current_loader.set(DataLoader())
+        try:
+            return await fun(*args, **kwargs)
+        finally:
+            current_loader.reset(token)
+
+    return wrapper
+
+
 class AsyncDAO(metaclass=StaticMethodMaker):
 
     async def acreate(queryset: QuerySet, **data) -> Model:
@@ -36,6 +103,14 @@ class AsyncDAO(metaclass=StaticMethodMaker):
             assert len(pks) == 1, "More than one primary key field"
             key = dict([(search_field._meta.pk_fields[0].__dict__.get("name"), val)], )
 
+            # pk lookup on the plain manager - coalesce with other lookups of this tick
+            loader = current_loader.get()
+            if loader is not None and queryset is search_field._default_manager:
+                obj = await loader.load(search_field, val)
+                if obj is None and not ignore_logger:
+                    logger.error("Error players.DAO.AsyncDAO.get_one %s %s not found", search_field.__name__, val)
+                return obj
+
         try:
             return await queryset.aget(**key)
         except (ObjectDoesNotExist, MultipleObjectsReturned) as e:
@@ -69,7 +144,8 @@ class AsyncDAO(metaclass=StaticMethodMaker):
         return queryset.aiterator(chunk_size=chuck)
 
     async def aget_list(queryset: QuerySet) -> QuerySet:
-        return await sync_to_async(queryset.all)()
+        # querysets are lazy, building them needs no thread hop
+        return queryset.all()
 
     async def aget_filtered_list(queryset: QuerySet, search_field: Union[str, ModelBase] = None,
                                  val: str = None) -> QuerySet:
@@ -81,7 +157,7 @@ class AsyncDAO(metaclass=StaticMethodMaker):
             assert len(pks) == 1, "More than one primary key field"
             key = dict([(search_field._meta.pk_fields[0].__dict__.get("name"), val)], )
 
-        return await sync_to_async(queryset.filter)(**key)
+        return queryset.filter(**key)
 
     async def get_minimal(queryset: QuerySet, sort_field: str) -> QuerySet:
         obj = await queryset.order_by(sort_field).afirst()
@@ -109,7 +185,26 @@ class AsyncDAO(metaclass=StaticMethodMaker):
 
     async def aget_sorted(queryset: QuerySet,
                           order: Optional[str] = None) -> QuerySet:
-        return await sync_to_async(queryset.order_by, thread_sensitive=True)(order)
+        return queryset.order_by(order)
+
+    async def ascatter(func: Callable[[str], Any], aliases: List[str]) -> List[Any]:
+        """Run sync func(alias) for every database alias in parallel threads, results in aliases order"""
+
+        def call(alias: str) -> Any:
+            try:
+                return func(alias)
+            finally:
+                connections[alias].close()
+
+        if not aliases:
+            return []
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+            return await asyncio.gather(*[loop.run_in_executor(executor, call, alias) for alias in aliases])
+
+    async def ascatter_gather(queryset: QuerySet, aliases: List[str]) -> List[List[Model]]:
+        """Evaluate queryset on every database alias in parallel, one result list per alias"""
+        return await AsyncDAO.ascatter(lambda alias: list(queryset.using(alias)), aliases)
 
     def t_pool(func: Callable, *arg) -> Any:
         with ThreadPoolExecutor(max_workers=1) as executor:
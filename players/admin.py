@@ -1,33 +1,114 @@
+from uuid import UUID
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+
 from players.models import Player, Boost, PlayerLevel, Level, Prize, LevelPrize
+from players.routers import RouteState, current_route
+from players.services import PlayerSearchService
+
+
+class EstimatedCountPaginator(Paginator):
+    """Unfiltered postgres changelist counts from planner statistics instead of COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        return super().count
+
+
+class LimitedInlineFormSet(BaseInlineFormSet):
+    """Only the latest ``limit`` rows of the player"""
+    limit = 20
+
+    def get_queryset(self):
+        if not hasattr(self, "_limited_queryset"):
+            queryset = super().get_queryset()
+            latest = list(queryset.order_by("-pk").values_list("pk", flat=True)[:self.limit])
+            self._limited_queryset = queryset.filter(pk__in=latest).order_by("-pk")
+        return self._limited_queryset
 
 
 class BoostInline(admin.TabularInline):
     model = Boost
+    formset = LimitedInlineFormSet
+    extra = 0
 
 
 class LevelInline(admin.TabularInline):
     model = PlayerLevel
+    formset = LimitedInlineFormSet
+    extra = 0
+    raw_id_fields = ["level"]
+
+
+class ReplicaChangelistMixin:
+    """Changelist pages (GET) are read from replicas when configured"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "GET":
+            return super().changelist_view(request, extra_context)
+        token = current_route.set(RouteState(use_replica=True))
+        try:
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, "render"):
+                response.render()
+            return response
+        finally:
+            current_route.reset(token)
 
 
 @admin.register(Player)
-class PlayerAdmin(admin.ModelAdmin):
+class PlayerAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     list_display = ["player_id", "player_name", "last_entry"]
-    search_fields = ["player_id", "player_name", "last_entry"]
-    list_filter = ["player_id"]
+    search_fields = ["player_id", "player_name"]
+    search_help_text = "player_id, его начало или начало имени игрока"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [BoostInline, LevelInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        """player_id (or its prefix) or name prefix - index lookups, same as the search API"""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        try:
+            return queryset.filter(player_id=UUID(search_term)), False
+        except ValueError:
+            pass
+        names = PlayerSearchService.filter(queryset, "name", search_term)
+        try:
+            return names | PlayerSearchService.filter(queryset, "id", search_term), False
+        except ValueError:
+            return names, False
+
 
 @admin.register(Level)
 class LevelAdmin(admin.ModelAdmin):
-    pass
+    list_display = ["title", "order"]
+    search_fields = ["title"]
 
 
 @admin.register(Prize)
 class PrizeAdmin(admin.ModelAdmin):
-    pass
+    search_fields = ["title"]
 
 
 @admin.register(LevelPrize)
-class LevelPrizeAdmin(admin.ModelAdmin):
-    pass
+class LevelPrizeAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
+    list_display = ["level", "prize", "received"]
+    list_select_related = ["level", "prize"]
+    autocomplete_fields = ["level", "prize"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
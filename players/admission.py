@@ -0,0 +1,127 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Callable, Any, AsyncIterator
+from django.conf import settings
+from rest_framework.response import Response
+from rest_framework.status import HTTP_429_TOO_MANY_REQUESTS, HTTP_503_SERVICE_UNAVAILABLE
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, retry_after: int):
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Per-process concurrency limit with a bounded FIFO wait queue.
+
+    ``per_key`` caps in-flight + waiting requests of one key (player), so one player can't fill the queue.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float, per_key: Optional[int] = None):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.per_key = per_key
+        self._semaphore = asyncio.Semaphore(limit)
+        self._keys: Dict[Any, int] = defaultdict(int)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.avg_duration = 0.0  # EWMA, seconds
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_duration * (self.waiting + 1) / self.limit))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "queue": self.queue, "active": self.active, "waiting": self.waiting,
+                "admitted": self.admitted, "rejected": self.rejected, "timed_out": self.timed_out,
+                "avg_duration": round(self.avg_duration, 4), "keys": len(self._keys)}
+
+    def _release_key(self, key: Any) -> None:
+        self._keys[key] -= 1
+        if self._keys[key] <= 0:
+            del self._keys[key]
+
+    @asynccontextmanager
+    async def slot(self, key: Any = None) -> AsyncIterator[None]:
+        if key is not None and self.per_key and self._keys.get(key, 0) >= self.per_key:
+            self.rejected += 1
+            raise Rejected(HTTP_429_TOO_MANY_REQUESTS, self.retry_after())
+        if self._semaphore.locked() and self.waiting >= self.queue:
+            self.rejected += 1
+            raise Rejected(HTTP_503_SERVICE_UNAVAILABLE, self.retry_after())
+
+        if key is not None:
+            self._keys[key] += 1
+        acquired = False
+        try:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except TimeoutError:
+                self.timed_out += 1
+                raise Rejected(HTTP_503_SERVICE_UNAVAILABLE, self.retry_after())
+            finally:
+                self.waiting -= 1
+            acquired = True
+
+            self.active += 1
+            self.admitted += 1
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - started)
+                self.active -= 1
+        finally:
+            # also when the waiting request is cancelled (client disconnected)
+            if acquired:
+                self._semaphore.release()
+            if key is not None:
+                self._release_key(key)
+
+
+_limiters: Dict[str, ConcurrencyLimiter] = {}
+
+
+def get_limiter(name: str) -> ConcurrencyLimiter:
+    if name not in _limiters:
+        _limiters[name] = ConcurrencyLimiter(name, **settings.ADMISSION_LIMITS[name])
+    return _limiters[name]
+
+
+def limiters_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: get_limiter(name).stats() for name in settings.ADMISSION_LIMITS}
+
+
+def admission(name: str, per_player: bool = False) -> Callable:
+    """Limit concurrency of async view method by limiter ``name``.
+    Full queue answers 503, player over its share 429, both with Retry-After."""
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(self, request, *args, **kwargs):
+            limiter = get_limiter(name)
+            try:
+                async with limiter.slot(kwargs.get("pk") if per_player else None):
+                    return await method(self, request, *args, **kwargs)
+            except Rejected as e:
+                logger.warning("Admission %s rejected %s with %s", name, request.path, e.status)
+                return Response({False: "Сервис перегружен, повторите позже"}, status=e.status,
+                                headers={"Retry-After": str(e.retry_after)})
+
+        return wrapper
+
+    return decorator
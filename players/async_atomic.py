@@ -3,6 +3,7 @@ from django.db.transaction import Atomic
 from asgiref.sync import sync_to_async, async_to_sync
 from django.db import connections
 from asyncio import wrap_future
+from players.DAO import loader_scope
 
 
 class AsyncAtomicContextManager(Atomic):
@@ -29,12 +30,15 @@ class AsyncAtomicContextManager(Atomic):
 
 
 def aatomic(using=None, savepoint=True, durable=False):
-    """This decorator will run function in new atomic context. Which will be destroyed after function ends."""
+    """This decorator will run function in new atomic context. Which will be destroyed after function ends.
+    Function gets its own DataLoader, request identity map is not shared with the transaction.
+    ``using`` may be a callable taking the function arguments and returning database alias (player shard)."""
 
     def decorator(fun):
         async def wrapper(*args, **kwargs):
-            async with AsyncAtomicContextManager(using, savepoint, durable) as aacm:
-                future = wrap_future(aacm.executor.submit(async_to_sync(fun), *args, **kwargs))
+            alias = using(*args, **kwargs) if callable(using) else using
+            async with AsyncAtomicContextManager(alias, savepoint, durable) as aacm:
+                future = wrap_future(aacm.executor.submit(async_to_sync(loader_scope(fun)), *args, **kwargs))
                 await future
                 return future.result()
 
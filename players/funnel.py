@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+SCORE_BINS = 33  # bin k: scores 2**(k-1) .. 2**k - 1, bin 0: score 0
+MAX_DAYS = 365  # histogram of days between levels, longer times are counted in the last bin
+
+
+class FunnelAccumulator:
+    """Counters per Level.order in fixed size arrays, fed with chunks of PlayerLevel columns.
+
+    Rows of one player must not be split between chunks: time spent on a level is the difference
+    of the completion dates of the player's neighbour levels.
+    """
+
+    def __init__(self, orders: Iterable[int]):
+        self.orders = np.unique(np.fromiter(orders, dtype=np.int64))
+        size = len(self.orders)
+        self.players = 0
+        self.reached = np.zeros(size, np.int64)
+        self.completed = np.zeros(size, np.int64)
+        self.score_sum = np.zeros(size, np.float64)
+        self.scores = np.zeros((size, SCORE_BINS), np.int64)
+        self.days_sum = np.zeros(size, np.float64)
+        self.days = np.zeros((size, MAX_DAYS + 1), np.int64)
+
+    def _count(self, index: np.ndarray, bins: int) -> np.ndarray:
+        return np.bincount(index, minlength=len(self.orders) * bins).reshape(len(self.orders), bins)
+
+    def add(self, player_ids: Sequence, orders: Sequence[int], is_completed: Sequence[bool],
+            scores: Sequence[int], completed: Sequence) -> None:
+        if not len(orders) or not len(self.orders):
+            return
+        size = len(self.orders)
+        orders = np.asarray(orders, np.int64)
+        level = np.minimum(np.searchsorted(self.orders, orders), size - 1)
+        players = np.unique(np.asarray(player_ids, dtype=object), return_inverse=True)[1]
+        dates = np.asarray(completed, "datetime64[D]")
+        # rows of a player by level order, without levels created after the catalog was read
+        rows = np.lexsort((dates, orders, players))
+        rows = rows[self.orders[level[rows]] == orders[rows]]
+        if not len(rows):
+            return
+        players, level, dates = players[rows], level[rows], dates[rows]
+        done = np.asarray(is_completed, bool)[rows]
+        scores = np.asarray(scores, np.int64)[rows]
+
+        self.players += 1 + int(np.count_nonzero(players[1:] != players[:-1]))
+        self.reached += np.bincount(level, minlength=size)
+        self.completed += np.bincount(level[done], minlength=size)
+        self.score_sum += np.bincount(level[done], weights=scores[done], minlength=size)
+        score_bin = np.ceil(np.log2(scores[done] + 1)).astype(np.int64)
+        self.scores += self._count(level[done] * SCORE_BINS + score_bin, SCORE_BINS)
+
+        # completion date of the previous level is when the player started this one
+        pair = (players[1:] == players[:-1]) & done[1:] & done[:-1]
+        days = (dates[1:] - dates[:-1]).astype(np.int64)[pair]
+        pair_level = level[1:][pair]
+        self.days_sum += np.bincount(pair_level, weights=days, minlength=size)
+        self.days += self._count(pair_level * (MAX_DAYS + 1) + np.clip(days, 0, MAX_DAYS), MAX_DAYS + 1)
+
+    def merge(self, other: "FunnelAccumulator") -> "FunnelAccumulator":
+        for name in ("players", "reached", "completed", "score_sum", "scores", "days_sum", "days"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    @staticmethod
+    def quantile(histogram: np.ndarray, q: float) -> np.ndarray:
+        """Bin of the q-quantile of every histogram row, -1 for empty rows"""
+        cumulative = np.cumsum(histogram, axis=1)
+        total = cumulative[:, -1:]
+        return np.where(total[:, 0] > 0, np.argmax(cumulative >= q * total, axis=1), -1)
+
+    @staticmethod
+    def ratio(a: np.ndarray, b: np.ndarray) -> List[Optional[float]]:
+        return [round(float(x) / y, 4) if y else None for x, y in zip(a, b)]
+
+    @staticmethod
+    def bins(bins: np.ndarray, score: bool = False) -> List[Optional[int]]:
+        """Quantile bins as values: days, or the upper bound of a score bin"""
+        return [None if b < 0 else 2 ** b - 1 if score else b for b in bins.tolist()]
+
+    def result(self) -> Dict:
+        stuck = self.reached - self.completed
+        pairs = self.days.sum(axis=1)
+        start = np.full_like(self.reached, self.reached[0] if len(self.reached) else 0)
+        columns = {
+            "order": self.orders.tolist(),
+            "reached": self.reached.tolist(),
+            "completed": self.completed.tolist(),
+            "completion_rate": self.ratio(self.completed, self.reached),
+            "stuck": stuck.tolist(),
+            "drop_off_rate": self.ratio(stuck, self.reached),
+            "share_of_start": self.ratio(self.reached, start),
+            "score_mean": self.ratio(self.score_sum, self.completed),
+            "score_p50": self.bins(self.quantile(self.scores, 0.5), score=True),
+            "score_p90": self.bins(self.quantile(self.scores, 0.9), score=True),
+            "days_mean": self.ratio(self.days_sum, pairs),
+            "days_p50": self.bins(self.quantile(self.days, 0.5)),
+            "days_p90": self.bins(self.quantile(self.days, 0.9)),
+        }
+        histogram = self.scores.sum(axis=0)
+        return {
+            "computed_at": datetime.now().isoformat(timespec="seconds"),
+            "players": int(self.players),
+            "levels": [dict(zip(columns, values)) for values in zip(*columns.values())],
+            "score_histogram": [{"min": 2 ** (b - 1) if b else 0, "max": 2 ** b - 1, "count": int(histogram[b])}
+                                for b in np.flatnonzero(histogram).tolist()],
+        }
@@ -0,0 +1,58 @@
+import functools
+import hashlib
+import logging
+
+from typing import Callable
+from rest_framework.response import Response
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_409_CONFLICT, HTTP_422_UNPROCESSABLE_ENTITY
+
+from players.services import IdempotencyService
+
+logger = logging.getLogger(__name__)
+
+
+def idempotent(scope: str) -> Callable:
+    """Requests of a player's view method repeated with the same ``Idempotency-Key`` header get the stored
+    response without running the method again.
+
+    The key is claimed before the method runs, so a concurrent duplicate gets 409 instead of doing the work twice.
+    Failed requests (exception or 5xx) release the key, the client may retry with it.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get("Idempotency-Key")
+            if key is None:
+                return await method(self, request, *args, **kwargs)
+            if not 0 < len(key) <= 64:
+                return Response({False: "Idempotency-Key должен быть от 1 до 64 символов"},
+                                status=HTTP_400_BAD_REQUEST)
+
+            player_id = kwargs.get("pk")
+            fingerprint = hashlib.sha256(request.get_full_path().encode() + request.body).hexdigest()
+            record, created = await IdempotencyService.claim(player_id, scope, key, fingerprint)
+            if not created:
+                if record.fingerprint != fingerprint:
+                    return Response({False: "Idempotency-Key уже использован для другого запроса"},
+                                    status=HTTP_422_UNPROCESSABLE_ENTITY)
+                if record.status is None:
+                    return Response({False: "Запрос с этим Idempotency-Key еще выполняется"},
+                                    status=HTTP_409_CONFLICT, headers={"Retry-After": "1"})
+                logger.info("Replayed %s %s of %s", scope, key, player_id)
+                return Response(record.response, status=record.status, headers={"Idempotent-Replayed": "true"})
+
+            try:
+                response = await method(self, request, *args, **kwargs)
+            except BaseException:
+                await IdempotencyService.release(player_id, record)
+                raise
+            if response.status_code >= 500:
+                await IdempotencyService.release(player_id, record)
+            else:
+                await IdempotencyService.complete(player_id, record, response.status_code, response.data)
+            return response
+
+        return wrapper
+
+    return decorator
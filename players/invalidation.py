@@ -0,0 +1,210 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Callable, Any, Tuple, Sequence
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from players.push import listen_kwargs
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus(ABC):
+    """Versions of cache keys shared by all workers: invalidate(key) increments the version everywhere.
+
+    A worker that may have missed invalidations (listener not running) has no versions - version() is None
+    and caches are bypassed instead of serving stale values.
+    """
+
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+        self.ready = False
+        self._started = False
+        self._lock = threading.Lock()
+
+    def version(self, key: str) -> Optional[int]:
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    threading.Thread(target=self.listen, name="invalidation-bus", daemon=True).start()
+                    self._started = True
+        if not self.ready:
+            return None
+        return self.versions.get(key, 0)
+
+    def versioned_key(self, key: str) -> Optional[str]:
+        """``key:version`` for shared caches, None - don't cache"""
+        version = self.version(key)
+        return None if version is None else f"{key}:{version}"
+
+    def update(self, key: str, version: int) -> None:
+        if version > self.versions.get(key, 0):
+            self.versions[key] = version
+
+    @abstractmethod
+    def invalidate(self, key: str) -> None:
+        """Increment the version of ``key`` for every worker"""
+
+    @abstractmethod
+    def listen(self) -> None:
+        """Keep ``versions`` up to date, runs forever in a daemon thread; sets ``ready``"""
+
+
+class PostgresInvalidationBus(InvalidationBus):
+    """Versions in the CacheVersion table of the default database, broadcast with NOTIFY.
+    The listener reloads all versions after every (re)connect, so nothing missed while disconnected stays."""
+    channel = "cache_invalidation"
+
+    @staticmethod
+    def table() -> str:
+        from players.models import CacheVersion
+
+        return CacheVersion._meta.db_table
+
+    def invalidate(self, key: str) -> None:
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table()} (key, version) VALUES (%s, 1) "
+                           f"ON CONFLICT (key) DO UPDATE SET version = {self.table()}.version + 1 RETURNING version",
+                           [key])
+            version = cursor.fetchone()[0]
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, json.dumps({"key": key, "version": version})])
+        self.update(key, version)
+
+    def listen(self) -> None:
+        import psycopg
+
+        while True:
+            try:
+                with psycopg.connect(**listen_kwargs(), autocommit=True) as connection:
+                    connection.execute(f"LISTEN {self.channel}")
+                    for key, version in connection.execute(f"SELECT key, version FROM {self.table()}"):
+                        self.update(key, version)
+                    self.ready = True
+                    for notify in connection.notifies():
+                        message = json.loads(notify.payload)
+                        self.update(message["key"], message["version"])
+            except Exception:
+                logger.warning("LISTEN %s failed, caches are bypassed until reconnect", self.channel, exc_info=True)
+            self.ready = False
+            time.sleep(1)
+
+
+class FileInvalidationBus(InvalidationBus):
+    """Local stand-in: versions in a JSON file shared by the workers of one host (INVALIDATION_FILE),
+    written under flock, re-read by every worker when its mtime changes"""
+
+    def __init__(self, path: Optional[str] = None):
+        super().__init__()
+        self.path = path or settings.INVALIDATION_FILE
+
+    def _read(self, f) -> Dict[str, int]:
+        f.seek(0)
+        content = f.read()
+        return json.loads(content) if content else {}
+
+    def invalidate(self, key: str) -> None:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            versions = self._read(f)
+            versions[key] = versions.get(key, 0) + 1
+            f.seek(0)
+            f.truncate()
+            json.dump(versions, f)
+            f.flush()
+        self.update(key, versions[key])
+
+    def listen(self) -> None:
+        seen = None
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else 0
+                if mtime != seen:
+                    if mtime:
+                        with open(self.path) as f:
+                            fcntl.flock(f, fcntl.LOCK_SH)
+                            for key, version in self._read(f).items():
+                                self.update(key, version)
+                    seen = mtime
+                self.ready = True
+            except (OSError, ValueError):
+                logger.warning("Can't read %s, caches are bypassed", self.path, exc_info=True)
+                self.ready = False
+            time.sleep(settings.INVALIDATION_POLL)
+
+
+_bus: Optional[InvalidationBus] = None
+
+
+def get_bus() -> InvalidationBus:
+    global _bus
+    if _bus is None:
+        _bus = import_string(settings.INVALIDATION_BUS)()
+    return _bus
+
+
+def invalidate_on_commit(key: str, using: str = DEFAULT_DB_ALIAS) -> None:
+    """Invalidate after the transaction of the change commits - a worker must not cache the old data
+    under the new version"""
+    transaction.on_commit(lambda: get_bus().invalidate(key), using=using)
+
+
+class VersionedCache:
+    """Per-process values computed once per version of their key.
+
+    ``depends_on`` - bus keys whose versions invalidate the value (default: the key itself),
+    ``max_age`` - seconds after which the value is recomputed anyway (data changing too often to invalidate).
+    """
+
+    _missing = object()
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Tuple[int, ...], float, Any]] = {}
+
+    def _get(self, key: str, depends_on: Optional[Sequence[str]], max_age: Optional[float]
+             ) -> Tuple[Optional[Tuple[int, ...]], Any]:
+        # versions are taken before computing: an invalidation meanwhile makes the stored value outdated
+        versions = tuple(get_bus().version(name) for name in depends_on or (key,))
+        if None in versions:
+            return None, self._missing
+        cached = self._values.get(key)
+        if (cached is not None and cached[0] == versions
+                and (max_age is None or time.monotonic() - cached[1] < max_age)):
+            return versions, cached[2]
+        return versions, self._missing
+
+    def _set(self, key: str, versions: Optional[Tuple[int, ...]], value: Any) -> Any:
+        if versions is not None:
+            self._values[key] = (versions, time.monotonic(), value)
+        return value
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], depends_on: Optional[Sequence[str]] = None,
+                   max_age: Optional[float] = None) -> Any:
+        versions, value = self._get(key, depends_on, max_age)
+        if value is self._missing:
+            value = self._set(key, versions, compute())
+        return value
+
+    async def aget_or_set(self, key: str, compute: Callable[[], Any], depends_on: Optional[Sequence[str]] = None,
+                          max_age: Optional[float] = None) -> Any:
+        """get_or_set for async code: a hit doesn't leave the event loop, ``compute`` runs in a thread
+        or is awaited when it is a coroutine function"""
+        versions, value = self._get(key, depends_on, max_age)
+        if value is self._missing:
+            if asyncio.iscoroutinefunction(compute):
+                value = await compute()
+            else:
+                value = await sync_to_async(compute)()
+            value = self._set(key, versions, value)
+        return value
+
+
+cache = VersionedCache()
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from players.services import ArchiveService
+
+
+class Command(BaseCommand):
+    help = ("Move old completed player levels and expired boosts of every player shard to archive tables. "
+            "Works in small keyset chunks, so it can be stopped and restarted at any time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--skip-levels", action="store_true", help="Do not archive player levels.")
+        parser.add_argument("--skip-boosts", action="store_true", help="Do not archive boosts.")
+
+    def handle(self, *args, **options):
+        jobs = []
+        if not options["skip_levels"]:
+            jobs.append(("player levels", ArchiveService.archive_player_levels_chunk))
+        if not options["skip_boosts"]:
+            jobs.append(("boosts", ArchiveService.archive_boosts_chunk))
+
+        for alias in settings.PLAYER_SHARDS:
+            for name, archive_chunk in jobs:
+                after_id, total = 0, 0
+                while True:
+                    after_id, archived = archive_chunk(alias, after_id)
+                    if after_id is None:
+                        break
+                    total += archived
+                    time.sleep(settings.ARCHIVE_PAUSE)
+                self.stdout.write(f"{alias}: archived {total} {name}")
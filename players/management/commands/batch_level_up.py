@@ -0,0 +1,29 @@
+import asyncio
+import csv
+import json
+import sys
+
+from uuid import UUID
+from django.core.management import BaseCommand
+
+from players.services import BatchLevelUpService
+
+
+class Command(BaseCommand):
+    help = "Level up players from a CSV file with lines `player_id` or `player_id,score` (tournament results)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file, '-' for stdin.")
+
+    def handle(self, *args, **options):
+        if options["path"] == "-":
+            rows = list(csv.reader(sys.stdin))
+        else:
+            with open(options["path"], newline="") as f:
+                rows = list(csv.reader(f))
+        items = [(UUID(row[0]), int(row[1]) if len(row) > 1 and row[1] else None) for row in rows if row]
+
+        results = asyncio.run(BatchLevelUpService.level_up_many(items))
+        for result in results:
+            self.stdout.write(json.dumps(result, ensure_ascii=False))
+        self.stderr.write(f"Leveled up {sum(r['result'] for r in results)} of {len(results)} players")
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Measure import time of config.asgi in a fresh interpreter and fail when over IMPORT_TIME_BUDGET"
+
+    module = "config.asgi"
+    # URLconf is resolved too: workers import views/serializers/services before the first request
+    script = ("import time; started = time.perf_counter(); import {module}; "
+              "from django.urls import get_resolver; get_resolver().url_patterns; "
+              "print(time.perf_counter() - started)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--budget", type=float, default=None, help="Budget in seconds, overrides settings.")
+        parser.add_argument("--top", type=int, default=10, help="Show N slowest modules by self time.")
+
+    def handle(self, *args, **options):
+        budget = options["budget"] if options["budget"] is not None else settings.IMPORT_TIME_BUDGET
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", self.script.format(module=self.module)],
+                              capture_output=True, text=True)
+        if proc.returncode:
+            raise CommandError(f"Can't import {self.module}:\n{proc.stderr}")
+
+        # строки вида "import time:   self [us] | cumulative | imported package"
+        modules = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, _, name = line[len("import time:"):].split("|")
+            modules.append((int(self_us), name.strip()))
+
+        total = float(proc.stdout.strip().splitlines()[-1])
+        for self_us, name in sorted(modules, reverse=True)[:options["top"]]:
+            self.stdout.write(f"{self_us / 1000:9.1f} ms  {name}")
+        self.stdout.write(f"{self.module} imported in {total:.3f}s (budget {budget:.3f}s)")
+
+        if total > budget:
+            raise CommandError(f"{self.module} import time {total:.3f}s is over budget {budget:.3f}s")
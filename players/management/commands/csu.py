@@ -4,7 +4,12 @@ from django.contrib.auth.models import User
 
 
 class Command(BaseCommand):
+    help = "Create default admin superuser if it does not exist"
+
     def handle(self, *args, **options):
+        if User.objects.filter(username="admin").exists():
+            self.stdout.write("Superuser admin already exists, skipped")
+            return
         user = User.objects.create(
             username="admin",
             email='admin@test.com',
@@ -14,4 +19,4 @@ class Command(BaseCommand):
 
         )
         user.set_password('12345')
-        user.save()
\ No newline at end of file
+        user.save()
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from players.outbox import OutboxDispatcher, get_sinks
+from players.services import IdempotencyService
+
+
+class Command(BaseCommand):
+    help = ("Deliver outbox events (level up, boosts, rewards) of every player shard to the configured sinks. "
+            "Hourly removes delivered events and expired Idempotency-Key records.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Dispatch pending events and exit.")
+
+    def handle(self, *args, **options):
+        dispatcher = OutboxDispatcher(get_sinks(), settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_MAX_ATTEMPTS,
+                                      settings.OUTBOX_LEASE)
+        last_purge = 0.0
+        while True:
+            sent = sum(dispatcher.dispatch(alias) for alias in settings.PLAYER_SHARDS)
+            if sent:
+                self.stdout.write(f"Dispatched {sent} events")
+
+            if time.monotonic() - last_purge > 3600:
+                for alias in settings.PLAYER_SHARDS:
+                    dispatcher.purge(alias, settings.OUTBOX_RETENTION_DAYS)
+                    IdempotencyService.purge(alias)
+                last_purge = time.monotonic()
+
+            if options["once"]:
+                if sent:
+                    continue
+                return
+            if sent < settings.OUTBOX_BATCH_SIZE:
+                time.sleep(settings.OUTBOX_POLL_INTERVAL)
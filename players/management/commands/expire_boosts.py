@@ -0,0 +1,35 @@
+import time
+
+from datetime import datetime
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from players.services import BoostService
+
+
+class Command(BaseCommand):
+    help = ("Deactivate boosts of every player shard when their end_time comes, with boost_expired outbox events. "
+            "Sleeps until the next end_time (at most BOOST_EXPIRY_POLL seconds).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Expire due boosts and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            expired, next_ends = 0, []
+            for alias in settings.PLAYER_SHARDS:
+                count, next_end = BoostService.expire_due_boosts(alias)
+                expired += count
+                if next_end is not None:
+                    next_ends.append(next_end)
+            if expired:
+                self.stdout.write(f"Expired {expired} boosts")
+
+            if expired >= settings.BOOST_EXPIRY_BATCH:
+                continue
+            if options["once"]:
+                return
+            sleep = settings.BOOST_EXPIRY_POLL
+            if next_ends:
+                sleep = min(sleep, max((min(next_ends) - datetime.now()).total_seconds(), 0.05))
+            time.sleep(sleep)
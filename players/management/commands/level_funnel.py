@@ -0,0 +1,14 @@
+import asyncio
+import json
+
+from django.core.management import BaseCommand
+
+from players.services import FunnelService
+
+
+class Command(BaseCommand):
+    help = ("Level funnel of the current season as JSON: completion and drop-off per level order, "
+            "score distribution and days between levels")
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(asyncio.run(FunnelService.compute()), ensure_ascii=False, indent=2))
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import BaseCommand, call_command
+
+
+class Command(BaseCommand):
+    help = ("Idempotent pre-start tasks: admin superuser, collectstatic (skipped when static sources unchanged) "
+            "and the import-time budget check")
+
+    fingerprint_name = ".static-fingerprint"
+
+    @staticmethod
+    def static_fingerprint() -> str:
+        """Hash of paths, sizes and mtimes of all static sources"""
+        digest = hashlib.sha256()
+        entries = []
+        for finder in get_finders():
+            for path, storage in finder.list([]):
+                stat = os.stat(storage.path(path))
+                entries.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        for entry in sorted(entries):
+            digest.update(entry.encode())
+        return digest.hexdigest()
+
+    def handle(self, *args, **options):
+        call_command("csu")
+        self.collect_static()
+        call_command("check_import_time")
+
+    def collect_static(self):
+        fingerprint_path = os.path.join(settings.STATIC_ROOT, self.fingerprint_name)
+        fingerprint = self.static_fingerprint()
+        try:
+            with open(fingerprint_path) as f:
+                if f.read() == fingerprint:
+                    self.stdout.write("Static files unchanged, collectstatic skipped")
+                    return
+        except FileNotFoundError:
+            pass
+
+        call_command("collectstatic", interactive=False, verbosity=0)
+        with open(fingerprint_path, "w") as f:
+            f.write(fingerprint)
@@ -0,0 +1,10 @@
+from django.core.management import BaseCommand
+
+from players.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed X-Profile header value that enables profiling of a request"
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
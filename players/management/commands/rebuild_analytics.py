@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+
+from players.services import AnalyticsService
+
+
+class Command(BaseCommand):
+    help = ("Recount analytics rollups (new/active players per day, retention cohorts) from the visits "
+            "and first entries of every player shard. The current day is kept: it is still counted on logins.")
+
+    def handle(self, *args, **options):
+        days, cohorts = AnalyticsService.rebuild()
+        self.stdout.write(f"Rebuilt {days} days and {cohorts} cohort days")
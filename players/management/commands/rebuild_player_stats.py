@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from players.services import PlayerStatsService
+
+
+class Command(BaseCommand):
+    help = ("Recount PlayerStats of every player of every shard from levels, boosts, archives and rewards. "
+            "Run after the stats migration or to repair drift; boosts deleted without an end time are not counted.")
+
+    def handle(self, *args, **options):
+        for alias in settings.PLAYER_SHARDS:
+            after_pk, total = None, 0
+            while True:
+                after_pk, rebuilt = PlayerStatsService.rebuild_chunk(alias, after_pk)
+                if after_pk is None:
+                    break
+                total += rebuilt
+            self.stdout.write(f"{alias}: rebuilt stats of {total} players")
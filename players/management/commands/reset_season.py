@@ -0,0 +1,56 @@
+import time
+
+from functools import partial
+from typing import Callable, Optional
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from players.invalidation import get_bus
+from players.routers import PrimaryReplicaRouter
+from players.services import SeasonService
+
+
+class Command(BaseCommand):
+    help = ("Finish a season on every player shard: snapshot the standings of all shards to SeasonStanding, "
+            "then reset scores, archive levels and boosts and start every player at the minimal level. Both passes "
+            "work in short keyset chunks throttled to SEASON_RESET_LOAD; run it again with the same season "
+            "to continue after an interruption.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("season", help="Name of the finished season, e.g. 2026-autumn.")
+
+    def wait_for_replicas(self) -> None:
+        while any(PrimaryReplicaRouter.replica_lag(alias) > settings.REPLICA_MAX_LAG
+                  for alias in settings.REPLICA_DATABASES):
+            self.stdout.write("replicas lag behind, waiting")
+            time.sleep(settings.REPLICA_LAG_CHECK_INTERVAL)
+
+    def handle(self, *args, **options):
+        season = options["season"]
+        levels = {}
+        for alias in settings.PLAYER_SHARDS:
+            levels[alias] = SeasonService.first_level(alias)
+            if levels[alias] is None:
+                raise CommandError(f"{alias}: the Level table is empty")
+
+        # standings of every shard are complete before any player is reset
+        for alias in settings.PLAYER_SHARDS:
+            total = self.run_chunks(partial(SeasonService.snapshot_chunk, alias, season))
+            self.stdout.write(f"{alias}: standings of season {season} saved for {total} players")
+        for alias in settings.PLAYER_SHARDS:
+            total = self.run_chunks(partial(SeasonService.reset_chunk, alias, season, levels[alias]))
+            self.stdout.write(f"{alias}: season {season} reset for {total} players")
+        # cached season data of the workers (level funnel)
+        get_bus().invalidate("season")
+
+    def run_chunks(self, chunk: Callable[[], Optional[int]]) -> int:
+        """Players processed by the remaining chunks of a pass, throttled and waiting for the replicas"""
+        total = 0
+        while True:
+            self.wait_for_replicas()
+            started = time.monotonic()
+            done = chunk()
+            if done is None:
+                return total
+            total += done
+            time.sleep(SeasonService.throttle(time.monotonic() - started))
@@ -0,0 +1,91 @@
+import logging
+import time
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+from players import profiling
+from players.DAO import DataLoader, current_loader
+from players.routers import RouteState, current_route
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware:
+    """Samples stacks of all threads while a request runs, when asked by a signed ``X-Profile`` header
+    (``manage.py profile_token``) or for PROFILE_SAMPLE_RATE of requests. The flamegraph-ready profile is
+    written to PROFILE_DIR, its name is returned in the ``X-Profile`` response header.
+    Off it costs one header lookup."""
+    async_capable = True
+    sync_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        markcoroutinefunction(self)
+
+    async def __call__(self, request):
+        if not profiling.should_profile(request):
+            return await self.get_response(request)
+        sampler = profiling.start_profile()
+        if sampler is None:
+            return await self.get_response(request)
+
+        started = time.monotonic()
+        try:
+            response = await self.get_response(request)
+        finally:
+            name = await sync_to_async(profiling.finish_profile, thread_sensitive=False)(
+                sampler, request.method, request.path, time.monotonic() - started)
+            logger.info("Profile of %s %s written to %s", request.method, request.path, name)
+        response["X-Profile"] = name
+        return response
+
+
+class DataLoaderMiddleware:
+    """New DataLoader (batching + identity map for AsyncDAO.aget_one) for every request"""
+    async_capable = True
+    sync_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        markcoroutinefunction(self)
+
+    async def __call__(self, request):
+        token = current_loader.set(DataLoader())
+        try:
+            return await self.get_response(request)
+        finally:
+            current_loader.reset(token)
+
+
+class ReplicaRoutingMiddleware:
+    """Safe requests to views with ``read_replica = True`` read from replicas.
+    A request that wrote pins the client to the primary for REPLICA_READ_YOUR_WRITES_WINDOW seconds (cookie)."""
+    async_capable = True
+    sync_capable = False
+
+    cookie_name = "db_primary"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        markcoroutinefunction(self)
+
+    async def __call__(self, request):
+        state = RouteState()
+        token = current_route.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_route.reset(token)
+        if state.wrote and settings.REPLICA_DATABASES:
+            response.set_cookie(self.cookie_name, "1", max_age=settings.REPLICA_READ_YOUR_WRITES_WINDOW)
+        return response
+
+    async def process_view(self, request, view_func, view_args, view_kwargs):
+        state = current_route.get()
+        view_class = getattr(view_func, "view_class", None)
+        if (state is not None and request.method in SAFE_METHODS
+                and getattr(view_class, "read_replica", False)
+                and self.cookie_name not in request.COOKIES):
+            state.use_replica = True
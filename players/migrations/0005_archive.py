@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0004_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoostArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('boost_id', models.BigIntegerField()),
+                ('player_id', models.UUIDField(db_index=True)),
+                ('title', models.CharField(max_length=30)),
+                ('description', models.CharField(max_length=30, null=True)),
+                ('active', models.BooleanField(default=False)),
+                ('get_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(null=True)),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayerLevelArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player_level_id', models.BigIntegerField()),
+                ('player_id', models.UUIDField(db_index=True)),
+                ('level_id', models.BigIntegerField()),
+                ('level_title', models.CharField(max_length=100)),
+                ('level_order', models.IntegerField()),
+                ('completed', models.DateField()),
+                ('is_completed', models.BooleanField(default=True)),
+                ('score', models.PositiveIntegerField(default=0)),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
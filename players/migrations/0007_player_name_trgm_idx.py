@@ -0,0 +1,35 @@
+import logging
+
+from django.db import migrations, transaction, DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+def create_trigram_index(apps, schema_editor):
+    """Postgres only, skipped when pg_trgm can't be installed (search ?by=contains stays unavailable)"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            schema_editor.execute(
+                'CREATE INDEX IF NOT EXISTS player_name_trgm_idx ON "players_player" '
+                'USING gin ((UPPER("player_name"::text)) gin_trgm_ops)')
+    except DatabaseError:
+        logger.warning("pg_trgm is not available, player_name_trgm_idx is not created", exc_info=True)
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS player_name_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0006_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,22 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0007_player_name_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='players.player')),
+                ('levels_completed', models.PositiveIntegerField(default=0)),
+                ('prizes_received', models.PositiveIntegerField(default=0)),
+                ('max_level_order', models.IntegerField(default=0)),
+                ('boosts_granted', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
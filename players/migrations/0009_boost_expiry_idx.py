@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0008_playerstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='boost',
+            index=models.Index(condition=models.Q(('active', True)), fields=['end_time'], name='boost_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+
+def backfill_first_entry(apps, schema_editor):
+    """last_entry was only set once, at the first entry"""
+    Player = apps.get_model("players", "Player")
+    Player.objects.using(schema_editor.connection.alias).update(first_entry=models.F("last_entry"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0009_boost_expiry_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='first_entry',
+            field=models.DateField(default=None, null=True, verbose_name='первый вход'),
+        ),
+        migrations.RunPython(backfill_first_entry, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='PlayerVisit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player_id', models.UUIDField()),
+                ('day', models.DateField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('player_id', 'day'), name='player_visit_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('new_players', models.PositiveIntegerField(default=0)),
+                ('active_players', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'slot'), name='daily_activity_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RetentionCohort',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.DateField()),
+                ('day', models.DateField()),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('active_players', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cohort', 'day', 'slot'), name='retention_cohort_unique')],
+            },
+        ),
+    ]
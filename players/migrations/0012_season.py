@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0011_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeasonStanding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('season', models.CharField(max_length=50)),
+                ('player_id', models.UUIDField()),
+                ('player_name', models.CharField(max_length=20)),
+                ('player_score', models.BigIntegerField(default=0)),
+                ('level_order', models.IntegerField(default=None, null=True)),
+                ('levels_completed', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('season', 'player_id'), name='season_standing_unique')],
+                'indexes': [models.Index(fields=['season', '-player_score'], name='season_standing_score_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SeasonReset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('season', models.CharField(max_length=50, unique=True)),
+                ('after_pk', models.UUIDField(default=None, null=True)),
+                ('players', models.PositiveIntegerField(default=0)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(default=None, null=True)),
+            ],
+        ),
+    ]
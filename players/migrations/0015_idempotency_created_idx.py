@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0014_remove_player_name_prefix_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='idempotencyrecord',
+            index=models.Index(fields=['created'], name='idempotency_created_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0015_idempotency_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seasonreset',
+            name='snapshot_after_pk',
+            field=models.UUIDField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='seasonreset',
+            name='snapshotted',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
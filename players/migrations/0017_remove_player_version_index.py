@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0016_season_reset_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='version',
+            field=models.BigIntegerField(default=0, verbose_name='Версия'),
+        ),
+    ]
@@ -1,51 +1,138 @@
+import random
+
 from datetime import timedelta, datetime
 
 from asgiref.sync import sync_to_async
-from django.db import models
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import F, QuerySet, Value
+from django.db.models.functions import Greatest
+
+from players.routers import shard_for
 
 
 class Player(models.Model):
     player_id = models.UUIDField(auto_created=True, max_length=100, primary_key=True, db_index=True)
     player_name = models.CharField(max_length=20, unique=True, verbose_name="Имя игрока", default="anonymous")
     last_entry = models.DateField(verbose_name="последний вход", auto_now_add=True, null=True)
+    first_entry = models.DateField(verbose_name="первый вход", default=None, null=True)
     last_boost_date = models.DateField(verbose_name="последний буст", default=None, null=True)
     player_score = models.BigIntegerField(default=0)
     rewarded = models.JSONField(verbose_name="Награды", default=dict)
+    version = models.BigIntegerField(verbose_name="Версия", default=0)
 
     @property
     async def check_boosts(self):
+        changed = False
         boosts = await sync_to_async(self.boosts.all)()
         async for boost in boosts:
             if boost.end_time:
                 if boost.end_time <= datetime.now():
+                    if boost.active:
+                        # not yet expired by `manage.py expire_boosts`
+                        await OutboxEvent.objects.using(self.write_db).acreate(
+                            player_id=self.pk, event_type="boost_expired", payload=boost.expired_payload())
                     boost.active = False
                     await boost.asave()
+                    changed = True
             else:
                 await boost.adelete()
+                changed = True
+        if changed:
+            await self.abump_version()
         return True
 
     @property
     async def remove_inactive(self):
-        boosts = await sync_to_async(self.boosts.all)()
-        async for boost in boosts:
-            if boost.active is False:
-                await boost.adelete()
+        """Inactive boosts are moved to BoostArchive in one transaction on the player's shard/primary,
+        a cheap EXISTS skips the transaction when there are none"""
+        inactive = Boost.objects.using(shard_for(self.pk)).filter(player_id=self.pk, active=False)
+        if await inactive.aexists() and await sync_to_async(BoostArchive.archive)(inactive):
+            self.version += 1  # bumped in the database by archive
         return True
 
+    def save(self, *args, **kwargs):
+        """version is only incremented in the database (ETag), in the same UPDATE as the fields:
+        a stale in-memory value never overwrites it. Explicit update_fields don't bump it."""
+        if self._state.adding or kwargs.get("force_insert") or kwargs.get("update_fields") is not None:
+            return super().save(*args, **kwargs)
+        kwargs["update_fields"] = [f.name for f in self._meta.concrete_fields if not f.primary_key]
+        kwargs.setdefault("using", self.write_db)
+        version, self.version = self.version, F("version") + 1
+        try:
+            super().save(*args, **kwargs)
+        except BaseException:
+            self.version = version
+            raise
+        self.version = version + 1
+        PlayersListVersion.bump(kwargs["using"])
+
+    @property
+    def write_db(self) -> str:
+        """Alias of writes of the player: its shard or the primary, never the replica it was read from"""
+        return router.db_for_write(Player, instance=self)
+
+    def bump_version(self):
+        Player.objects.using(self.write_db).filter(pk=self.pk).update(version=F("version") + 1)
+        PlayersListVersion.bump(self.write_db)
+        self.version += 1
+
+    async def acompare_and_bump_version(self) -> bool:
+        """Optimistic lock: bump version only if it is still the one that was read"""
+        updated = await Player.objects.using(self.write_db).filter(pk=self.pk, version=self.version).aupdate(
+            version=F("version") + 1)
+        if updated:
+            await PlayersListVersion.abump(self.write_db)
+            self.version += 1
+        return bool(updated)
+
+    async def abump_version(self):
+        """Changes of boosts and levels that don't save the player"""
+        await Player.objects.using(self.write_db).filter(pk=self.pk).aupdate(version=F("version") + 1)
+        await PlayersListVersion.abump(self.write_db)
+        self.version += 1
+
     def __str__(self):
         return self.player_name
 
-    async def set_rewards(self, rewards):
-        self.rewarded["rewards"] = self.rewarded.get("rewards", []) + [rewards]
+    def add_rewards(self, *rewards):
+        """Append to the rewards in memory, saved with the next save of the player"""
+        self.rewarded["rewards"] = self.rewarded.get("rewards", []) + list(rewards)
+
+    async def set_rewards(self, *rewards):
+        self.add_rewards(*rewards)
         await self.asave()
         return True
 
     class Meta:
+        # LIKE 'prefix%' on postgres uses the varchar_pattern_ops "_like" index Django creates for unique player_name
         ordering = ['player_id']
         verbose_name = "Игрок"
         verbose_name_plural = "Игроки"
 
 
+class PlayersListVersion(models.Model):
+    """Version of the players list (ETag of GET /players/all), bumped with every write that bumps Player.version
+    and on insert/delete of players. Every shard keeps its own rows, spread over PLAYERS_LIST_SLOTS slots
+    so concurrent writers rarely wait on one row; the list version is the sum."""
+    slot = models.PositiveSmallIntegerField(primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls, using: str) -> None:
+        slot = random.randrange(settings.PLAYERS_LIST_SLOTS)
+        if not cls.objects.using(using).filter(slot=slot).update(version=F("version") + 1):
+            with transaction.atomic(using=using):
+                cls.objects.using(using).get_or_create(slot=slot)
+                cls.objects.using(using).filter(slot=slot).update(version=F("version") + 1)
+
+    @classmethod
+    async def abump(cls, using: str) -> None:
+        slot = random.randrange(settings.PLAYERS_LIST_SLOTS)
+        if not await cls.objects.using(using).filter(slot=slot).aupdate(version=F("version") + 1):
+            await sync_to_async(cls.bump)(using)
+
+
 class Boost(models.Model):
     player = models.ForeignKey(Player, on_delete=models.CASCADE, verbose_name="усилитель", related_name="boosts",
                                null=True)
@@ -68,9 +155,18 @@ class Boost(models.Model):
             self.end_time = self.get_time + timedelta(hours=delay_time)
         await super().asave(force_update, force_update, using, update_fields)
 
+    def expired_payload(self) -> dict:
+        return {"title": self.title, "end_time": self.end_time.isoformat()}
+
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            # expire_boosts: next active boost to end
+            models.Index(fields=["end_time"], name="boost_expiry_idx", condition=models.Q(active=True)),
+        ]
+
 
 class Level(models.Model):
     title = models.CharField(max_length=100)
@@ -92,7 +188,211 @@ class PlayerLevel(models.Model):
     score = models.PositiveIntegerField(default=0)
 
 
+class PlayerStats(models.Model):
+    """Counters of the player updated in the transactions that change them, O(1) reads.
+    `manage.py rebuild_player_stats` recounts them from history."""
+    player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    levels_completed = models.PositiveIntegerField(default=0)
+    prizes_received = models.PositiveIntegerField(default=0)
+    max_level_order = models.IntegerField(default=0)
+    boosts_granted = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    async def abump(cls, player_id, levels_completed: int = 0, prizes_received: int = 0, boosts_granted: int = 0,
+                    level_order: int = None) -> None:
+        """Add to the counters of the player, one UPDATE (INSERT for the first time)"""
+        updates = {"levels_completed": F("levels_completed") + levels_completed,
+                   "prizes_received": F("prizes_received") + prizes_received,
+                   "boosts_granted": F("boosts_granted") + boosts_granted}
+        if level_order is not None:
+            updates["max_level_order"] = Greatest("max_level_order", Value(level_order))
+        if not await cls.objects.filter(player_id=player_id).aupdate(**updates):
+            await cls.objects.acreate(player_id=player_id, levels_completed=levels_completed,
+                                      prizes_received=prizes_received, boosts_granted=boosts_granted,
+                                      max_level_order=level_order or 0)
+
+
+class BoostArchive(models.Model):
+    """Expired boosts moved out of the hot Boost table"""
+    boost_id = models.BigIntegerField()
+    player_id = models.UUIDField(db_index=True)
+    title = models.CharField(max_length=30)
+    description = models.CharField(max_length=30, null=True)
+    active = models.BooleanField(default=False)
+    get_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    fields_from_boost = ["title", "description", "active", "get_time", "end_time"]
+
+    @classmethod
+    def archive(cls, boosts: QuerySet) -> int:
+        """Move boosts of the queryset to the archive, one transaction"""
+        with transaction.atomic(using=boosts.db):
+            rows = list(boosts.select_for_update().values("id", "player_id", *cls.fields_from_boost))
+            if not rows:
+                return 0
+            ids = [row.pop("id") for row in rows]
+            cls.objects.using(boosts.db).bulk_create([cls(boost_id=pk, **row) for pk, row in zip(ids, rows)])
+            Boost.objects.using(boosts.db).filter(pk__in=ids).delete()
+            Player.objects.using(boosts.db).filter(pk__in={row["player_id"] for row in rows}).update(
+                version=F("version") + 1)
+            PlayersListVersion.bump(boosts.db)
+        return len(ids)
+
+
+class PlayerLevelArchive(models.Model):
+    """Completed historical PlayerLevel rows, level title/order are kept as they were"""
+    player_level_id = models.BigIntegerField()
+    player_id = models.UUIDField(db_index=True)
+    level_id = models.BigIntegerField()
+    level_title = models.CharField(max_length=100)
+    level_order = models.IntegerField()
+    completed = models.DateField()
+    is_completed = models.BooleanField(default=True)
+    score = models.PositiveIntegerField(default=0)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def archive(cls, player_levels: QuerySet) -> int:
+        """Move PlayerLevel rows of the queryset to the archive, one transaction"""
+        with transaction.atomic(using=player_levels.db):
+            rows = list(player_levels.select_for_update(of=("self",)).values(
+                "id", "player_id", "level_id", "level__title", "level__order", "completed", "is_completed", "score"))
+            if not rows:
+                return 0
+            ids = [row["id"] for row in rows]
+            cls.objects.using(player_levels.db).bulk_create([
+                cls(player_level_id=row["id"], player_id=row["player_id"], level_id=row["level_id"],
+                    level_title=row["level__title"], level_order=row["level__order"], completed=row["completed"],
+                    is_completed=row["is_completed"], score=row["score"]) for row in rows])
+            PlayerLevel.objects.using(player_levels.db).filter(pk__in=ids).delete()
+            Player.objects.using(player_levels.db).filter(pk__in={row["player_id"] for row in rows}).update(
+                version=F("version") + 1)
+            PlayersListVersion.bump(player_levels.db)
+        return len(ids)
+
+
+class SeasonStanding(models.Model):
+    """Final standing of a player in a season, written by `manage.py reset_season` for all shards before the reset
+    and refreshed with the values the player is reset with"""
+    season = models.CharField(max_length=50)
+    player_id = models.UUIDField()
+    player_name = models.CharField(max_length=20)
+    player_score = models.BigIntegerField(default=0)
+    level_order = models.IntegerField(null=True, default=None)
+    levels_completed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["season", "player_id"], name="season_standing_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["season", "-player_score"], name="season_standing_score_idx"),
+        ]
+
+
+class SeasonReset(models.Model):
+    """Progress of `manage.py reset_season` on the database it is stored in (every shard has its own),
+    committed in the transaction of every chunk: standings snapshot first, then the reset"""
+    season = models.CharField(max_length=50, unique=True)
+    snapshot_after_pk = models.UUIDField(null=True, default=None)
+    snapshotted = models.DateTimeField(null=True, default=None)
+    after_pk = models.UUIDField(null=True, default=None)
+    players = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, default=None)
+
+
 class LevelPrize(models.Model):
     level = models.ForeignKey(Level, on_delete=models.CASCADE)
     prize = models.ForeignKey(Prize, on_delete=models.CASCADE)
     received = models.DateField()
+
+
+class PlayerVisit(models.Model):
+    """First request of the player in a day - history the analytics rollups are rebuilt from"""
+    player_id = models.UUIDField()
+    day = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["player_id", "day"], name="player_visit_unique"),
+        ]
+
+
+class DailyActivity(models.Model):
+    """Rollup of a day: players with the first login and active players.
+    Counters of a day are spread over ``slot`` rows (fewer waits on one hot row), readers sum them."""
+    day = models.DateField()
+    slot = models.PositiveSmallIntegerField(default=0)
+    new_players = models.PositiveIntegerField(default=0)
+    active_players = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "slot"], name="daily_activity_unique"),
+        ]
+
+
+class RetentionCohort(models.Model):
+    """Rollup: players with the first login on ``cohort`` day that were active on ``day``"""
+    cohort = models.DateField()
+    day = models.DateField()
+    slot = models.PositiveSmallIntegerField(default=0)
+    active_players = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cohort", "day", "slot"], name="retention_cohort_unique"),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """Event written in the same transaction as the state change, delivered by `manage.py dispatch_outbox`"""
+    player_id = models.UUIDField(db_index=True)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, default=None)
+    last_error = models.TextField(null=True, default=None)
+    dispatched_at = models.DateTimeField(null=True, default=None)
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=["id"], name="outbox_pending_idx",
+                         condition=models.Q(dispatched_at__isnull=True, failed=False)),
+        ]
+
+    def as_message(self) -> dict:
+        return {"id": self.pk, "player_id": str(self.player_id), "type": self.event_type,
+                "payload": self.payload, "created": self.created.isoformat()}
+
+
+class IdempotencyRecord(models.Model):
+    """Result of a write request sent with ``Idempotency-Key``, status is null while the request is running"""
+    player_id = models.UUIDField()
+    scope = models.CharField(max_length=30)
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True, default=None)
+    response = models.JSONField(null=True, default=None)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["player_id", "scope", "key"], name="idempotency_key_unique"),
+        ]
+        indexes = [
+            # IdempotencyService.purge of expired records of all players
+            models.Index(fields=["created"], name="idempotency_created_idx"),
+        ]
+
+
+class CacheVersion(models.Model):
+    """Version of a cache key for all workers (players.invalidation.PostgresInvalidationBus)"""
+    key = models.CharField(max_length=200, primary_key=True)
+    version = models.BigIntegerField(default=0)
@@ -0,0 +1,136 @@
+import json
+import logging
+import urllib.request
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from queue import SimpleQueue
+from typing import List, Dict, Any
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from players.models import OutboxEvent
+from players.push import get_bus
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(ABC):
+    """Receives a batch of events in order; raising means the whole batch is retried (at-least-once)"""
+
+    @abstractmethod
+    def send(self, messages: List[Dict[str, Any]]) -> None:
+        ...
+
+
+class WebhookSink(Sink):
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, messages):
+        request = urllib.request.Request(self.url, data=json.dumps(messages).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class FileSink(Sink):
+    """JSON lines file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, messages):
+        with open(self.path, "a") as f:
+            f.writelines(json.dumps(message) + "\n" for message in messages)
+
+
+class LocalQueueSink(Sink):
+    """In-process queue, stand-in for a broker in development and tests"""
+    queue: SimpleQueue = SimpleQueue()
+
+    def send(self, messages):
+        for message in messages:
+            self.queue.put(message)
+
+
+class PushSink(Sink):
+    """Live push to the players' SSE clients (players.push)"""
+
+    def send(self, messages):
+        get_bus().publish(messages)
+
+
+def get_sinks() -> List[Sink]:
+    return [import_string(config["class"])(**{k: v for k, v in config.items() if k != "class"})
+            for config in settings.OUTBOX_SINKS]
+
+
+class OutboxDispatcher:
+    """Delivers pending events of a database in batches, keeping per-player order:
+    after a player's event that is waiting for retry, his later events wait too.
+
+    Sinks are called outside of transactions: a batch is leased in one short transaction
+    (next_attempt_at = end of the lease), sent, then marked in another one. A dispatcher that dies
+    while sending leaves the lease to expire and the batch is sent again (at-least-once)."""
+
+    def __init__(self, sinks: List[Sink], batch_size: int, max_attempts: int, lease: float = 60):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+    @staticmethod
+    def backoff(attempts: int) -> timedelta:
+        return timedelta(seconds=min(2 ** attempts, 300))
+
+    def claim(self, alias: str, now: datetime) -> List[OutboxEvent]:
+        with transaction.atomic(using=alias):
+            events = list(OutboxEvent.objects.using(alias).select_for_update()
+                          .filter(dispatched_at__isnull=True, failed=False).order_by("id")[:self.batch_size])
+            blocked, due = set(), []
+            for event in events:
+                if event.player_id in blocked:
+                    continue
+                if event.next_attempt_at and event.next_attempt_at > now:
+                    blocked.add(event.player_id)
+                    continue
+                due.append(event)
+            if due:
+                OutboxEvent.objects.using(alias).filter(pk__in=[event.pk for event in due]).update(
+                    next_attempt_at=now + timedelta(seconds=self.lease))
+        return due
+
+    def dispatch(self, alias: str) -> int:
+        now = datetime.now()
+        due = self.claim(alias, now)
+        if not due:
+            return 0
+
+        try:
+            messages = [event.as_message() for event in due]
+            for sink in self.sinks:
+                sink.send(messages)
+        except Exception as e:
+            logger.warning("Outbox delivery of %s events from %s failed", len(due), alias, exc_info=True)
+            for event in due:
+                event.attempts += 1
+                event.next_attempt_at = now + self.backoff(event.attempts)
+                event.last_error = repr(e)
+                event.failed = event.attempts >= self.max_attempts
+            with transaction.atomic(using=alias):
+                OutboxEvent.objects.using(alias).bulk_update(
+                    due, ["attempts", "next_attempt_at", "last_error", "failed"])
+            return 0
+
+        OutboxEvent.objects.using(alias).filter(pk__in=[event.pk for event in due]).update(
+            dispatched_at=now, next_attempt_at=None)
+        return len(due)
+
+    @staticmethod
+    def purge(alias: str, days: int) -> int:
+        deleted, _ = OutboxEvent.objects.using(alias).filter(
+            dispatched_at__lt=datetime.now() - timedelta(days=days)).delete()
+        return deleted
@@ -0,0 +1,105 @@
+import os
+import random
+import re
+import sys
+import threading
+
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+from django.conf import settings
+from django.core import signing
+
+salt = "players.profiling"
+_active = threading.Lock()
+
+
+def make_token() -> str:
+    """Value of the ``X-Profile`` request header, valid for PROFILE_TOKEN_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=salt).sign("profile")
+
+
+def token_is_valid(token: str) -> bool:
+    try:
+        signing.TimestampSigner(salt=salt).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class StackSampler:
+    """Samples call stacks of every thread of the process (event loop and executor threads)
+    from a daemon thread every ``interval`` seconds.
+
+    Result is in the collapsed ("folded") format: ``thread;outer frame;...;inner frame count`` per line,
+    read by flamegraph.pl, inferno and speedscope.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})".replace(";", ":")
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)).replace(";", ":"))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.counts.items())
+
+
+def should_profile(request) -> bool:
+    """Signed ``X-Profile`` header or PROFILE_SAMPLE_RATE fraction of requests"""
+    token = request.headers.get("X-Profile")
+    if token is not None:
+        return token_is_valid(token)
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def start_profile() -> Optional[StackSampler]:
+    """Sampler of the request, None while another request of the process is being profiled
+    (one sampler already sees every thread)"""
+    if not _active.acquire(blocking=False):
+        return None
+    sampler = StackSampler(settings.PROFILE_INTERVAL)
+    sampler.start()
+    return sampler
+
+
+def finish_profile(sampler: StackSampler, method: str, path: str, elapsed: float) -> str:
+    """Stop the sampler and write the profile to PROFILE_DIR, returns the file name"""
+    try:
+        sampler.stop()
+    finally:
+        _active.release()
+    name = "%s-%s-%s-%s-%dms.folded" % (datetime.now().strftime("%Y%m%d-%H%M%S"), os.getpid(), method,
+                                         re.sub(r"[^\w-]+", "_", path).strip("_")[:80], elapsed * 1000)
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    sampler.dump(os.path.join(settings.PROFILE_DIR, name))
+    return name
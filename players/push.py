@@ -0,0 +1,189 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+
+from collections import defaultdict
+from typing import Dict, Set, List, Any, AsyncIterator, Optional
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def listen_kwargs(alias: str = DEFAULT_DB_ALIAS) -> Dict[str, Any]:
+    """psycopg connect() arguments of a dedicated LISTEN connection (outside Django's pool)"""
+    database = settings.DATABASES[alias]
+    return {"dbname": database["NAME"], "user": database["USER"], "password": database["PASSWORD"],
+            "host": database["HOST"], "port": database["PORT"]}
+
+
+class Subscription:
+    """Events of one player for one client. The queue is bounded: a client that doesn't read loses the oldest."""
+
+    def __init__(self, player_id: str, size: int):
+        self.player_id = player_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+
+    def put(self, message: Dict[str, Any]) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class LocalBus:
+    """In-process fan-out: only subscribers of the publishing process get the events.
+    Base of the cross-process buses, useful alone when the outbox is dispatched in the web process."""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        for message in messages:
+            self.deliver(message)
+
+    def deliver(self, message: Dict[str, Any]) -> None:
+        # publish() may run in another thread (outbox dispatcher, executors)
+        for subscription in list(self.subscribers.get(message["player_id"], ())):
+            subscription.loop.call_soon_threadsafe(subscription.put, message)
+
+    async def subscribe(self, player_id: str) -> Subscription:
+        subscription = Subscription(str(player_id), settings.PUSH_QUEUE_SIZE)
+        self.subscribers[subscription.player_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self.subscribers.get(subscription.player_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.player_id]
+
+    def connections(self) -> int:
+        return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+
+class PostgresBus(LocalBus):
+    """Fan-out across workers and hosts with LISTEN/NOTIFY of the default postgres database:
+    publish() sends NOTIFY, every worker keeps one LISTEN connection and delivers to its subscribers."""
+    channel = "player_events"
+
+    def __init__(self):
+        super().__init__()
+        self._listener: Optional[asyncio.Task] = None
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            for message in messages:
+                cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, json.dumps(message)])
+
+    async def subscribe(self, player_id: str) -> Subscription:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self.listen())
+        return await super().subscribe(player_id)
+
+    async def listen(self) -> None:
+        import psycopg
+
+        while True:
+            try:
+                connection = await psycopg.AsyncConnection.connect(**listen_kwargs(), autocommit=True)
+                async with connection:
+                    await connection.execute(f"LISTEN {self.channel}")
+                    async for notify in connection.notifies():
+                        self.deliver(json.loads(notify.payload))
+            except Exception:
+                logger.warning("LISTEN %s failed, reconnecting", self.channel, exc_info=True)
+                await asyncio.sleep(1)
+
+
+class FileBus(LocalBus):
+    """Local stand-in for PostgresBus: fan-out across the processes of one host (dispatch_outbox and web workers)
+    through a JSON lines file (PUSH_FILE). publish() appends under flock, every worker tails the file
+    from the size it had at the first subscription, every PUSH_POLL seconds.
+    The file is truncated when it grows over PUSH_FILE_MAX_BYTES, a reader that missed lines gets them
+    from the outbox on reconnect (Last-Event-ID)."""
+
+    def __init__(self, path: Optional[str] = None):
+        super().__init__()
+        self.path = path or settings.PUSH_FILE
+        self._listener: Optional[asyncio.Task] = None
+        self._offset = 0
+
+    def _size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_size > settings.PUSH_FILE_MAX_BYTES:
+                f.truncate(0)
+            f.write("".join(json.dumps(message) + "\n" for message in messages))
+            f.flush()
+
+    async def subscribe(self, player_id: str) -> Subscription:
+        if self._listener is None or self._listener.done():
+            # the offset is taken now: lines published before the listener task runs are not skipped
+            self._offset = self._size()
+            self._listener = asyncio.create_task(self.listen())
+        return await super().subscribe(player_id)
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Complete lines appended since the last read"""
+        if self._size() < self._offset:
+            self._offset = 0
+        with open(self.path, "ab+") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            f.seek(self._offset)
+            content = f.read()
+        complete = content[:content.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        return [json.loads(line) for line in complete.splitlines()]
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                for message in self.read():
+                    self.deliver(message)
+            except (OSError, ValueError):
+                logger.warning("Can't read %s", self.path, exc_info=True)
+            await asyncio.sleep(settings.PUSH_POLL)
+
+
+_bus: Optional[LocalBus] = None
+
+
+def get_bus() -> LocalBus:
+    global _bus
+    if _bus is None:
+        _bus = import_string(settings.PUSH_BUS)()
+    return _bus
+
+
+def sse_event(message: Dict[str, Any]) -> str:
+    return f"id: {message['id']}\nevent: {message['type']}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(subscription: Subscription, missed: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Missed events first (Last-Event-ID), then live ones; a comment every PUSH_HEARTBEAT seconds
+    keeps proxies from closing the idle connection"""
+    try:
+        last_id = 0
+        for message in missed:
+            last_id = message["id"]
+            yield sse_event(message)
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), settings.PUSH_HEARTBEAT)
+            except TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            # delivered after the subscription and also read from the outbox
+            if message["id"] <= last_id:
+                continue
+            yield sse_event(message)
+    finally:
+        get_bus().unsubscribe(subscription)
@@ -0,0 +1,225 @@
+import asyncio
+import functools
+import inspect
+import logging
+import random
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional, Dict, Tuple, Callable, List, Iterator, Union
+from uuid import UUID
+from django.conf import settings
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.models.base import ModelBase
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RouteState:
+    """Routing state of the current request/service call"""
+    use_replica: bool = False
+    wrote: bool = False
+
+
+current_route: ContextVar[Optional[RouteState]] = ContextVar("current_route", default=None)
+
+
+def replica_reads(fun: Callable) -> Callable:
+    """Run read-only coroutine function against replicas (unless the caller already wrote)"""
+
+    @functools.wraps(fun)
+    async def wrapper(*args, **kwargs):
+        state = current_route.get()
+        token = current_route.set(RouteState(use_replica=True, wrote=bool(state and state.wrote)))
+        try:
+            return await fun(*args, **kwargs)
+        finally:
+            current_route.reset(token)
+
+    return wrapper
+
+
+current_shard: ContextVar[Optional[str]] = ContextVar("current_shard", default=None)
+
+
+def is_sharded() -> bool:
+    return len(settings.PLAYER_SHARDS) > 1
+
+
+def shard_for(player_id: Union[str, UUID]) -> str:
+    """Database alias of the player's shard (hash partitioning by player_id)"""
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    return settings.PLAYER_SHARDS[UUID(str(player_id)).int % len(settings.PLAYER_SHARDS)]
+
+
+@contextmanager
+def use_player_shard(player_id: Union[str, UUID]) -> Iterator[str]:
+    alias = shard_for(player_id)
+    token = current_shard.set(alias if is_sharded() else None)
+    try:
+        yield alias
+    finally:
+        current_shard.reset(token)
+
+
+def player_shard(arg: str) -> Callable:
+    """Run coroutine function on the shard of the player passed in argument ``arg``"""
+
+    def decorator(fun: Callable) -> Callable:
+        signature = inspect.signature(fun)
+
+        @functools.wraps(fun)
+        async def wrapper(*args, **kwargs):
+            with use_player_shard(signature.bind_partial(*args, **kwargs).arguments[arg]):
+                return await fun(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def read_database(alias: str) -> str:
+    """Alias to read the data of ``alias`` from: a fresh replica of the default database when the current request
+    reads from replicas (``read_replica`` views, ReplicaRoutingMiddleware) and didn't write, else ``alias``.
+    Call it in the request's coroutine: executor threads (AsyncDAO.ascatter) don't see its routing state."""
+    state = current_route.get()
+    if alias != DEFAULT_DB_ALIAS or state is None or not state.use_replica or state.wrote:
+        return alias
+    return PrimaryReplicaRouter.fresh_replica()
+
+
+def player_databases(model: ModelBase) -> List[str]:
+    """Aliases to scatter reads of player data over: every shard (shards have no replicas),
+    or the default database - a replica of it for replica reads of the request"""
+    if is_sharded():
+        return list(settings.PLAYER_SHARDS)
+    return [read_database(DEFAULT_DB_ALIAS)]
+
+
+class PlayerShardRouter:
+    """Player data (Player, Boost, PlayerLevel, OutboxEvent, archives, IdempotencyRecord, PlayerStats,
+    PlayerVisit, SeasonStanding) lives on the shard of its player_id.
+    Level/Prize/LevelPrize are written to the default database and copied to every shard
+    (players.signals), reads inside a player shard context use the shard's copy.
+    Analytics rollups (DailyActivity, RetentionCohort) are written to the default database only."""
+
+    # model_name -> attribute holding player_id
+    player_models = {"player": "pk", "boost": "player_id", "playerlevel": "player_id", "outboxevent": "player_id",
+                     "boostarchive": "player_id", "playerlevelarchive": "player_id",
+                     "idempotencyrecord": "player_id", "playerstats": "player_id",
+                     "playervisit": "player_id", "seasonstanding": "player_id"}
+
+    def _route(self, model: ModelBase, hints: dict) -> Optional[str]:
+        if not is_sharded() or model._meta.app_label != "players":
+            return None
+
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+
+        attr = self.player_models.get(model._meta.model_name)
+        if attr and instance is not None and getattr(instance, attr, None):
+            return shard_for(getattr(instance, attr))
+        return current_shard.get()
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        if model._meta.model_name not in self.player_models:
+            instance = hints.get("instance")
+            if instance is None or not instance._state.db:
+                # new catalog rows go to default, replicated to shards by signals
+                return None
+        return self._route(model, hints)
+
+
+class PrimaryReplicaRouter:
+    """Writes, transactions and read-your-writes go to the primary, marked reads go to a fresh replica"""
+
+    # alias -> (monotonic time of check, lag in seconds)
+    _lag: Dict[str, Tuple[float, float]] = {}
+    # alias -> last background check of a replica routed from the event loop
+    _refreshing: Dict[str, Future] = {}
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replica-lag")
+
+    lag_query = ("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                 "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+    @classmethod
+    def replica_lag(cls, alias: str) -> float:
+        """Cached lag of the replica, checked at most every REPLICA_LAG_CHECK_INTERVAL seconds.
+        On the event loop (routing of async views, DataLoader) no query is run: an outdated value is refreshed
+        in a background thread and the last known one is returned, unknown lag counts as too high."""
+        checked_at, lag = cls._lag.get(alias, (None, float("inf")))
+        if checked_at is not None and time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return lag
+        if connections[alias].vendor != "postgresql":
+            # sqlite replicas (local testing) have no replication
+            cls._lag[alias] = (time.monotonic(), 0.0)
+            return 0.0
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return cls.check_lag(alias)
+        refreshing = cls._refreshing.get(alias)
+        if refreshing is None or refreshing.done():
+            cls._refreshing[alias] = cls._executor.submit(cls.refresh_lag, alias)
+        return lag
+
+    @classmethod
+    def check_lag(cls, alias: str) -> float:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(cls.lag_query)
+                lag = float(cursor.fetchone()[0])
+        except DatabaseError:
+            logger.warning("Replica %s is unavailable", alias, exc_info=True)
+            lag = float("inf")
+        cls._lag[alias] = (time.monotonic(), lag)
+        return lag
+
+    @classmethod
+    def refresh_lag(cls, alias: str) -> float:
+        try:
+            return cls.check_lag(alias)
+        except Exception:
+            logger.warning("Lag of replica %s is unknown", alias, exc_info=True)
+            cls._lag[alias] = (time.monotonic(), float("inf"))
+            return float("inf")
+        finally:
+            connections[alias].close()
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        state = current_route.get()
+        if state is not None and state.wrote:
+            return DEFAULT_DB_ALIAS
+
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+
+        if state is None or not state.use_replica:
+            return DEFAULT_DB_ALIAS
+        return self.fresh_replica()
+
+    @classmethod
+    def fresh_replica(cls) -> str:
+        """Random replica lagging at most REPLICA_MAX_LAG, the primary when there is none"""
+        fresh = [alias for alias in settings.REPLICA_DATABASES if cls.replica_lag(alias) <= settings.REPLICA_MAX_LAG]
+        return random.choice(fresh) if fresh else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> str:
+        state = current_route.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # all aliases hold the same data
+        return True
@@ -1,15 +1,20 @@
-from datetime import datetime
-from players.models import Player, PlayerLevel, Boost, Level
+from collections import defaultdict
+from datetime import datetime, date, timedelta, timezone as dt_timezone
+from typing import Optional, List, Dict, Any
+from uuid import UUID
+from django.conf import settings
+from django.utils import timezone
+from players.models import Player, PlayerLevel, Boost, Level, BoostArchive, PlayerLevelArchive, PlayerStats
 from rest_framework import serializers
 from adrf.serializers import Serializer, ModelSerializer
 
-from players.services import LevelService
+from players.services import LevelService, PlayerSearchService
 
 
 class PlayerCreateSerializer(ModelSerializer):
     class Meta:
         model = Player
-        exclude = ['last_entry', 'last_boost_date']
+        exclude = ['last_entry', 'first_entry', 'last_boost_date', 'version']
 
 
 class LevelSerializer(ModelSerializer):
@@ -42,17 +47,99 @@ class BoostsListSerializer(ModelSerializer):
         exclude = ['id', 'player']
 
 
+class PlayerStatsSerializer(ModelSerializer):
+    class Meta:
+        model = PlayerStats
+        exclude = ["player"]
+
+
+class BoostArchiveSerializer(ModelSerializer):
+    """Same shape as BoostsListSerializer"""
+    class Meta:
+        model = BoostArchive
+        fields = ["title", "description", "active", "get_time", "end_time"]
+
+
+class PlayerLevelArchiveSerializer(ModelSerializer):
+    """Same shape as PlayerLevelSerializer"""
+    current_level = serializers.IntegerField(source="level_order")
+
+    class Meta:
+        model = PlayerLevelArchive
+        fields = ["current_level", "completed", "is_completed", "score"]
+
+
 class BoostCreateSerializer(Serializer):
     title = serializers.CharField()
     description = serializers.CharField()
     duration = serializers.IntegerField()
 
 
+class LevelUpScoreSerializer(Serializer):
+    player_id = serializers.UUIDField()
+    score = serializers.IntegerField(min_value=0, required=False)
+
+
+class BatchLevelUpSerializer(Serializer):
+    """Either ``players`` - list of ids, or ``scores`` - list of {player_id, score}"""
+    players = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False)
+    scores = LevelUpScoreSerializer(many=True, required=False, allow_empty=False)
+
+    def validate(self, attrs):
+        if ("players" in attrs) == ("scores" in attrs):
+            raise serializers.ValidationError("Нужен один из списков: players или scores")
+        if len(attrs.get("players") or attrs.get("scores")) > settings.BATCH_LEVEL_UP_MAX:
+            raise serializers.ValidationError(f"Не больше {settings.BATCH_LEVEL_UP_MAX} игроков за запрос")
+        return attrs
+
+    def items(self):
+        if "players" in self.validated_data:
+            return [(player_id, None) for player_id in self.validated_data["players"]]
+        return [(item["player_id"], item.get("score")) for item in self.validated_data["scores"]]
+
+
+class PlayerSearchSerializer(Serializer):
+    """Query parameters of the player search"""
+    q = serializers.CharField(max_length=36)
+    by = serializers.ChoiceField(choices=["name", "id", "contains"], default="name")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    cursor = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        if attrs["by"] == "id":
+            try:
+                PlayerSearchService.id_prefix_range(attrs["q"])
+            except ValueError:
+                raise serializers.ValidationError({"q": "Начало player_id: шестнадцатеричные цифры"})
+        if attrs["by"] == "contains" and not settings.SEARCH_TRIGRAM:
+            raise serializers.ValidationError({"by": "Поиск по подстроке отключен"})
+        if "cursor" in attrs:
+            try:
+                PlayerSearchService.decode_cursor(attrs["cursor"])
+            except (ValueError, TypeError):
+                raise serializers.ValidationError({"cursor": "Неверный курсор"})
+        return attrs
+
+
+class AnalyticsQuerySerializer(Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault("until", datetime.now().date())
+        attrs.setdefault("since", attrs["until"] - timedelta(days=29))
+        if attrs["since"] > attrs["until"]:
+            raise serializers.ValidationError("since позже until")
+        if (attrs["until"] - attrs["since"]).days >= settings.ANALYTICS_MAX_DAYS:
+            raise serializers.ValidationError(f"Не больше {settings.ANALYTICS_MAX_DAYS} дней")
+        return attrs
+
+
 class PlayersListSerializer(ModelSerializer):
     boost = BoostSerializer(source="boosts", many=True, read_only=True)
     player_level = PlayerLevelSerializer(source='playerlevel_set', many=True, read_only=True)
     boost_required = serializers.SerializerMethodField()
-
+    stats = PlayerStatsSerializer(read_only=True)
 
     def get_boost_required(self, obj):
         """check if 1 day has passed"""
@@ -73,6 +160,7 @@ class PlayerSerializer(ModelSerializer):
     boost = BoostSerializer(source="boosts", many=True, read_only=True)
     player_levels = PlayerLevelSerializer(source='playerlevel_set', many=True, read_only=True)
     boost_required = serializers.SerializerMethodField()
+    stats = PlayerStatsSerializer(read_only=True)
 
     def get_boost_required(self, obj):
         """check if 1 day has passed"""
@@ -86,3 +174,123 @@ class PlayerSerializer(ModelSerializer):
     class Meta:
         model = Player
         fields = '__all__'
+
+
+class PlayerRowsSerializer:
+    """Byte-identical output of PlayerSerializer/PlayersListSerializer built straight from
+    PlayerService.get_players_rows values() rows, without model instances and nested serializers."""
+
+    def __init__(self, levels_key: str = "player_levels"):
+        self.levels_key = levels_key
+
+    @staticmethod
+    def date(value: Optional[date]) -> Optional[str]:
+        return value.isoformat() if value else None
+
+    @staticmethod
+    def datetime(value: Optional[datetime]) -> Optional[str]:
+        """rest_framework DateTimeField in ISO_8601 with USE_TZ=False"""
+        if not value:
+            return None
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value, dt_timezone.utc)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    def boost(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "title": row["title"],
+            "description": row["description"],
+            "active": row["active"],
+            "get_time": self.datetime(row["get_time"]),
+            "end_time": self.datetime(row["end_time"]),
+        }
+
+    def level(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "current_level": row["level__order"],
+            "completed": self.date(row["completed"]),
+            "is_completed": row["is_completed"],
+            "score": row["score"],
+        }
+
+    @staticmethod
+    def stats(row: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        """Joined PlayerStats columns, all None without the stats row"""
+        if row["stats__levels_completed"] is None:
+            return None
+        return {
+            "levels_completed": row["stats__levels_completed"],
+            "prizes_received": row["stats__prizes_received"],
+            "max_level_order": row["stats__max_level_order"],
+            "boosts_granted": row["stats__boosts_granted"],
+        }
+
+    def player(self, row: Dict[str, Any], boosts: List[Dict], levels: List[Dict], now: date) -> Dict[str, Any]:
+        last_boost = row["last_boost_date"]
+        return {
+            "player_id": str(row["player_id"]),
+            "boost": [self.boost(b) for b in boosts],
+            self.levels_key: [self.level(pl) for pl in levels],
+            "boost_required": (now - last_boost).days >= 1 if last_boost else True,
+            "stats": self.stats(row),
+            "player_name": row["player_name"],
+            "last_entry": self.date(row["last_entry"]),
+            "first_entry": self.date(row["first_entry"]),
+            "last_boost_date": self.date(last_boost),
+            "player_score": row["player_score"],
+            "rewarded": row["rewarded"],
+            "version": row["version"],
+        }
+
+    def data(self, players: List[Dict], boosts: List[Dict], levels: List[Dict]) -> List[Dict[str, Any]]:
+        boosts_of, levels_of = defaultdict(list), defaultdict(list)
+        for row in boosts:
+            boosts_of[row["player_id"]].append(row)
+        for row in levels:
+            levels_of[row["player_id"]].append(row)
+        now = datetime.now().date()
+        return [self.player(row, boosts_of[row["player_id"]], levels_of[row["player_id"]], now) for row in players]
+
+    def data_by_ids(self, player_ids: List, players: List[Dict], boosts: List[Dict], levels: List[Dict],
+                    fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Players in the order of ``player_ids``, ``{"player_id": ..., "not_found": true}`` for missing ones.
+        ``fields`` limits the keys of every player, player_id is always there."""
+        found = {player["player_id"]: player for player in self.data(players, boosts, levels)}
+        result = []
+        for player_id in map(str, player_ids):
+            player = found.get(player_id)
+            if player is None:
+                result.append({"player_id": player_id, "not_found": True})
+            elif fields:
+                result.append({"player_id": player_id, **{field: player[field] for field in fields}})
+            else:
+                result.append(player)
+        return result
+
+
+class PlayersByIdsSerializer(Serializer):
+    """Query parameters of the multi-get: ?ids=<uuid>,<uuid>...&fields=player_name,player_score"""
+    field_choices = ["boost", "player_levels", "boost_required", "stats", "player_name", "last_entry",
+                     "first_entry", "last_boost_date", "player_score", "rewarded", "version"]
+
+    ids = serializers.CharField()
+    fields = serializers.CharField(required=False)
+
+    def validate_ids(self, value):
+        try:
+            ids = [UUID(item.strip()) for item in value.split(",") if item.strip()]
+        except ValueError:
+            raise serializers.ValidationError("Список player_id через запятую")
+        if not 0 < len(ids) <= settings.MULTI_GET_MAX:
+            raise serializers.ValidationError(f"От 1 до {settings.MULTI_GET_MAX} игроков за запрос")
+        return ids
+
+    def validate_fields(self, value):
+        fields = list(dict.fromkeys(item.strip() for item in value.split(",") if item.strip()))
+        unknown = [field for field in fields if field not in self.field_choices and field != "player_id"]
+        if unknown:
+            raise serializers.ValidationError(f"Неизвестные поля: {', '.join(unknown)}")
+        return [field for field in fields if field != "player_id"]
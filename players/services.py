@@ -1,26 +1,44 @@
 import asyncio
+import base64
 import functools
+import heapq
+import json
 import logging
 import csv
+import random
+from collections import defaultdict
 from functools import partial
 
-import pandas as pd
-import aiohttp
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from io import StringIO
-from typing import Optional, Dict, Union, AsyncIterator, List
+from typing import Optional, Dict, Union, AsyncIterator, List, Tuple
+from asgiref.sync import sync_to_async
 from rest_framework.request import Request
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, APIException
 from rest_framework.reverse import reverse
+from rest_framework.status import HTTP_409_CONFLICT
 from uuid import UUID
-from players.models import Player, Boost, PlayerLevel, Level, Prize, LevelPrize
-from django.db.models import QuerySet, Model
+from players.models import (Player, Boost, PlayerLevel, Level, Prize, LevelPrize, OutboxEvent, BoostArchive,
+                            PlayerLevelArchive, IdempotencyRecord, PlayerStats, PlayerVisit, DailyActivity,
+                            RetentionCohort, SeasonStanding, SeasonReset, PlayersListVersion)
+from django.conf import settings
+from django.db import connections, transaction, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import QuerySet, Model, Q, F, Exists, OuterRef, Subquery, Count, Sum, Max, Value
+from django.db.models.functions import Coalesce
 from players.DAO import AsyncDAO
+from players.invalidation import cache
 from players.async_atomic import aatomic
+from players.routers import replica_reads, player_shard, shard_for, player_databases, is_sharded
 
 logger = logging.getLogger(__name__)
 
 
+class VersionConflict(APIException):
+    status_code = HTTP_409_CONFLICT
+    default_detail = "Игрок изменен параллельным запросом, повторите позже"
+    default_code = "version_conflict"
+
+
 class BaseService:
     _pl_queryset: QuerySet = Player.objects
     _boost_queryset: QuerySet = Boost.objects
@@ -28,6 +46,17 @@ class BaseService:
     _lvl_queryset: QuerySet = Level.objects
     _prize_queryset: QuerySet = Prize.objects
     _lvl_prize_queryset: QuerySet = LevelPrize.objects
+    _outbox_queryset: QuerySet = OutboxEvent.objects
+    _boost_archive_queryset: QuerySet = BoostArchive.objects
+    _pll_archive_queryset: QuerySet = PlayerLevelArchive.objects
+    _idempotency_queryset: QuerySet = IdempotencyRecord.objects
+    _stats_queryset: QuerySet = PlayerStats.objects
+    _visit_queryset: QuerySet = PlayerVisit.objects
+    _daily_queryset: QuerySet = DailyActivity.objects
+    _cohort_queryset: QuerySet = RetentionCohort.objects
+    _standing_queryset: QuerySet = SeasonStanding.objects
+    _season_reset_queryset: QuerySet = SeasonReset.objects
+    _list_version_queryset: QuerySet = PlayersListVersion.objects
     dao: AsyncDAO = AsyncDAO
 
 
@@ -38,6 +67,58 @@ class PlayerService(BaseService):
         return cls.dao.get_list(cls._pl_queryset)
 
     @classmethod
+    async def get_all_players(cls) -> List[Player]:
+        """Scatter-gather over player shards, ordered by player_id"""
+        queryset = cls._pl_queryset.prefetch_related("boosts", "playerlevel_set", "stats")
+        parts = await cls.dao.ascatter_gather(queryset, player_databases(Player))
+        return list(heapq.merge(*parts, key=lambda player: player.pk))
+
+    @classmethod
+    def get_players_rows(cls, alias: str, player_ids: Optional[List[UUID]] = None, with_boosts: bool = True,
+                         with_levels: bool = True) -> Tuple[list, list, list]:
+        """values() rows of players, their boosts and levels (with Level.order) - 3 queries,
+        skipped relations are empty lists without a query"""
+        players = cls._pl_queryset.using(alias).values(
+            "player_id", "player_name", "last_entry", "first_entry", "last_boost_date", "player_score", "rewarded",
+            "version",
+            *PlayerStatsService.rows_fields)
+        boosts = cls._boost_queryset.using(alias).order_by("id").values(
+            "player_id", "title", "description", "active", "get_time", "end_time")
+        levels = cls._pll_queryset.using(alias).order_by("id").values(
+            "player_id", "level__order", "completed", "is_completed", "score")
+        if player_ids is not None:
+            players = players.filter(player_id__in=player_ids)
+            boosts = boosts.filter(player_id__in=player_ids)
+            levels = levels.filter(player_id__in=player_ids)
+        return list(players), list(boosts) if with_boosts else [], list(levels) if with_levels else []
+
+    @classmethod
+    async def get_player_rows(cls, player: Player) -> Tuple[list, list, list]:
+        return await sync_to_async(cls.get_players_rows)(player._state.db, [player.pk])
+
+    @classmethod
+    async def get_all_players_rows(cls) -> Tuple[list, list, list]:
+        """Scatter-gather of values() rows over player shards, players ordered by player_id"""
+        parts = await cls.dao.ascatter(cls.get_players_rows, player_databases(Player))
+        players = list(heapq.merge(*[part[0] for part in parts], key=lambda row: row["player_id"]))
+        return players, [row for part in parts for row in part[1]], [row for part in parts for row in part[2]]
+
+    @classmethod
+    async def get_players_rows_by_ids(cls, player_ids: List[UUID], with_boosts: bool = True,
+                                      with_levels: bool = True) -> Tuple[list, list, list]:
+        """values() rows of the given players, one query per relation on every shard holding them.
+        Read only: no boost sweep (expire_boosts does it) and no last_entry update."""
+        # resolved here, in the request's context: a replica for PlayersByIdsView
+        aliases = player_databases(Player)
+        ids_of = defaultdict(list)
+        for player_id in dict.fromkeys(player_ids):
+            ids_of[shard_for(player_id) if is_sharded() else aliases[0]].append(player_id)
+        parts = await cls.dao.ascatter(
+            lambda alias: cls.get_players_rows(alias, ids_of[alias], with_boosts, with_levels), list(ids_of))
+        return tuple([row for part in parts for row in part[i]] for i in range(3))
+
+    @classmethod
+    @player_shard("player_id")
     async def get_player(cls, player_id: str) -> Player():
         player = await cls.dao.aget_one(cls._pl_queryset, Player, player_id)
         try:
@@ -51,33 +132,132 @@ class PlayerService(BaseService):
 
     @classmethod
     async def check_last_entry(cls, obj: Model) -> Model:
+        """First profile request of the day is the player's login: last_entry, first_entry, analytics"""
         try:
-            if obj.last_entry is None:
-                obj.last_entry = datetime.now().date()
-                await obj.asave()
+            today = datetime.now().date()
+            if obj.first_entry is not None and obj.last_entry == today:
                 return obj
+            if await AnalyticsService.register_visit(obj.pk, obj.first_entry):
+                obj.first_entry = obj.first_entry or today
+                obj.last_entry = today
+                obj.version += 1
             return obj
         except AttributeError as e:
             logger.error("problem players.services.PlayerService.check_last_entry", exc_info=True)
 
 
+class PlayerSearchService(BaseService):
+    """Player lookup by name prefix, player_id prefix or (postgres, SEARCH_TRIGRAM) name substring.
+    Every mode is an index range scan, pages are keyset - latency doesn't grow with the table."""
+    fields = ["player_id", "player_name", "player_score"]
+    modes = ["name", "id", "contains"]
+
+    @staticmethod
+    def id_prefix_range(prefix: str) -> Tuple[UUID, UUID]:
+        digits = prefix.replace("-", "").lower()
+        if not digits or len(digits) > 32 or any(c not in "0123456789abcdef" for c in digits):
+            raise ValueError("player_id prefix must be hex")
+        return UUID(digits.ljust(32, "0")), UUID(digits.ljust(32, "f"))
+
+    @classmethod
+    def filter(cls, queryset: QuerySet, by: str, q: str) -> QuerySet:
+        if by == "id":
+            low, high = cls.id_prefix_range(q)
+            return queryset.filter(player_id__gte=low, player_id__lte=high)
+        if by == "contains":
+            # postgres: UPPER(player_name) gin_trgm_ops index (migration 0007)
+            return queryset.filter(player_name__icontains=q)
+        if connections[queryset.db].vendor == "sqlite":
+            # sqlite doesn't use an index for LIKE ... ESCAPE, a range on the unique index works
+            return queryset.filter(player_name__gte=q, player_name__lt=q[:-1] + chr(ord(q[-1]) + 1))
+        # postgres: varchar_pattern_ops "_like" index of the unique player_name
+        return queryset.filter(player_name__startswith=q)
+
+    @staticmethod
+    def encode_cursor(row: Dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps([row["player_name"], str(row["player_id"])]).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, UUID]:
+        name, player_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return name, UUID(player_id)
+
+    @classmethod
+    def order(cls, by: str) -> List[str]:
+        return ["player_id"] if by == "id" else ["player_name", "player_id"]
+
+    @classmethod
+    def search_alias(cls, alias: str, by: str, q: str, limit: int, after: Optional[Tuple[str, UUID]]) -> List[Dict]:
+        queryset = cls.filter(cls._pl_queryset.using(alias), by, q)
+        if after is not None:
+            name, player_id = after
+            if by == "id":
+                queryset = queryset.filter(player_id__gt=player_id)
+            else:
+                queryset = queryset.filter(Q(player_name__gt=name) | Q(player_name=name, player_id__gt=player_id))
+        return list(queryset.order_by(*cls.order(by)).values(*cls.fields)[:limit])
+
+    @classmethod
+    async def search(cls, by: str, q: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Union[list, str]]:
+        """Page of ``limit`` players after ``cursor``, merged from every player shard"""
+        after = cls.decode_cursor(cursor) if cursor else None
+        parts = await cls.dao.ascatter(lambda alias: cls.search_alias(alias, by, q, limit + 1, after),
+                                       player_databases(Player))
+        order = cls.order(by)
+        rows = list(heapq.merge(*parts, key=lambda row: tuple(row[field] for field in order)))[:limit + 1]
+        return {"results": rows[:limit], "next": cls.encode_cursor(rows[limit - 1]) if len(rows) > limit else None}
+
+
 class BoostService(BaseService):
 
     @classmethod
+    @aatomic(using=lambda cls, data, player_pk: shard_for(player_pk))
+    @player_shard("player_pk")
     async def create_boost(cls, data: Dict[str, Union[str, int]], player_pk: str) -> Dict[str, str]:
+        return await cls.add_boost(data, player_pk)
+
+    @classmethod
+    async def add_boost(cls, data: Dict[str, Union[str, int]], player_pk: str) -> Dict[str, str]:
+        """create_boost in the transaction of the caller, on the player's shard"""
         buff = await cls.dao.acreate(cls._boost_queryset,
                                      player_id=player_pk,
                                      title=data.get("title"),
                                      description=data.get("description"),
                                      get_time=datetime.now())
 
-        player = await cls.dao.aget_one(cls._pl_queryset, Player, player_pk)
-        player.last_boost_date = datetime.now().date()
         await buff.asave(delay_time=data.get("duration"))
-        await player.asave()
+        # one UPDATE: saving a stale copy of the player would undo concurrent score/rewards changes
+        await cls._pl_queryset.filter(pk=player_pk).aupdate(last_boost_date=datetime.now().date(),
+                                                            version=F("version") + 1)
+        await PlayersListVersion.abump(shard_for(player_pk))
+        await PlayerStats.abump(player_pk, boosts_granted=1)
+        await OutboxService.enqueue(player_pk, "boost_granted", {
+            "title": buff.title, "description": buff.description,
+            "end_time": buff.end_time.isoformat() if buff.end_time else None})
         return {"ok": "%s player buffed by %s" % (player_pk, buff.title)}
 
     @classmethod
+    def expire_due_boosts(cls, alias: str) -> Tuple[int, Optional[datetime]]:
+        """Deactivate boosts whose end_time has passed, with boost_expired outbox events, in one transaction.
+        Returns the number expired and the end_time of the next active boost (when to wake up)."""
+        now = datetime.now()
+        with transaction.atomic(using=alias):
+            due = list(cls._boost_queryset.using(alias).select_for_update(skip_locked=True)
+                       .filter(active=True, end_time__lte=now).order_by("end_time")[:settings.BOOST_EXPIRY_BATCH])
+            if due:
+                cls._boost_queryset.using(alias).filter(pk__in=[boost.pk for boost in due]).update(active=False)
+                cls._pl_queryset.using(alias).filter(pk__in={boost.player_id for boost in due}).update(
+                    version=F("version") + 1)
+                PlayersListVersion.bump(alias)
+                cls._outbox_queryset.using(alias).bulk_create([
+                    OutboxEvent(player_id=boost.player_id, event_type="boost_expired", payload=boost.expired_payload())
+                    for boost in due])
+        next_end = (cls._boost_queryset.using(alias).filter(active=True, end_time__isnull=False)
+                    .order_by("end_time").values_list("end_time", flat=True).first())
+        return len(due), next_end
+
+    @classmethod
+    @player_shard("pk")
     async def get_boosts_list(cls, pk: str) -> QuerySet:
         player = await cls.dao.aget_one(cls._pl_queryset, Player, pk)
         return await cls.dao.aget_list(player.boosts)
@@ -86,6 +266,8 @@ class BoostService(BaseService):
     async def boost_player(cls, request_kwarg: Dict[str, str], request: Request, **kwargs) -> Optional[bool]:
         """Boost with http request"""
 
+        import aiohttp  # lazy: only needed here, keeps worker boot light
+
         # trouble with docker
         try:
             url = reverse("players:boost_player", kwargs=request_kwarg, request=request)
@@ -100,6 +282,7 @@ class BoostService(BaseService):
 class PlayerLevelService(BaseService):
 
     @classmethod
+    @player_shard("uuid")
     async def set_levels_to_fresh_player(cls, uuid: UUID) -> None:
         """Set first from order level to player"""
         try:
@@ -118,11 +301,27 @@ class PlayerLevelService(BaseService):
                                              is_completed=False,
                                              )
         await player_level.asave()
+        await PlayerStats.abump(uuid, level_order=minimal.order)
 
     @classmethod
-    @aatomic()
-    async def level_up(cls, player_id: str) -> Dict[str, Union[str, bool]]:
-        """Try set new level to player"""
+    async def level_up(cls, player_id: str, boost: Optional[Dict[str, Union[str, int]]] = None
+                       ) -> Dict[str, Union[str, bool]]:
+        """Try set new level to player, an attempt that lost the race for Player.version is retried.
+        ``boost`` is granted for the new level in the same transaction."""
+        for attempt in range(settings.LEVEL_UP_RETRIES + 1):
+            try:
+                return await cls._level_up(player_id, boost)
+            except VersionConflict:
+                if attempt == settings.LEVEL_UP_RETRIES:
+                    raise
+                logger.info("level_up of %s conflicted, retry %s", player_id, attempt + 1)
+                await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+    @classmethod
+    @aatomic(using=lambda cls, player_id, boost: shard_for(player_id))
+    @player_shard("player_id")
+    async def _level_up(cls, player_id: str, boost: Optional[Dict[str, Union[str, int]]]
+                        ) -> Dict[str, Union[str, bool]]:
 
         player = await cls.dao.aget_one(cls._pl_queryset, Player, player_id)
         the_need_to_issue_an_award = False  # необходимость выдать награду
@@ -131,20 +330,15 @@ class PlayerLevelService(BaseService):
             raise NotFound
 
         try:
-            # все записи PlayerLevel для Player
-            player_levels_of_player = await cls.dao.aget_list(player.playerlevel_set)
-
-            # Список id уровней в queryset(LevelPlayer) для Player
-            levels_in_levels_of_player = [i.level_id async for i in player_levels_of_player]
-
-            # Список уровней (ADRF... [pl.level.order for pl in levels_of_player] не сработает(новый поток или sync_to_async))
-            levels_from_db = asyncio.gather(
-                *[cls.dao.aget_one(cls._lvl_queryset, Level, i) for i in levels_in_levels_of_player])
-
-            # текущий уровень - максимальный из LevelPlayer.level
-            current_level_of_player = max([i for i in await levels_from_db], key=lambda x: x.order)
-            current_level_player = await cls.dao.aget_one(player_levels_of_player, 'level', current_level_of_player)
+            # текущий уровень - PlayerLevel с максимальным Level.order, одним запросом без загрузки всей истории
+            current_level_player = await (player.playerlevel_set.select_related("level")
+                                          .order_by("-level__order", "id").afirst())
             assert current_level_player, "Player have not PlayerLevel"
+            current_level_of_player = current_level_player.level
+
+            # compare-and-swap до первой записи: игрок изменился после чтения - транзакция откатывается и повторяется
+            if not await player.acompare_and_bump_version():
+                raise VersionConflict
 
             # фиксируем завершенный уровень
             if not current_level_player.is_completed:
@@ -154,7 +348,7 @@ class PlayerLevelService(BaseService):
             current_level_player.completed = datetime.now().date()
             await current_level_player.asave()
             player.player_score += current_level_player.score
-            await player.asave()
+            await PlayerStats.abump(player.player_id, levels_completed=int(the_need_to_issue_an_award))
 
             try:
                 if the_need_to_issue_an_award:
@@ -162,10 +356,14 @@ class PlayerLevelService(BaseService):
                     current_level_prize_queryset = await cls.dao.aget_list(current_level_of_player.levelprize_set)
                     # выдача наград и сохранение в список для отправки
                     rewards_list = await LevelPrizeService.give_out_awards(current_level_prize_queryset, player)
+                # счет и награды одним UPDATE, версию уже увеличил compare-and-swap
+                await player.asave(update_fields=["player_score", "rewarded"])
 
                 new_level_model_or_None = await LevelService.find_new_level(current_level_of_player.order)
             except AssertionError as e:
                 if rewards_list:
+                    await OutboxService.enqueue(player.player_id, "reward", {
+                        "level": current_level_of_player.order, "rewards": rewards_list})
                     return {"result": False, "description":
                         f"{player.player_id} {player.player_name} {str(e)}, но завершил {current_level_of_player.order} и"
                         f"получил {rewards_list} в награду "}
@@ -184,54 +382,654 @@ class PlayerLevelService(BaseService):
                                                                  is_completed=False,
                                                                  )
         await new_player_level_from_next_level.asave()
+        await PlayerStats.abump(player.player_id, level_order=new_level_model_or_None.order)
+
+        await OutboxService.enqueue(player.player_id, "level_up", {
+            "completed": current_level_of_player.order, "level": new_level_model_or_None.order,
+            "score": player.player_score})
+        if rewards_list:
+            await OutboxService.enqueue(player.player_id, "reward", {
+                "level": current_level_of_player.order, "rewards": rewards_list})
+        if boost is not None:
+            await BoostService.add_boost(boost, player.player_id)
 
         return {"result": True, "description":
             f"{player.player_id} {player.player_name} поднял уровень до {new_level_model_or_None.order}"
             f" и получил {rewards_list} в награду за прохождение {current_level_of_player.order} "}
 
 
+class BatchLevelUpService(BaseService):
+    """Level up of many players (tournament, season results) with the semantics of PlayerLevelService.level_up,
+    but set-based: per shard chunk a few reads and bulk writes in one transaction."""
+
+    @classmethod
+    async def level_up_many(cls, items: List[Tuple[UUID, Optional[int]]]) -> List[Dict[str, Union[str, bool]]]:
+        """``items`` - (player_id, score of the completed level or None), results in the same order"""
+        unique: Dict[UUID, Optional[int]] = {}
+        for player_id, score in items:
+            unique.setdefault(player_id, score)
+        by_alias: Dict[str, List[Tuple[UUID, Optional[int]]]] = {}
+        for player_id, score in unique.items():
+            by_alias.setdefault(shard_for(player_id), []).append((player_id, score))
+
+        def level_up_alias(alias: str) -> Dict[UUID, Dict[str, Union[str, bool]]]:
+            alias_results = {}
+            batch = by_alias[alias]
+            for start in range(0, len(batch), settings.BATCH_LEVEL_UP_CHUNK):
+                alias_results.update(cls.level_up_chunk(alias, batch[start:start + settings.BATCH_LEVEL_UP_CHUNK]))
+            return alias_results
+
+        results: Dict[UUID, Dict[str, Union[str, bool]]] = {}
+        for alias_results in await cls.dao.ascatter(level_up_alias, list(by_alias)):
+            results.update(alias_results)
+
+        seen = set()
+        ordered = []
+        for player_id, _ in items:
+            if player_id in seen:
+                ordered.append({"player_id": str(player_id), "result": False,
+                                "description": f"{player_id} повторяется в пакете"})
+                continue
+            seen.add(player_id)
+            ordered.append({"player_id": str(player_id), **results[player_id]})
+        return ordered
+
+    @classmethod
+    def level_up_chunk(cls, alias: str, items: List[Tuple[UUID, Optional[int]]]
+                       ) -> Dict[UUID, Dict[str, Union[str, bool]]]:
+        today = datetime.now().date()
+        scores = dict(items)
+        results = {}
+        with transaction.atomic(using=alias):
+            players = cls._pl_queryset.using(alias).select_for_update().in_bulk(list(scores))
+            levels = {row["id"]: row for row in cls._lvl_queryset.using(alias).values("id", "order")}
+            orders = sorted({row["order"] for row in levels.values()})
+            first_level_of_order = {}
+            for row in sorted(levels.values(), key=lambda row: row["id"]):
+                first_level_of_order.setdefault(row["order"], row["id"])
+
+            # текущий уровень игрока - PlayerLevel с максимальным Level.order
+            current = {}
+            for pll in cls._pll_queryset.using(alias).filter(player_id__in=list(players)).order_by("id"):
+                known = current.get(pll.player_id)
+                if known is None or levels[pll.level_id]["order"] > levels[known.level_id]["order"]:
+                    current[pll.player_id] = pll
+
+            awarded_levels = {pll.level_id for pll in current.values() if not pll.is_completed}
+            prizes: Dict[int, List[str]] = {}
+            for row in (cls._lvl_prize_queryset.using(alias).filter(level_id__in=awarded_levels)
+                        .order_by("id").values("level_id", "prize__title")):
+                prizes.setdefault(row["level_id"], []).append(row["prize__title"])
+
+            stats = cls._stats_queryset.using(alias).in_bulk(list(players))
+            done_levels, new_levels, events, changed_stats = [], [], [], []
+            for player_id in scores:
+                player = players.get(player_id)
+                if player is None:
+                    results[player_id] = {"result": False, "description": f"{player_id} {NotFound.default_detail}"}
+                    continue
+                pll = current.get(player_id)
+                if pll is None:
+                    results[player_id] = {"result": False, "description":
+                        f"{player.player_id} {player.player_name} Player have not PlayerLevel"}
+                    continue
+
+                rewards_list = []
+                completed_now = not pll.is_completed
+                if completed_now:
+                    pll.is_completed = True
+                    rewards_list = list(prizes.get(pll.level_id, []))
+                if scores[player_id] is not None:
+                    pll.score = scores[player_id]
+                pll.completed = today
+                done_levels.append(pll)
+                player.player_score += pll.score
+                if rewards_list:
+                    player.rewarded["rewards"] = player.rewarded.get("rewards", []) + rewards_list
+                player.version += 1
+
+                order = levels[pll.level_id]["order"]
+                next_orders = [o for o in orders if o > order]
+                player_stats = stats.get(player_id) or PlayerStats(player_id=player_id, max_level_order=order)
+                player_stats.levels_completed += int(completed_now)
+                player_stats.prizes_received += len(rewards_list)
+                if next_orders:
+                    player_stats.max_level_order = max(player_stats.max_level_order, next_orders[0])
+                changed_stats.append(player_stats)
+                if not next_orders:
+                    if rewards_list:
+                        events.append(OutboxEvent(player_id=player.player_id, event_type="reward",
+                                                  payload={"level": order, "rewards": rewards_list}))
+                        results[player_id] = {"result": False, "description":
+                            f"{player.player_id} {player.player_name} У игрока максимальный уровень, но завершил "
+                            f"{order} иполучил {rewards_list} в награду "}
+                    else:
+                        results[player_id] = {"result": False, "description":
+                            f"{player.player_id} {player.player_name} У игрока максимальный уровень"}
+                    continue
+
+                new_levels.append(PlayerLevel(player_id=player.player_id,
+                                              level_id=first_level_of_order[next_orders[0]],
+                                              completed=today, is_completed=False))
+                events.append(OutboxEvent(player_id=player.player_id, event_type="level_up", payload={
+                    "completed": order, "level": next_orders[0], "score": player.player_score}))
+                if rewards_list:
+                    events.append(OutboxEvent(player_id=player.player_id, event_type="reward",
+                                              payload={"level": order, "rewards": rewards_list}))
+                results[player_id] = {"result": True, "description":
+                    f"{player.player_id} {player.player_name} поднял уровень до {next_orders[0]}"
+                    f" и получил {rewards_list} в награду за прохождение {order} "}
+
+            changed = [players[pll.player_id] for pll in done_levels]
+            cls._pll_queryset.using(alias).bulk_update(done_levels, ["is_completed", "completed", "score"])
+            cls._pl_queryset.using(alias).bulk_update(changed, ["player_score", "rewarded", "version"])
+            if changed:
+                PlayersListVersion.bump(alias)
+            cls._lvl_prize_queryset.using(alias).filter(level_id__in=awarded_levels).update(received=today)
+            cls._pll_queryset.using(alias).bulk_create(new_levels)
+            cls._outbox_queryset.using(alias).bulk_create(events)
+            cls._stats_queryset.using(alias).bulk_create(
+                changed_stats, update_conflicts=True, unique_fields=["player"],
+                update_fields=["levels_completed", "prizes_received", "max_level_order"])
+        return results
+
+
+class PlayerStatsService(BaseService):
+    fields = ["levels_completed", "prizes_received", "max_level_order", "boosts_granted"]
+    # PlayerService.get_players_rows: the stats row is joined into the player row
+    rows_fields = [f"stats__{field}" for field in fields]
+
+    @classmethod
+    def rebuild_chunk(cls, alias: str, after_pk: Optional[UUID]) -> Tuple[Optional[UUID], int]:
+        """Recount lifetime stats of the next keyset chunk of players from PlayerLevel, Boost, archives and rewards.
+        Players are locked, so concurrent level ups wait instead of being lost."""
+        with transaction.atomic(using=alias):
+            players = cls._pl_queryset.using(alias).select_for_update().order_by("pk")
+            if after_pk is not None:
+                players = players.filter(pk__gt=after_pk)
+            players = list(players.values("player_id", "rewarded")[:settings.STATS_REBUILD_CHUNK])
+            if not players:
+                return None, 0
+            ids = [row["player_id"] for row in players]
+
+            def count(queryset: QuerySet, **filters) -> Dict[UUID, int]:
+                return dict(queryset.using(alias).filter(player_id__in=ids, **filters).values("player_id")
+                            .annotate(n=Count("pk")).values_list("player_id", "n"))
+
+            completed = count(cls._pll_queryset, is_completed=True)
+            completed_archived = count(cls._pll_archive_queryset, is_completed=True)
+            boosts = count(cls._boost_queryset)
+            boosts_archived = count(cls._boost_archive_queryset)
+            # lifetime counters, like the ones kept on writes: levels of past seasons are in the archive
+            max_order = dict(cls._pll_archive_queryset.using(alias).filter(player_id__in=ids).values("player_id")
+                             .annotate(m=Max("level_order")).values_list("player_id", "m"))
+            for player_id, order in (cls._pll_queryset.using(alias).filter(player_id__in=ids).values("player_id")
+                                     .annotate(m=Max("level__order")).values_list("player_id", "m")):
+                max_order[player_id] = max(order, max_order.get(player_id, order))
+
+            cls._stats_queryset.using(alias).bulk_create(
+                [PlayerStats(player_id=pk, levels_completed=completed.get(pk, 0) + completed_archived.get(pk, 0),
+                             prizes_received=len((row["rewarded"] or {}).get("rewards", [])),
+                             max_level_order=max_order.get(pk) or 0,
+                             boosts_granted=boosts.get(pk, 0) + boosts_archived.get(pk, 0))
+                 for pk, row in zip(ids, players)],
+                update_conflicts=True, unique_fields=["player"], update_fields=cls.fields)
+        return ids[-1], len(ids)
+
+
+class ArchiveService(BaseService):
+
+    @classmethod
+    def archive_player_levels_chunk(cls, alias: str, after_id: int) -> Tuple[Optional[int], int]:
+        """Next keyset chunk of PlayerLevel after ``after_id``: completed, old and not the player's latest"""
+        ids = list(cls._pll_queryset.using(alias).filter(id__gt=after_id).order_by("id")
+                   .values_list("id", flat=True)[:settings.ARCHIVE_CHUNK_SIZE])
+        if not ids:
+            return None, 0
+        newer = cls._pll_queryset.using(alias).filter(player_id=OuterRef("player_id"), id__gt=OuterRef("id"))
+        candidates = cls._pll_queryset.using(alias).filter(
+            pk__in=ids, is_completed=True,
+            completed__lt=datetime.now().date() - timedelta(days=settings.ARCHIVE_PLAYER_LEVEL_DAYS),
+        ).filter(Exists(newer))
+        return ids[-1], PlayerLevelArchive.archive(candidates)
+
+    @classmethod
+    def archive_boosts_chunk(cls, alias: str, after_id: int) -> Tuple[Optional[int], int]:
+        """Next keyset chunk of Boost after ``after_id``: ended ARCHIVE_BOOST_DAYS ago"""
+        ids = list(cls._boost_queryset.using(alias).filter(id__gt=after_id).order_by("id")
+                   .values_list("id", flat=True)[:settings.ARCHIVE_CHUNK_SIZE])
+        if not ids:
+            return None, 0
+        candidates = cls._boost_queryset.using(alias).filter(
+            pk__in=ids, end_time__lt=datetime.now() - timedelta(days=settings.ARCHIVE_BOOST_DAYS))
+        return ids[-1], BoostArchive.archive(candidates)
+
+    @classmethod
+    @player_shard("player_id")
+    async def get_archived_boosts(cls, player_id: str) -> QuerySet:
+        return await cls.dao.aget_filtered_list(cls._boost_archive_queryset.order_by("id"), "player_id", player_id)
+
+    @classmethod
+    @player_shard("player_id")
+    async def get_archived_levels(cls, player_id: str) -> QuerySet:
+        return await cls.dao.aget_filtered_list(cls._pll_archive_queryset.order_by("id"), "player_id", player_id)
+
+
+class SeasonService(BaseService):
+
+    @classmethod
+    def first_level(cls, alias: str) -> Optional[Level]:
+        """Level every player starts the season at (same choice as set_levels_to_fresh_player)"""
+        return cls._lvl_queryset.using(alias).order_by("order", "id").first()
+
+    @classmethod
+    def season_since(cls, alias: str, season: str) -> Optional[datetime]:
+        """End of the previous reset: PlayerLevel rows archived after it belong to ``season``"""
+        return (cls._season_reset_queryset.using(alias).exclude(season=season).filter(finished__isnull=False)
+                .order_by("-finished").values_list("finished", flat=True).first())
+
+    @classmethod
+    def standings(cls, alias: str, season: str, players: List[Dict]) -> List[SeasonStanding]:
+        """Standings of the players (player_id, player_name, player_score rows): the current level and the levels
+        completed in the season, live and archived by `archive_history` since the previous reset"""
+        ids = [row["player_id"] for row in players]
+        level_orders = dict(cls._pll_queryset.using(alias).filter(player_id__in=ids).values("player_id")
+                            .annotate(m=Max("level__order")).values_list("player_id", "m"))
+        completed = defaultdict(int)
+        archived = cls._pll_archive_queryset.using(alias).filter(player_id__in=ids, is_completed=True)
+        since = cls.season_since(alias, season)
+        if since is not None:
+            archived = archived.filter(archived__gt=since)
+        for queryset in (cls._pll_queryset.using(alias).filter(player_id__in=ids, is_completed=True), archived):
+            for player_id, n in queryset.values("player_id").annotate(n=Count("pk")).values_list("player_id", "n"):
+                completed[player_id] += n
+        return [SeasonStanding(season=season, level_order=level_orders.get(row["player_id"]),
+                               levels_completed=completed[row["player_id"]], **row) for row in players]
+
+    @classmethod
+    def snapshot_chunk(cls, alias: str, season: str) -> Optional[int]:
+        """First pass: standings of the next keyset chunk of players, nothing is changed.
+        None when the standings of ``alias`` are complete, the reset of every shard starts after that."""
+        with transaction.atomic(using=alias):
+            progress, _ = cls._season_reset_queryset.using(alias).select_for_update().get_or_create(season=season)
+            if progress.snapshotted is not None:
+                return None
+            players = cls._pl_queryset.using(alias).order_by("pk")
+            if progress.snapshot_after_pk is not None:
+                players = players.filter(pk__gt=progress.snapshot_after_pk)
+            players = list(players.values("player_id", "player_name", "player_score")[:settings.SEASON_RESET_CHUNK])
+            if not players:
+                progress.snapshotted = datetime.now()
+                progress.save(update_fields=["snapshotted"])
+                return None
+            cls._standing_queryset.using(alias).bulk_create(cls.standings(alias, season, players),
+                                                            ignore_conflicts=True)
+            progress.snapshot_after_pk = players[-1]["player_id"]
+            progress.save(update_fields=["snapshot_after_pk"])
+        return len(players)
+
+    @classmethod
+    def reset_chunk(cls, alias: str, season: str, level: Level) -> Optional[int]:
+        """Second pass: reset the score of the next keyset chunk of players, move their levels and boosts
+        to the archives and start them at ``level``. None when the season is reset on ``alias``.
+
+        Players of the chunk are locked for one short transaction that also commits the progress, so an
+        interrupted reset continues after the last committed chunk and no player is reset twice.
+        Their standings are refreshed with the locked values: level ups after the snapshot are not lost.
+        Concurrent level ups of the chunk fail their version check and retry after the reset.
+        PlayerStats are lifetime counters and are not reset.
+        """
+        today = datetime.now().date()
+        with transaction.atomic(using=alias):
+            progress = cls._season_reset_queryset.using(alias).select_for_update().filter(season=season).first()
+            if progress is None or progress.snapshotted is None:
+                raise RuntimeError(f"{alias}: standings of season {season} are not snapshotted")
+            if progress.finished is not None:
+                return None
+            players = cls._pl_queryset.using(alias).select_for_update().order_by("pk")
+            if progress.after_pk is not None:
+                players = players.filter(pk__gt=progress.after_pk)
+            players = list(players.values("player_id", "player_name", "player_score")[:settings.SEASON_RESET_CHUNK])
+            if not players:
+                progress.finished = datetime.now()
+                progress.save(update_fields=["finished"])
+                return None
+            ids = [row["player_id"] for row in players]
+
+            cls._standing_queryset.using(alias).bulk_create(
+                cls.standings(alias, season, players), update_conflicts=True, unique_fields=["season", "player_id"],
+                update_fields=["player_name", "player_score", "level_order", "levels_completed"])
+            PlayerLevelArchive.archive(cls._pll_queryset.using(alias).filter(player_id__in=ids))
+            BoostArchive.archive(cls._boost_queryset.using(alias).filter(player_id__in=ids))
+            cls._pll_queryset.using(alias).bulk_create(
+                [PlayerLevel(player_id=pk, level_id=level.id, completed=today, is_completed=False) for pk in ids])
+            cls._pl_queryset.using(alias).filter(pk__in=ids).update(player_score=0, version=F("version") + 1)
+            PlayersListVersion.bump(alias)
+            cls._outbox_queryset.using(alias).bulk_create(
+                [OutboxEvent(player_id=row["player_id"], event_type="season_reset",
+                             payload={"season": season, "score": row["player_score"]}) for row in players])
+
+            progress.after_pk = ids[-1]
+            progress.players += len(ids)
+            progress.save(update_fields=["after_pk", "players"])
+        return len(ids)
+
+    @staticmethod
+    def throttle(elapsed: float) -> float:
+        """Pause after a chunk that took ``elapsed`` seconds, so the reset keeps transactions open
+        at most SEASON_RESET_LOAD of the time"""
+        load = min(max(settings.SEASON_RESET_LOAD, 0.01), 1.0)
+        return elapsed * (1 - load) / load
+
+
+class IdempotencyService(BaseService):
+
+    @classmethod
+    @player_shard("player_id")
+    async def claim(cls, player_id: str, scope: str, key: str, fingerprint: str) -> Tuple[IdempotencyRecord, bool]:
+        """Pending record of the key, or the existing one (created=False). Player's expired records are
+        removed here, abandoned pending ones can be claimed again."""
+        now = datetime.now()
+        await cls._idempotency_queryset.filter(
+            Q(created__lt=now - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS))
+            | Q(status__isnull=True, created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_PENDING_TIMEOUT)),
+            player_id=player_id).adelete()
+        while True:
+            try:
+                return await cls.dao.acreate(cls._idempotency_queryset, player_id=player_id, scope=scope, key=key,
+                                             fingerprint=fingerprint), True
+            except IntegrityError:
+                pass
+            record = await cls._idempotency_queryset.filter(player_id=player_id, scope=scope, key=key).afirst()
+            if record is not None:
+                return record, False
+
+    @classmethod
+    @player_shard("player_id")
+    async def complete(cls, player_id: str, record: IdempotencyRecord, status: int, response: Dict) -> None:
+        await cls._idempotency_queryset.filter(pk=record.pk).aupdate(status=status, response=response)
+
+    @classmethod
+    @player_shard("player_id")
+    async def release(cls, player_id: str, record: IdempotencyRecord) -> None:
+        await cls._idempotency_queryset.filter(pk=record.pk).adelete()
+
+    @classmethod
+    def purge(cls, alias: str) -> int:
+        """Delete records of all players older than IDEMPOTENCY_TTL_HOURS in chunks (claim only cleans
+        the claiming player's ones)"""
+        expired = cls._idempotency_queryset.using(alias).filter(
+            created__lt=datetime.now() - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS))
+        total = 0
+        while True:
+            ids = list(expired.order_by("created").values_list("pk", flat=True)[:settings.ARCHIVE_CHUNK_SIZE])
+            if not ids:
+                return total
+            total += cls._idempotency_queryset.using(alias).filter(pk__in=ids).delete()[0]
+
+
+class AnalyticsService(BaseService):
+    """Daily new/active players and retention cohorts: rollups updated on login, reads never touch players"""
+
+    @classmethod
+    @player_shard("player_id")
+    async def register_visit(cls, player_id: UUID, first_entry: Optional[date]) -> bool:
+        """Login of the player today, False if it was already registered (one conditional UPDATE decides)"""
+        today = datetime.now().date()
+        updated = await cls._pl_queryset.filter(
+            Q(first_entry__isnull=True) | Q(last_entry__isnull=True) | Q(last_entry__lt=today), pk=player_id,
+        ).aupdate(last_entry=today, first_entry=Coalesce("first_entry", Value(today)), version=F("version") + 1)
+        if not updated:
+            return False
+        await PlayersListVersion.abump(shard_for(player_id))
+
+        try:
+            await cls.dao.acreate(cls._visit_queryset, player_id=player_id, day=today)
+        except IntegrityError:
+            pass
+        slot = random.randrange(settings.ANALYTICS_SLOTS)
+        await cls.increment(cls._daily_queryset, {"day": today, "slot": slot},
+                            new_players=int(first_entry is None), active_players=1)
+        await cls.increment(cls._cohort_queryset, {"cohort": first_entry or today, "day": today, "slot": slot},
+                            active_players=1)
+        return True
+
+    @staticmethod
+    async def increment(queryset: QuerySet, key: Dict, **counters: int) -> None:
+        """UPDATE counters + n, INSERT when the row is new"""
+        updates = {name: F(name) + value for name, value in counters.items()}
+        if await queryset.filter(**key).aupdate(**updates):
+            return
+        try:
+            await queryset.acreate(**key, **counters)
+        except IntegrityError:
+            await queryset.filter(**key).aupdate(**updates)
+
+    @classmethod
+    async def report(cls, since: date, until: date) -> Dict[str, list]:
+        """Rollups of days since..until and of the cohorts that started in them"""
+        daily = (cls._daily_queryset.filter(day__gte=since, day__lte=until).values("day")
+                 .annotate(new=Sum("new_players"), active=Sum("active_players")).order_by("day"))
+        cohorts = (cls._cohort_queryset.filter(cohort__gte=since, cohort__lte=until).values("cohort", "day")
+                   .annotate(active=Sum("active_players")).order_by("cohort", "day"))
+        days = [row async for row in daily]
+        new_of_day = {row["day"]: row["new"] for row in days}
+        retention: Dict[date, Dict[str, int]] = {}
+        async for row in cohorts:
+            retention.setdefault(row["cohort"], {})[str((row["day"] - row["cohort"]).days)] = row["active"]
+        return {
+            "daily": [{"day": row["day"].isoformat(), "new_players": row["new"], "active_players": row["active"]}
+                      for row in days],
+            "cohorts": [{"cohort": cohort.isoformat(), "new_players": new_of_day.get(cohort, 0), "retention": days_n}
+                        for cohort, days_n in retention.items()],
+        }
+
+    @classmethod
+    def rebuild(cls) -> Tuple[int, int]:
+        """Recount rollups of closed days from PlayerVisit and Player.first_entry of every shard, returns rows written.
+
+        register_visit only increments rows of the current day, so rows of earlier days can be replaced without
+        losing concurrent increments; the current day (and the first minutes after midnight, for visits
+        started the day before) is left to the live counters."""
+        closed_before = (datetime.now() - timedelta(minutes=5)).date()
+        new, active, cohorts = defaultdict(int), defaultdict(int), defaultdict(int)
+        for alias in player_databases(Player):
+            for day, n in (cls._pl_queryset.using(alias).filter(first_entry__lt=closed_before).values("first_entry")
+                           .annotate(n=Count("pk")).values_list("first_entry", "n")):
+                new[day] += n
+            visits = cls._visit_queryset.using(alias).filter(day__lt=closed_before)
+            for day, n in visits.values("day").annotate(n=Count("pk")).values_list("day", "n"):
+                active[day] += n
+            first_entry = cls._pl_queryset.using(alias).filter(pk=OuterRef("player_id")).values("first_entry")[:1]
+            for cohort, day, n in (visits.annotate(cohort=Subquery(first_entry))
+                                   .filter(cohort__isnull=False).values("cohort", "day")
+                                   .annotate(n=Count("pk")).values_list("cohort", "day", "n")):
+                cohorts[(cohort, day)] += n
+
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            cls._daily_queryset.using(DEFAULT_DB_ALIAS).filter(day__lt=closed_before).delete()
+            cls._cohort_queryset.using(DEFAULT_DB_ALIAS).filter(day__lt=closed_before).delete()
+            cls._daily_queryset.using(DEFAULT_DB_ALIAS).bulk_create(
+                [DailyActivity(day=day, new_players=new.get(day, 0), active_players=active.get(day, 0))
+                 for day in sorted(set(new) | set(active))], batch_size=1000)
+            cls._cohort_queryset.using(DEFAULT_DB_ALIAS).bulk_create(
+                [RetentionCohort(cohort=cohort, day=day, active_players=n)
+                 for (cohort, day), n in sorted(cohorts.items())], batch_size=1000)
+        return len(set(new) | set(active)), len(cohorts)
+
+
+class FunnelService(BaseService):
+    """Level funnel of the current season: completion and drop-off per Level.order, scores, days between levels.
+    Columns of PlayerLevel are read in player keyset chunks and aggregated with NumPy in bounded memory."""
+    columns = ["player_id", "level__order", "is_completed", "score", "completed"]
+    archive_columns = ["player_id", "level_order", "is_completed", "score", "completed"]
+
+    @classmethod
+    def season_archive(cls, alias: str) -> QuerySet:
+        """Archived PlayerLevel rows of the current season: archived after the last season reset finished"""
+        archive = cls._pll_archive_queryset.using(alias)
+        reset = cls._season_reset_queryset.using(alias).order_by("-started").first()
+        if reset is not None:
+            archive = archive.filter(archived__gt=reset.finished or reset.started)
+        return archive
+
+    @classmethod
+    def compute_alias(cls, alias: str, orders: List[int]):
+        from players.funnel import FunnelAccumulator  # lazy: numpy is only needed for the funnel
+
+        funnel = FunnelAccumulator(orders)
+        archive = cls.season_archive(alias)
+        after_pk = None
+        while True:
+            players = cls._pl_queryset.using(alias).order_by("pk")
+            if after_pk is not None:
+                players = players.filter(pk__gt=after_pk)
+            ids = list(players.values_list("pk", flat=True)[:settings.FUNNEL_CHUNK])
+            if not ids:
+                return funnel
+            bounds = {"player_id__lte": ids[-1]}
+            if after_pk is not None:
+                bounds["player_id__gt"] = after_pk
+            rows = list(cls._pll_queryset.using(alias).filter(**bounds).values_list(*cls.columns))
+            rows += archive.filter(**bounds).values_list(*cls.archive_columns)
+            if rows:
+                funnel.add(*zip(*rows))
+            after_pk = ids[-1]
+
+    @classmethod
+    async def compute(cls) -> Dict:
+        orders = list((await cache.aget_or_set("level", LevelService.level_orders)).values())
+        # aliases are resolved here, in the request's context: a replica for LevelFunnelView
+        parts = await cls.dao.ascatter(partial(cls.compute_alias, orders=orders), player_databases(Player))
+        funnel = parts[0]
+        for part in parts[1:]:
+            funnel.merge(part)
+        return funnel.result()
+
+    @classmethod
+    async def get(cls) -> Dict:
+        """Kept by the worker until the level catalog changes or a season is reset, at most FUNNEL_CACHE_TTL seconds
+        (level ups change it all the time)"""
+        return await cache.aget_or_set("funnel", cls.compute, depends_on=("level", "season"),
+                                       max_age=settings.FUNNEL_CACHE_TTL)
+
+
+class OutboxService(BaseService):
+
+    @classmethod
+    async def enqueue(cls, player_id: Union[str, UUID], event_type: str, payload: Dict) -> OutboxEvent:
+        """Call inside the transaction of the state change (aatomic) - event commits with it"""
+        return await cls.dao.acreate(cls._outbox_queryset, player_id=player_id, event_type=event_type,
+                                     payload=payload)
+
+    @classmethod
+    @player_shard("player_id")
+    async def events_after(cls, player_id: str, after_id: int) -> List[Dict]:
+        """Events of the player after ``after_id`` (SSE Last-Event-ID), as delivered to sinks"""
+        queryset = cls._outbox_queryset.filter(player_id=player_id, id__gt=after_id).order_by("id")
+        return [event.as_message() async for event in queryset[:settings.PUSH_REPLAY_LIMIT]]
+
+
+class ETagService(BaseService):
+    """Conditional GET: ETags from Player.version, checked with one indexed lookup"""
+
+    @staticmethod
+    def make(request: Request, resource: str, version: Union[int, str]) -> str:
+        # дата: boost_required меняется раз в день без записи; формат: json и browsable api различаются
+        return f'W/"{resource}-{version}-{datetime.now().date().isoformat()}-{request.accepted_renderer.format}"'
+
+    @staticmethod
+    def matches(request: Request, etag: str) -> bool:
+        header = request.headers.get("If-None-Match")
+        if not header:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    @classmethod
+    @player_shard("player_id")
+    async def player_version(cls, player_id: str) -> Optional[Tuple[int, bool]]:
+        """(version, fresh) of player; not fresh - profile read would expire boosts or register the login"""
+        stale_boosts = cls._boost_queryset.filter(player_id=OuterRef("pk")).filter(
+            Q(end_time__lte=datetime.now()) | Q(end_time__isnull=True) | Q(active=False))
+        row = await (cls._pl_queryset.filter(pk=player_id)
+                     .annotate(stale=Exists(stale_boosts))
+                     .values_list("version", "stale", "last_entry", "first_entry").afirst())
+        if row is None:
+            return
+        version, stale, last_entry, first_entry = row
+        return version, not stale and first_entry is not None and last_entry == datetime.now().date()
+
+    @classmethod
+    async def players_version(cls) -> str:
+        """Sum of PlayersListVersion slots over player shards - changes on any player write, insert or delete"""
+        parts = await cls.dao.ascatter(
+            lambda alias: cls._list_version_queryset.using(alias).aggregate(total=Sum("version"))["total"] or 0,
+            player_databases(Player))
+        return str(sum(parts))
+
+
 class LevelPrizeService(BaseService):
     @classmethod
     async def give_out_awards(cls, level_prizes: QuerySet, player: Player) -> List[str]:
-        """Выдача наград за пройденный уровень"""
+        """Выдача наград за пройденный уровень, награды игрока сохраняет вызывающий"""
         rewards_list = []
-        async for lp in level_prizes:
-            prize = await cls.dao.aget_one(cls._prize_queryset, Prize, lp.prize_id)
+        level_prizes = [lp async for lp in level_prizes]
+        # одним запросом через DataLoader
+        prizes = await asyncio.gather(*[cls.dao.aget_one(cls._prize_queryset, Prize, lp.prize_id)
+                                        for lp in level_prizes])
+        for lp, prize in zip(level_prizes, prizes):
             rewards_list += [prize.title]
-            assert await player.set_rewards(prize.title), "Can't reward player"
             lp.received = datetime.now().date()
             await lp.asave()
+        if rewards_list:
+            player.add_rewards(*rewards_list)
+            await PlayerStats.abump(player.player_id, prizes_received=len(rewards_list))
         return rewards_list
 
 
 class LevelService(BaseService):
+    @classmethod
+    def level_orders(cls) -> Dict[int, int]:
+        """{level id: order} - the catalog changes rarely, every worker keeps it until a Level is saved/deleted"""
+        return dict(cls._lvl_queryset.values_list("id", "order"))
+
     @classmethod
     def get_level(cls, pk: str) -> int:
         """Получение данных в отдельном потоке, потому-что ADRF ... """
+        orders = cls.dao.t_pool(cache.get_or_set, "level", cls.level_orders)
+        if pk in orders:
+            return orders[pk]
         return cls.dao.t_pool(cls.dao.get_one, cls._lvl_queryset, "id", pk).order
 
     @classmethod
     async def find_new_level(cls, level: int) -> Optional[Model]:
         """Try to find level.order > that"""
-        levels_queryset = await cls.dao.aget_list(cls._lvl_queryset)
-        levels = [i.order async for i in levels_queryset]
-        assert any(filter(lambda x: x > level, levels)), "У игрока максимальный уровень"
-
-        for lvl in sorted(levels):
-            if lvl > level:
-                return await cls.dao.aget_one(cls._lvl_queryset, "order", lvl, ignore_logger=True)
+        orders = await cache.aget_or_set("level", cls.level_orders)
+        higher = [lvl for lvl in orders.values() if lvl > level]
+        assert higher, "У игрока максимальный уровень"
+        return await cls.dao.aget_one(cls._lvl_queryset, "order", min(higher), ignore_logger=True)
 
 
 class CSVService(BaseService):
 
     @classmethod
-    def csv_work(cls, players: list) -> StringIO:
+    def csv_work(cls, players: list, include_archive: bool = False) -> StringIO:
         def map_player(player):
             _dict = dict()
             _dict["player_id"] = player.player_id
             _dict["player_name"] = player.player_name
             _dict["levels"] = []
 
+            if include_archive:
+                archived = cls._pll_archive_queryset.using(player._state.db).filter(player_id=player.player_id)
+                for pll in archived.order_by("id"):
+                    _dict.get("levels").append(
+                        {"level_title": pll.level_title,
+                         "player_level_is_completed": pll.is_completed,
+                         "prize": [i.prize.title for i in cls._lvl_prize_queryset.using(player._state.db)
+                                   .filter(level_id=pll.level_id).select_related("prize")]})
+
             for pll in player.playerlevel_set.all():
                 _dict.get("levels").append(
                     {"level_title": pll.level.title,
@@ -251,38 +1049,52 @@ class CSVService(BaseService):
         return cloud_file
 
     @classmethod
-    async def export_to_csv(cls):
-        """ Экспорт данных игрока в CSV. """
+    @replica_reads
+    async def export_to_csv(cls, include_archive: bool = False):
+        """ Экспорт данных игрока в CSV, include_archive - вместе с архивными уровнями. """
         tasks: list[partial] = []
-        count = await cls.dao.aget_count(cls._pl_queryset)
         chunk = 500
+        aliases = player_databases(Player)  # все шарды игроков
+        count = sum([await cls.dao.aget_count(cls._pl_queryset.using(alias)) for alias in aliases])
 
         assert count > 0, "Empty player queryset"
         assert chunk > 50, "Chunk too small"
 
-        iterator = await cls.dao.aget_list_iterator(cls._pl_queryset, chunk)
-
-        assert isinstance(iterator, AsyncIterator), "returned not asyncio iterator"
+        _list = []
+        for alias in aliases:
+            iterator = await cls.dao.aget_list_iterator(cls._pl_queryset.using(alias), chunk)
 
-        match count:
-            case x if x > chunk:
-                _list = []
-                async for p in iterator:
-                    _list.append(p)
-                    if len(_list) == chunk:
-                        tasks.append(partial(cls.csv_work, _list.copy()))
-                        _list = []
-                else:
-                    tasks.append(partial(cls.csv_work, _list))
+            assert isinstance(iterator, AsyncIterator), "returned not asyncio iterator"
 
-            case x if x < chunk:
-                _list = []
-                async for p in iterator:
-                    _list.append(p)
-                else:
-                    tasks.append(partial(cls.csv_work, _list))
+            async for p in iterator:
+                _list.append(p)
+                if len(_list) == chunk:
+                    tasks.append(partial(cls.csv_work, _list.copy(), include_archive))
+                    _list = []
+        if _list:
+            tasks.append(partial(cls.csv_work, _list, include_archive))
 
         result = await cls.dao.async_processes_work(asyncio.get_running_loop(), tasks)
         assert result, "empty result after asyncio processes"
+        import pandas as pd  # lazy: heavy import, only needed for the export
+
         csv_pd_list = [pd.read_csv(i) for i in result]
         return pd.concat(csv_pd_list, ignore_index=True)
+
+
+class DatabaseService(BaseService):
+
+    @classmethod
+    def pool_stats(cls, alias: str = "default") -> Dict[str, Union[str, int, bool]]:
+        """Connection pool usage of this worker process"""
+        connection = connections[alias]
+        pool = getattr(connection, "pool", None)
+        if pool is None:
+            return {"alias": alias, "pooled": False, "conn_max_age": connection.settings_dict["CONN_MAX_AGE"]}
+        return {"alias": alias, "pooled": True, **pool.get_stats()}
+
+    @classmethod
+    def pools_stats(cls) -> List[Dict[str, Union[str, int, bool]]]:
+        """pool_stats of every database the worker connects to: default, player shards and replicas"""
+        aliases = dict.fromkeys([DEFAULT_DB_ALIAS, *settings.PLAYER_SHARDS, *settings.REPLICA_DATABASES])
+        return [cls.pool_stats(alias) for alias in aliases]
@@ -0,0 +1,49 @@
+import copy
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from players.invalidation import invalidate_on_commit
+from players.models import Level, Prize, LevelPrize, Player, PlayersListVersion
+from players.routers import is_sharded
+
+
+@receiver(post_save, sender=Level)
+@receiver(post_save, sender=Prize)
+@receiver(post_save, sender=LevelPrize)
+def replicate_catalog_save(sender, instance, using, raw=False, **kwargs):
+    """Copy catalog rows written to default to every player shard"""
+    if raw or using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    for alias in settings.PLAYER_SHARDS:
+        copy.copy(instance).save(using=alias)
+
+
+@receiver(post_delete, sender=Level)
+@receiver(post_delete, sender=Prize)
+@receiver(post_delete, sender=LevelPrize)
+def replicate_catalog_delete(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    for alias in settings.PLAYER_SHARDS:
+        sender.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+@receiver(post_save, sender=Level)
+@receiver(post_delete, sender=Level)
+@receiver(post_save, sender=Prize)
+@receiver(post_delete, sender=Prize)
+def invalidate_catalog(sender, using, **kwargs):
+    """Worker caches of levels/prizes (LevelService); LevelPrize.received written by level_up isn't cached"""
+    if using == DEFAULT_DB_ALIAS:
+        invalidate_on_commit(sender._meta.model_name, using)
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def bump_players_list(sender, instance, using, created=True, **kwargs):
+    """New and deleted players change the list; updates bump it with Player.version"""
+    if created:
+        PlayersListVersion.bump(using)
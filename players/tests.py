@@ -1,2 +1,1034 @@
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from datetime import datetime, date, timedelta
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, connections, transaction
+from django.db.models import aprefetch_related_objects
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from players import admission, profiling
+from players.DAO import AsyncDAO, DataLoader, current_loader, loader_scope
+from players.async_atomic import aatomic
+from players.funnel import FunnelAccumulator
+from players.middleware import ProfilingMiddleware
+from players import invalidation
+from players.invalidation import cache, FileInvalidationBus, PostgresInvalidationBus, VersionedCache
+from players.models import (Player, Boost, Level, PlayerLevel, PlayerStats, OutboxEvent, BoostArchive,
+                            IdempotencyRecord, Prize, LevelPrize, PlayerVisit, PlayerLevelArchive, SeasonReset,
+                            SeasonStanding, CacheVersion)
+from players import push
+from players.outbox import OutboxDispatcher, Sink, PushSink
+from players.routers import shard_for, use_player_shard, PrimaryReplicaRouter
+from players.renderers import FastJSONRenderer
+from players.serializers import PlayerSerializer, PlayersListSerializer, PlayerRowsSerializer
+from players.services import (PlayerService, PlayerSearchService, ETagService, PlayerLevelService, IdempotencyService,
+                              VersionConflict, BoostService, BatchLevelUpService, PlayerStatsService,
+                              OutboxService, AnalyticsService, SeasonService, FunnelService, LevelService)
+
+
+class PlayerRowsSerializerTest(TransactionTestCase):
+    """Fast path (values() rows + orjson) must give the same bytes as serializers + JSONRenderer"""
+
+    def setUp(self):
+        first = Level.objects.create(title="first", order=1)
+        second = Level.objects.create(title="second", order=2)
+        self.player = Player.objects.create(player_id=uuid4(), player_name="игрок\u2028",
+                                            last_boost_date=date(2025, 1, 1),
+                                            player_score=10, rewarded={"rewards": ["приз"]})
+        Player.objects.create(player_id=uuid4(), player_name="fresh")
+        Boost.objects.create(player=self.player, title="boost", description=None,
+                             get_time=datetime(2025, 1, 1, 10, 0, 0, 123456),
+                             end_time=datetime(2025, 1, 1, 11, 0, 0, 123456))
+        Boost.objects.create(player=self.player, title="manual", active=False, get_time=datetime(2025, 1, 2))
+        PlayerLevel.objects.create(player=self.player, level=first, completed=date(2025, 1, 1),
+                                   is_completed=True, score=10)
+        PlayerStats.objects.create(player=self.player, levels_completed=1, prizes_received=1, max_level_order=2,
+                                   boosts_granted=2)
+        PlayerLevel.objects.create(player=self.player, level=second, completed=date(2025, 1, 2))
+
+    async def test_profile_is_byte_identical(self):
+        player = await Player.objects.aget(pk=self.player.pk)
+        await aprefetch_related_objects([player], "stats")
+        expected = JSONRenderer().render(await PlayerSerializer(player).adata)
+
+        rows = await PlayerService.get_player_rows(player)
+        self.assertEqual(FastJSONRenderer().render(PlayerRowsSerializer().data(*rows)[0]), expected)
+
+    async def test_list_is_byte_identical(self):
+        players = [player async for player in Player.objects.prefetch_related("stats")]
+        expected = JSONRenderer().render(await PlayersListSerializer(players, many=True).adata)
+
+        rows = await PlayerService.get_all_players_rows()
+        self.assertEqual(FastJSONRenderer().render(PlayerRowsSerializer("player_level").data(*rows)), expected)
+
+    async def test_by_ids_keeps_request_order(self):
+        missing = uuid4()
+        ids = [missing, self.player.pk]
+        rows = await PlayerService.get_players_rows_by_ids(ids, with_boosts=False, with_levels=False)
+        data = PlayerRowsSerializer().data_by_ids(ids, *rows, fields=["player_score"])
+        self.assertEqual(data, [{"player_id": str(missing), "not_found": True},
+                                {"player_id": str(self.player.pk), "player_score": 10}])
+
+
+@override_settings(PLAYER_SHARDS=["test_shard_1", "test_shard_2"])
+class PlayerSearchTest(TransactionTestCase):
+    """Search ranges on sqlite shards and keyset pages merged across them"""
+    databases = "__all__"
+
+    def setUp(self):
+        # even UUID.int on test_shard_1, odd on test_shard_2
+        names = ["aa", "ab", "ab~", "abc", "abz", "ac", "b"]
+        for number, name in enumerate(names, start=1):
+            Player(player_id=UUID(int=number), player_name=name).save()
+        for player_id in ("12340000-0000-0000-0000-000000000001", "1234ffff-ffff-ffff-ffff-fffffffffff2",
+                          "12350000-0000-0000-0000-000000000000"):
+            Player(player_id=UUID(player_id), player_name=f"id {player_id}").save()
+
+    def test_name_prefix_upper_bound(self):
+        queryset = PlayerSearchService.filter(Player.objects.using("test_shard_1"), "name", "ab")
+        sql, params = queryset.query.sql_with_params()
+        self.assertNotIn("LIKE", sql)
+        self.assertEqual(params, ("ab", "ac"))
+        rows = []
+        for alias in ("test_shard_1", "test_shard_2"):
+            rows += PlayerSearchService.filter(Player.objects.using(alias), "name", "ab").values_list(
+                "player_name", flat=True)
+        self.assertEqual(sorted(rows), ["ab", "abc", "abz", "ab~"])
+
+    def test_id_prefix_range(self):
+        low, high = PlayerSearchService.id_prefix_range("1234-")
+        self.assertEqual(low, UUID("12340000-0000-0000-0000-000000000000"))
+        self.assertEqual(high, UUID("1234ffff-ffff-ffff-ffff-ffffffffffff"))
+        with self.assertRaises(ValueError):
+            PlayerSearchService.id_prefix_range("12g")
+
+    async def test_id_prefix_is_merged_across_shards(self):
+        page = await PlayerSearchService.search("id", "1234", limit=10)
+        self.assertEqual([str(row["player_id"]) for row in page["results"]],
+                         ["12340000-0000-0000-0000-000000000001", "1234ffff-ffff-ffff-ffff-fffffffffff2"])
+        self.assertIsNone(page["next"])
+
+    def test_cursor_round_trip(self):
+        row = {"player_name": "abc", "player_id": UUID(int=4)}
+        self.assertEqual(PlayerSearchService.decode_cursor(PlayerSearchService.encode_cursor(row)),
+                         ("abc", UUID(int=4)))
+
+    async def test_pages_are_merged_across_shards(self):
+        page = await PlayerSearchService.search("name", "a", limit=3)
+        self.assertEqual([row["player_name"] for row in page["results"]], ["aa", "ab", "abc"])
+        self.assertEqual(PlayerSearchService.decode_cursor(page["next"]), ("abc", UUID(int=4)))
+        page = await PlayerSearchService.search("name", "a", limit=3, cursor=page["next"])
+        self.assertEqual([row["player_name"] for row in page["results"]], ["abz", "ab~", "ac"])
+        self.assertEqual({shard_for(row["player_id"]) for row in page["results"]}, {"test_shard_1", "test_shard_2"})
+        self.assertIsNone(page["next"])
+
+    async def test_view_next_page(self):
+        response = await AsyncClient().get("/players/search", {"q": "ab", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+        response = await AsyncClient().get("/players/search", {"q": "ab", "limit": 2, "cursor": first["next"]})
+        self.assertEqual([row["player_name"] for row in first["results"] + response.json()["results"]],
+                         ["ab", "abc", "abz", "ab~"])
+        self.assertIsNone(response.json()["next"])
+
+
+@override_settings(PLAYER_SHARDS=["test_shard_1", "test_shard_2"])
+class ShardRoutingTest(TransactionTestCase):
+    """Player data on the shard of its player_id, catalog copied to every shard"""
+    databases = "__all__"
+
+    def setUp(self):
+        # UUID.int % 2 picks the shard; save() routes by the instance, QuerySet.create() needs use_player_shard
+        self.first = Player(player_id=UUID(int=2), player_name="first")
+        self.first.save()
+        with use_player_shard(UUID(int=3)):
+            self.second = Player.objects.create(player_id=UUID(int=3), player_name="second")
+
+    def test_shard_for(self):
+        self.assertEqual(shard_for(self.first.pk), "test_shard_1")
+        self.assertEqual(shard_for(str(self.second.pk)), "test_shard_2")
+
+    def test_instance_is_written_to_its_shard(self):
+        self.assertEqual(self.first._state.db, "test_shard_1")
+        self.assertTrue(Player.objects.using("test_shard_2").filter(pk=self.second.pk).exists())
+        self.assertFalse(Player.objects.using("test_shard_1").filter(pk=self.second.pk).exists())
+        self.assertFalse(Player.objects.using("default").exists())
+
+    def test_current_shard_routes_queries(self):
+        with use_player_shard(self.second.pk):
+            self.assertTrue(Player.objects.filter(pk=self.second.pk).exists())
+            self.assertFalse(Player.objects.filter(pk=self.first.pk).exists())
+
+    def test_instance_hint_wins_over_current_shard(self):
+        with use_player_shard(self.second.pk):
+            self.first.player_name = "renamed"
+            self.first.save()
+        self.assertEqual(Player.objects.using("test_shard_1").get(pk=self.first.pk).player_name, "renamed")
+        self.assertFalse(Player.objects.using("test_shard_2").filter(pk=self.first.pk).exists())
+
+    def test_catalog_is_copied_to_shards(self):
+        level = Level.objects.create(title="first", order=1)
+        for alias in ("default", "test_shard_1", "test_shard_2"):
+            self.assertEqual(Level.objects.using(alias).get(pk=level.pk).order, 1)
+        level.delete()
+        for alias in ("default", "test_shard_1", "test_shard_2"):
+            self.assertFalse(Level.objects.using(alias).filter(pk=level.pk).exists())
+
+    async def test_scatter_gather_is_ordered(self):
+        third = Player(player_id=UUID(int=4), player_name="third")
+        await third.asave()
+        players = await PlayerService.get_all_players()
+        self.assertEqual([player.pk for player in players], [self.first.pk, self.second.pk, third.pk])
+
+    async def test_aatomic_uses_shard_of_argument(self):
+        @aatomic(using=lambda player_id, name, fail: shard_for(player_id))
+        async def rename(player_id, name, fail):
+            with use_player_shard(player_id):
+                await Player.objects.filter(pk=player_id).aupdate(player_name=name)
+            if fail:
+                raise ValueError
+
+        with self.assertRaises(ValueError):
+            await rename(self.second.pk, "rolled back", True)
+        await rename(self.first.pk, "committed", False)
+        self.assertEqual((await Player.objects.using("test_shard_2").aget(pk=self.second.pk)).player_name, "second")
+        self.assertEqual((await Player.objects.using("test_shard_1").aget(pk=self.first.pk)).player_name, "committed")
+
+
+@override_settings(PLAYER_SHARDS=["test_shard_1", "test_shard_2"])
+class DataLoaderTest(TransactionTestCase):
+    """Loads of one tick are batched per (model, alias), rows are kept in an identity map of the scope"""
+    databases = "__all__"
+
+    def setUp(self):
+        self.levels = [Level.objects.create(title=f"level {order}", order=order) for order in range(1, 4)]
+        self.prize = Prize.objects.create(title="prize")
+        self.players = [Player(player_id=UUID(int=number), player_name=f"player {number}") for number in range(2, 6)]
+        for player in self.players:
+            player.save()
+
+    def capture(self, *aliases):
+        return [CaptureQueriesContext(connections[alias]) for alias in aliases]
+
+    def test_one_query_per_model_and_alias(self):
+        loader = DataLoader()
+
+        async def load_player(player_id):
+            with use_player_shard(player_id):
+                return await loader.load(Player, player_id)
+
+        async def load():
+            return await asyncio.gather(*[loader.load(Level, level.pk) for level in self.levels],
+                                        loader.load(Prize, self.prize.pk), loader.load(Level, 0),
+                                        *[load_player(player.pk) for player in self.players])
+
+        default, first, second = self.capture("default", "test_shard_1", "test_shard_2")
+        with default, first, second:
+            loaded = async_to_sync(load)()
+        self.assertEqual([obj.pk if obj else None for obj in loaded],
+                         [level.pk for level in self.levels] + [self.prize.pk, None] +
+                         [player.pk for player in self.players])
+        self.assertEqual((len(default), len(first), len(second)), (2, 1, 1))
+
+    def test_identity_map(self):
+        loader = DataLoader()
+
+        async def load():
+            return await loader.load(Level, self.levels[0].pk), await loader.load(Level, str(self.levels[0].pk))
+
+        with self.capture("default")[0] as queries:
+            first, second = async_to_sync(load)()
+        self.assertIs(first, second)
+        self.assertEqual(len(queries), 1)
+
+    async def test_scope_is_reset_after_aatomic(self):
+        outer = DataLoader()
+        token = current_loader.set(outer)
+        inner = []
+
+        @aatomic()
+        async def load(fail):
+            inner.append(current_loader.get())
+            await current_loader.get().load(Level, self.levels[0].pk)
+            if fail:
+                raise ValueError
+
+        try:
+            await load(False)
+            self.assertIs(current_loader.get(), outer)
+            with self.assertRaises(ValueError):
+                await load(True)
+            self.assertIs(current_loader.get(), outer)
+        finally:
+            current_loader.reset(token)
+        self.assertIsNone(current_loader.get())
+        self.assertEqual(len({id(loader) for loader in inner + [outer]}), 3)
+        self.assertEqual(outer._identity, {})
+
+    async def test_loader_scope(self):
+        @loader_scope
+        async def scoped():
+            return current_loader.get()
+
+        self.assertIsInstance(await scoped(), DataLoader)
+        self.assertIsNone(current_loader.get())
+
+
+class ReplicaWriteTest(TransactionTestCase):
+    """A player read from a replica (test_shard_1 stands in for it) is written to the primary"""
+    databases = "__all__"
+
+    def setUp(self):
+        self.player = Player.objects.create(player_id=uuid4(), player_name="player")
+        Player.objects.using("test_shard_1").bulk_create([Player(player_id=self.player.pk, player_name="player")])
+
+    def test_version_is_bumped_on_primary(self):
+        player = Player.objects.using("test_shard_1").get(pk=self.player.pk)
+        player.bump_version()
+        self.assertEqual(Player.objects.using("default").get(pk=self.player.pk).version, 1)
+        self.assertEqual(Player.objects.using("test_shard_1").get(pk=self.player.pk).version, 0)
+
+    def test_save_bumps_version_in_the_same_update(self):
+        player = Player.objects.using("test_shard_1").get(pk=self.player.pk)
+        player.player_score = 10
+        with CaptureQueriesContext(connection) as queries:
+            player.save()
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "players_player"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(player.version, 1)
+        self.assertEqual(Player.objects.using("default").values_list("player_score", "version").get(
+            pk=self.player.pk), (10, 1))
+
+    async def test_rewards_bump_version_once(self):
+        player = await Player.objects.aget(pk=self.player.pk)
+        self.assertTrue(await player.set_rewards("first", "second"))
+        player = await Player.objects.aget(pk=self.player.pk)
+        self.assertEqual(player.rewarded["rewards"], ["first", "second"])
+        self.assertEqual(player.version, 1)
+
+    async def test_inactive_boosts_are_archived_on_primary(self):
+        for alias in ("default", "test_shard_1"):
+            await Boost.objects.using(alias).acreate(player_id=self.player.pk, title="old", active=False,
+                                                     get_time=datetime(2025, 1, 1))
+        player = await Player.objects.using("test_shard_1").aget(pk=self.player.pk)
+        self.assertTrue(await player.remove_inactive)
+        self.assertFalse(await Boost.objects.using("default").aexists())
+        self.assertEqual(await BoostArchive.objects.using("default").acount(), 1)
+        self.assertTrue(await Boost.objects.using("test_shard_1").aexists())
+        self.assertFalse(await BoostArchive.objects.using("test_shard_1").aexists())
+
+
+class ReplicaLagTest(TransactionTestCase):
+    """Lag of a postgres replica is queried outside of the event loop"""
+
+    class PostgresReplica:
+        vendor = "postgresql"
+
+        def __init__(self, lag=1.5):
+            self.lag = lag
+            self.threads = []
+
+        def cursor(self):
+            replica = self
+
+            class Cursor:
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *exc):
+                    return False
+
+                def execute(self, sql):
+                    replica.threads.append(threading.current_thread())
+
+                def fetchone(self):
+                    return (replica.lag,)
+
+            return Cursor()
+
+        def close(self):
+            pass
+
+    def setUp(self):
+        self.replica = self.PostgresReplica()
+        patcher = patch("players.routers.connections", {"replica_1": self.replica, "default": connection})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(PrimaryReplicaRouter._lag.clear)
+        PrimaryReplicaRouter._lag.clear()
+
+    def test_checked_in_sync_code(self):
+        self.assertEqual(PrimaryReplicaRouter.replica_lag("replica_1"), 1.5)
+        # cached for REPLICA_LAG_CHECK_INTERVAL
+        self.assertEqual(PrimaryReplicaRouter.replica_lag("replica_1"), 1.5)
+        self.assertEqual(self.replica.threads, [threading.current_thread()])
+
+    async def test_refreshed_in_background_on_event_loop(self):
+        self.assertEqual(PrimaryReplicaRouter.replica_lag("replica_1"), float("inf"))
+        await asyncio.wrap_future(PrimaryReplicaRouter._refreshing["replica_1"])
+        self.assertEqual(PrimaryReplicaRouter.replica_lag("replica_1"), 1.5)
+        self.assertEqual(len(self.replica.threads), 1)
+        self.assertNotEqual(self.replica.threads[0], threading.current_thread())
+
+    @override_settings(REPLICA_DATABASES=["replica_1"])
+    async def test_replica_view(self):
+        # primary while the lag is unknown or too high
+        self.replica.lag = 100
+        for _ in range(2):
+            response = await AsyncClient().get("/players/all")
+            self.assertEqual(response.status_code, 200)
+            await asyncio.wrap_future(PrimaryReplicaRouter._refreshing["replica_1"])
+        self.assertTrue(self.replica.threads)
+        self.assertNotIn(threading.current_thread(), self.replica.threads)
+
+
+@override_settings(REPLICA_DATABASES=["test_shard_1"])
+class ReplicaReadTest(TransactionTestCase):
+    """read_replica views read from a replica (test_shard_1 stands in for it), also in executor threads"""
+    databases = "__all__"
+
+    def setUp(self):
+        self.player = Player(player_id=uuid4(), player_name="replica")
+        Player.objects.using("test_shard_1").bulk_create([self.player])
+
+    async def test_by_ids(self):
+        url = f"/players/by_ids?ids={self.player.pk}&fields=player_name"
+        response = await AsyncClient().get(url)
+        self.assertEqual(response.json(), [{"player_id": str(self.player.pk), "player_name": "replica"}])
+        # pinned to the primary after a write
+        client = AsyncClient()
+        client.cookies["db_primary"] = "1"
+        response = await client.get(url)
+        self.assertEqual(response.json(), [{"player_id": str(self.player.pk), "not_found": True}])
+
+
+class PlayersListVersionTest(TransactionTestCase):
+    """ETag of the list changes on player writes without scanning players"""
+
+    async def test_version_changes_on_writes(self):
+        before = await ETagService.players_version()
+        player = Player(player_id=uuid4(), player_name="player")
+        await player.asave()
+        created = await ETagService.players_version()
+        await player.abump_version()
+        bumped = await ETagService.players_version()
+        await player.adelete()
+        deleted = await ETagService.players_version()
+        self.assertEqual(len({before, created, bumped, deleted}), 4)
+
+
+class OutboxDispatcherTest(TransactionTestCase):
+    """Sinks are called outside of the claim transaction, failures are rescheduled"""
+
+    class RecordingSink(Sink):
+        def __init__(self, fail=False):
+            self.fail = fail
+            self.batches = []
+
+        def send(self, messages):
+            self.batches.append((connection.in_atomic_block, [message["id"] for message in messages]))
+            if self.fail:
+                raise OSError("down")
+
+    def setUp(self):
+        self.events = [OutboxEvent.objects.create(player_id=uuid4(), event_type="level_up") for _ in range(2)]
+
+    def test_send_outside_transaction(self):
+        sink = self.RecordingSink()
+        self.assertEqual(OutboxDispatcher([sink], 10, 3).dispatch("default"), 2)
+        self.assertEqual(sink.batches, [(False, [event.pk for event in self.events])])
+        self.assertFalse(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+
+    def test_failed_batch_is_rescheduled(self):
+        sink = self.RecordingSink(fail=True)
+        self.assertEqual(OutboxDispatcher([sink], 10, 3).dispatch("default"), 0)
+        event = OutboxEvent.objects.get(pk=self.events[0].pk)
+        self.assertEqual((event.attempts, event.dispatched_at), (1, None))
+        self.assertGreater(event.next_attempt_at, datetime.now())
+        # waiting for retry: not sent again now
+        self.assertEqual(OutboxDispatcher([sink], 10, 3).dispatch("default"), 0)
+        self.assertEqual(len(sink.batches), 1)
+
+
+class BatchLevelUpTest(TransactionTestCase):
+    """Empty batches are rejected by validation, not by the scatter over shards"""
+
+    async def test_empty_lists(self):
+        for body in ({"players": []}, {"scores": []}):
+            response = await AsyncClient().post("/players/level_up/batch", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400, body)
+
+    async def test_scatter_without_aliases(self):
+        self.assertEqual(await AsyncDAO.ascatter(lambda alias: alias, []), [])
+
+
+class FileBusTest(TransactionTestCase):
+    """An event enqueued in a transaction reaches the SSE subscriber of another process (bus instance)
+    when dispatch_outbox delivers it"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        push._bus = None
+
+    def tearDown(self):
+        push._bus = None
+        os.remove(self.path)
+
+    async def test_event_reaches_subscriber(self):
+        player_id = str(uuid4())
+        with override_settings(PUSH_BUS="players.push.FileBus", PUSH_FILE=self.path, PUSH_POLL=0.01):
+            worker = push.FileBus()
+            subscription = await worker.subscribe(player_id)
+            try:
+                event = await OutboxService.enqueue(player_id, "boost_granted", {"title": "boost"})
+                delivered = await sync_to_async(OutboxDispatcher([PushSink()], 10, 3).dispatch)("default")
+                message = await asyncio.wait_for(subscription.queue.get(), 5)
+            finally:
+                worker._listener.cancel()
+        self.assertEqual(delivered, 1)
+        self.assertIsNot(push._bus, worker)
+        self.assertEqual((message["id"], message["type"], message["player_id"]), (event.pk, "boost_granted", player_id))
+
+
+class InvalidationTest(TransactionTestCase):
+    """A catalog commit bumps the shared version, workers drop values cached under older versions
+    and bypass the cache until they have versions"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.cache = VersionedCache()
+
+    def tearDown(self):
+        invalidation._bus = None
+        os.remove(self.path)
+
+    @staticmethod
+    def use_bus(bus, ready=True):
+        # no listener thread: the test decides whether versions were received
+        bus._started, bus.ready = True, ready
+        invalidation._bus = bus
+        return bus
+
+    def test_commit_bumps_cache_version(self):
+        bus = self.use_bus(PostgresInvalidationBus())
+        notified = []
+        connection.ensure_connection()
+        # sqlite stand-in for NOTIFY
+        connection.connection.create_function(
+            "pg_notify", 2, lambda channel, payload: notified.append((channel, json.loads(payload))))
+        with transaction.atomic():
+            level = Level.objects.create(title="first", order=1)
+            self.assertFalse(CacheVersion.objects.exists())
+        Prize.objects.create(title="prize")
+        level.delete()
+        self.assertEqual(dict(CacheVersion.objects.values_list("key", "version")), {"level": 2, "prize": 1})
+        self.assertEqual(bus.versions, {"level": 2, "prize": 1})
+        self.assertEqual(notified, [("cache_invalidation", {"key": "level", "version": 1}),
+                                    ("cache_invalidation", {"key": "prize", "version": 1}),
+                                    ("cache_invalidation", {"key": "level", "version": 2})])
+
+    def test_rolled_back_change_is_not_invalidated(self):
+        bus = self.use_bus(FileInvalidationBus(self.path))
+        with self.assertRaises(ValueError), transaction.atomic():
+            Level.objects.create(title="first", order=1)
+            raise ValueError
+        self.assertEqual(bus.version("level"), 0)
+
+    def test_workers_drop_cached_catalog(self):
+        with override_settings(INVALIDATION_POLL=0.01):
+            worker = FileInvalidationBus(self.path)
+            invalidation._bus = worker
+            level = Level.objects.create(title="first", order=1)
+            deadline = time.monotonic() + 5
+            while worker.version("level") != 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.cache.get_or_set("level", LevelService.level_orders), {level.pk: 1})
+
+            # another worker changes the catalog
+            Level.objects.filter(pk=level.pk).update(order=5)
+            self.assertEqual(self.cache.get_or_set("level", LevelService.level_orders), {level.pk: 1})
+            FileInvalidationBus(self.path).invalidate("level")
+            while worker.version("level") != 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.cache.get_or_set("level", LevelService.level_orders), {level.pk: 5})
+
+    async def test_cache_is_bypassed_without_versions(self):
+        bus = self.use_bus(FileInvalidationBus(self.path), ready=False)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual([self.cache.get_or_set("level", compute) for _ in range(2)], [1, 2])
+        self.assertEqual(await self.cache.aget_or_set("level", compute), 3)
+        self.assertIsNone(bus.versioned_key("level"))
+        self.assertEqual(self.cache._values, {})
+
+        bus.ready = True
+        self.assertEqual([self.cache.get_or_set("level", compute) for _ in range(2)], [4, 4])
+        self.assertEqual(bus.versioned_key("level"), "level:0")
+
+
+class ProfilingTest(TransactionTestCase):
+    """A request with a valid X-Profile token writes a folded profile named in the response header,
+    bad and expired tokens are ignored"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(PROFILE_DIR=directory.name, PROFILE_INTERVAL=0.001, PROFILE_SAMPLE_RATE=0)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.directory = directory.name
+
+    @staticmethod
+    async def slow_response(request):
+        await sync_to_async(time.sleep, thread_sensitive=False)(0.05)
+        return HttpResponse("done")
+
+    async def test_valid_token_writes_profile(self):
+        request = RequestFactory().get("/players/search", headers={"X-Profile": profiling.make_token()})
+        response = await ProfilingMiddleware(self.slow_response)(request)
+        name = response["X-Profile"]
+        self.assertEqual(os.listdir(self.directory), [name])
+        self.assertRegex(name, r"-GET-players_search-\d+ms\.folded$")
+        with open(os.path.join(self.directory, name)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r"^[^;]+(;[^;]+)+ \d+$")
+        self.assertTrue(any(line.startswith("MainThread;") for line in lines))
+        self.assertTrue(profiling._active.acquire(blocking=False))
+        profiling._active.release()
+
+    async def test_view_returns_profile_name(self):
+        response = await AsyncClient().get("/players/search", {"q": "a"}, headers={"X-Profile": profiling.make_token()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(self.directory), [response["X-Profile"]])
+
+    async def test_bad_token_is_ignored(self):
+        expired = profiling.make_token()
+        for token, max_age in (("profile:bad:signature", 3600), (expired, -1)):
+            with override_settings(PROFILE_TOKEN_MAX_AGE=max_age):
+                request = RequestFactory().get("/players/search", headers={"X-Profile": token})
+                response = await ProfilingMiddleware(self.slow_response)(request)
+            self.assertFalse(response.has_header("X-Profile"))
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class LevelUpConflictTest(TransactionTestCase):
+    """A level up that lost the Player.version race is retried, after LEVEL_UP_RETRIES it is a 409"""
+
+    def setUp(self):
+        first = Level.objects.create(title="first", order=1)
+        Level.objects.create(title="second", order=2)
+        self.player = Player.objects.create(player_id=uuid4(), player_name="player")
+        PlayerLevel.objects.create(player=self.player, level=first, completed=date(2025, 1, 1))
+
+    async def test_conflict_is_retried(self):
+        with patch.object(Player, "acompare_and_bump_version", side_effect=[False, True]) as cas:
+            result = await PlayerLevelService.level_up(str(self.player.pk))
+        self.assertTrue(result["result"])
+        self.assertEqual(cas.await_count, 2)
+        self.assertEqual(await PlayerLevel.objects.filter(player_id=self.player.pk).acount(), 2)
+
+    @override_settings(LEVEL_UP_RETRIES=1)
+    async def test_conflict_after_retries(self):
+        with patch.object(Player, "acompare_and_bump_version", return_value=False) as cas:
+            with self.assertRaises(VersionConflict):
+                await PlayerLevelService.level_up(str(self.player.pk))
+            response = await AsyncClient().patch(f"/players/player/{self.player.pk}/level_up")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(cas.await_count, 4)
+        self.assertEqual(await PlayerLevel.objects.filter(player_id=self.player.pk).acount(), 1)
+
+
+class IdempotencyTest(TransactionTestCase):
+    """Repeated boost requests with the same Idempotency-Key are replayed, not applied twice"""
+
+    def setUp(self):
+        self.player = Player.objects.create(player_id=uuid4(), player_name="player")
+        self.url = f"/players/player/{self.player.pk}/boost"
+        self.client = AsyncClient()
+
+    async def post(self, key, **data):
+        return await self.client.post(self.url, {"title": "boost", "description": "d", "duration": 1, **data},
+                                      content_type="application/json", headers={"Idempotency-Key": key})
+
+    async def test_replay(self):
+        first = await self.post("key")
+        replayed = await self.post("key")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((replayed.status_code, replayed.json()), (201, first.json()))
+        self.assertEqual(replayed.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(await Boost.objects.filter(player_id=self.player.pk).acount(), 1)
+
+    async def test_key_of_another_request(self):
+        await self.post("key")
+        response = await self.post("key", duration=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(await Boost.objects.filter(player_id=self.player.pk).acount(), 1)
+
+    async def test_pending_key(self):
+        await self.post("key")
+        # the first request is still running
+        await IdempotencyRecord.objects.filter(key="key").aupdate(status=None, response=None)
+        response = await self.post("key")
+        self.assertEqual((response.status_code, response.headers["Retry-After"]), (409, "1"))
+
+    async def test_level_up_with_failed_boost(self):
+        level = await Level.objects.acreate(title="first", order=1)
+        await Level.objects.acreate(title="second", order=2)
+        await PlayerLevel.objects.acreate(player=self.player, level=level, completed=date(2025, 1, 1))
+        url = f"/players/player/{self.player.pk}/level_up"
+        with patch.object(BoostService, "add_boost", side_effect=RuntimeError("boost failed")):
+            with self.assertRaises(RuntimeError):
+                await self.client.patch(url, headers={"Idempotency-Key": "key"})
+        # the level up was rolled back with the boost, the released key levels up once
+        self.assertEqual(await PlayerLevel.objects.filter(player=self.player).acount(), 1)
+        first = await self.client.patch(url, headers={"Idempotency-Key": "key"})
+        replayed = await self.client.patch(url, headers={"Idempotency-Key": "key"})
+        self.assertTrue(first.json()["result"])
+        self.assertEqual(replayed.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(await PlayerLevel.objects.filter(player=self.player).acount(), 2)
+        self.assertEqual(await Boost.objects.filter(player=self.player).acount(), 1)
+
+    @override_settings(ARCHIVE_CHUNK_SIZE=1)
+    def test_purge(self):
+        for key in ("old", "older", "fresh"):
+            IdempotencyRecord.objects.create(player_id=self.player.pk, scope="boost", key=key, fingerprint="")
+        IdempotencyRecord.objects.exclude(key="fresh").update(created=datetime.now() - timedelta(hours=25))
+        self.assertEqual(IdempotencyService.purge("default"), 2)
+        self.assertEqual(list(IdempotencyRecord.objects.values_list("key", flat=True)), ["fresh"])
+
+
+class PlayerStatsConsistencyTest(TransactionTestCase):
+    """Counters kept by the write paths are the same as a recount from history"""
+
+    def setUp(self):
+        levels = [Level.objects.create(title=f"level {order}", order=order) for order in (1, 2, 3)]
+        for level, titles in zip(levels, (["gold"], ["silver", "bronze"])):
+            for title in titles:
+                LevelPrize.objects.create(level=level, prize=Prize.objects.create(title=title), received=date.today())
+        self.players = [Player.objects.create(player_id=uuid4(), player_name=name) for name in ("first", "second")]
+
+    def stats(self):
+        return {row.pop("player_id"): row for row in PlayerStats.objects.order_by("pk").values(
+            "player_id", *PlayerStatsService.fields)}
+
+    async def test_counters_match_recount(self):
+        first, second = (str(player.pk) for player in self.players)
+        for player_id in (first, second):
+            await PlayerLevelService.set_levels_to_fresh_player(player_id)
+        self.assertTrue((await PlayerLevelService.level_up(first))["result"])
+        await BoostService.create_boost({"title": "boost", "description": "d", "duration": 1}, first)
+        await BoostService.create_boost({"title": "manual", "description": None, "duration": None}, second)
+        results = await BatchLevelUpService.level_up_many([(UUID(first), 5), (UUID(second), None)])
+        self.assertEqual([result["result"] for result in results], [True, True])
+        # the last level: completed with no next one
+        self.assertFalse((await PlayerLevelService.level_up(first))["result"])
+
+        kept = await sync_to_async(self.stats)()
+        self.assertEqual(kept[UUID(first)], {"levels_completed": 3, "prizes_received": 3, "max_level_order": 3,
+                                             "boosts_granted": 1})
+        self.assertEqual(kept[UUID(second)], {"levels_completed": 1, "prizes_received": 1, "max_level_order": 2,
+                                              "boosts_granted": 1})
+
+        await PlayerStats.objects.aupdate(levels_completed=0, prizes_received=0, max_level_order=0, boosts_granted=0)
+        self.assertEqual(await sync_to_async(PlayerStatsService.rebuild_chunk)("default", None),
+                         (max(UUID(first), UUID(second)), 2))
+        self.assertEqual(await sync_to_async(self.stats)(), kept)
+
+
+class AnalyticsTest(TransactionTestCase):
+    """Logins are counted once per player and day into the cohort of the first login, rebuild agrees"""
+
+    def setUp(self):
+        self.today = date.today()
+        self.started = self.today - timedelta(days=3)
+        self.fresh = Player.objects.create(player_id=uuid4(), player_name="fresh")
+        self.returning = Player.objects.create(player_id=uuid4(), player_name="returning", first_entry=self.started)
+        # last_entry is auto_now_add
+        Player.objects.filter(pk=self.returning.pk).update(last_entry=self.today - timedelta(days=1))
+        PlayerVisit.objects.create(player_id=self.returning.pk, day=self.started)
+
+    async def visit_all(self):
+        return [await AnalyticsService.register_visit(self.fresh.pk, None),
+                await AnalyticsService.register_visit(self.returning.pk, self.started),
+                await AnalyticsService.register_visit(self.fresh.pk, self.today),
+                await AnalyticsService.register_visit(self.returning.pk, self.started)]
+
+    async def test_one_login_per_day(self):
+        self.assertEqual(await self.visit_all(), [True, True, False, False])
+        report = await AnalyticsService.report(self.started, self.today)
+        self.assertEqual(report["daily"], [{"day": self.today.isoformat(), "new_players": 1, "active_players": 2}])
+        self.assertEqual(report["cohorts"], [
+            {"cohort": self.started.isoformat(), "new_players": 0, "retention": {"3": 1}},
+            {"cohort": self.today.isoformat(), "new_players": 1, "retention": {"0": 1}}])
+
+    async def test_rebuild_keeps_current_day(self):
+        await self.visit_all()
+        self.assertEqual(await sync_to_async(AnalyticsService.rebuild)(), (1, 1))
+        report = await AnalyticsService.report(self.started, self.today)
+        self.assertEqual(report["daily"], [
+            {"day": self.started.isoformat(), "new_players": 1, "active_players": 1},
+            {"day": self.today.isoformat(), "new_players": 1, "active_players": 2}])
+        self.assertEqual(report["cohorts"][0]["retention"], {"0": 1, "3": 1})
+
+
+@override_settings(SEASON_RESET_CHUNK=1)
+class SeasonResetTest(TransactionTestCase):
+    """Standings of all players are saved before the reset, both passes continue after an interruption"""
+
+    def setUp(self):
+        self.first_level = Level.objects.create(title="first", order=1)
+        second_level = Level.objects.create(title="second", order=2)
+        self.leader = Player.objects.create(player_id=UUID(int=1), player_name="leader", player_score=10)
+        self.newbie = Player.objects.create(player_id=UUID(int=2), player_name="newbie", player_score=5)
+        PlayerLevel.objects.create(player=self.leader, level=self.first_level, completed=date(2025, 1, 1),
+                                   is_completed=True, score=10)
+        PlayerLevel.objects.create(player=self.leader, level=second_level, completed=date(2025, 1, 2))
+        PlayerLevel.objects.create(player=self.newbie, level=self.first_level, completed=date(2025, 1, 1))
+        Boost.objects.create(player=self.leader, title="boost", get_time=datetime(2025, 1, 1))
+        PlayerStatsService.rebuild_chunk("default", None)
+
+    def run_pass(self, chunk, *args):
+        done = []
+        while (n := chunk("default", "s1", *args)) is not None:
+            done.append(n)
+        return done
+
+    def stats(self):
+        return list(PlayerStats.objects.order_by("pk").values_list("pk", *PlayerStatsService.fields))
+
+    def test_reset_needs_snapshot(self):
+        with self.assertRaises(RuntimeError):
+            SeasonService.reset_chunk("default", "s1", self.first_level)
+
+    def test_resume_after_interruption(self):
+        self.assertEqual(SeasonService.snapshot_chunk("default", "s1"), 1)
+        # interrupted: the next run continues after the saved chunk
+        self.assertEqual(self.run_pass(SeasonService.snapshot_chunk), [1])
+        # a score earned after the snapshot is kept in the standing
+        Player.objects.filter(pk=self.newbie.pk).update(player_score=7)
+
+        with patch.object(BoostArchive, "archive", side_effect=RuntimeError("killed")):
+            with self.assertRaises(RuntimeError):
+                SeasonService.reset_chunk("default", "s1", self.first_level)
+        self.assertEqual(Player.objects.get(pk=self.leader.pk).player_score, 10)
+        self.assertEqual(PlayerLevel.objects.filter(player=self.leader).count(), 2)
+        self.assertEqual(SeasonReset.objects.get(season="s1").after_pk, None)
+
+        self.assertEqual(self.run_pass(SeasonService.reset_chunk, self.first_level), [1, 1])
+        self.assertIsNone(SeasonService.reset_chunk("default", "s1", self.first_level))
+        self.assertEqual(list(SeasonStanding.objects.order_by("player_id").values_list(
+            "player_name", "player_score", "level_order", "levels_completed")), [("leader", 10, 2, 1),
+                                                                                  ("newbie", 7, 1, 0)])
+        self.assertEqual(OutboxEvent.objects.filter(event_type="season_reset").count(), 2)
+        self.assertEqual(SeasonReset.objects.get(season="s1").players, 2)
+
+    def test_levels_and_boosts_are_archived(self):
+        self.run_pass(SeasonService.snapshot_chunk)
+        self.run_pass(SeasonService.reset_chunk, self.first_level)
+        self.assertEqual(list(Player.objects.values_list("player_score", flat=True)), [0, 0])
+        self.assertEqual(list(PlayerLevel.objects.order_by("player_id").values_list(
+            "player_id", "level_id", "is_completed")), [(self.leader.pk, self.first_level.pk, False),
+                                                        (self.newbie.pk, self.first_level.pk, False)])
+        self.assertEqual(list(PlayerLevelArchive.objects.order_by("player_level_id").values_list(
+            "player_id", "level_order", "is_completed")), [(self.leader.pk, 1, True), (self.leader.pk, 2, False),
+                                                           (self.newbie.pk, 1, False)])
+        self.assertFalse(Boost.objects.exists())
+        self.assertEqual(list(BoostArchive.objects.values_list("player_id", flat=True)), [self.leader.pk])
+
+    def test_stats_are_lifetime(self):
+        before = self.stats()
+        self.run_pass(SeasonService.snapshot_chunk)
+        self.run_pass(SeasonService.reset_chunk, self.first_level)
+        self.assertEqual(self.stats(), before)
+        PlayerStatsService.rebuild_chunk("default", None)
+        self.assertEqual(self.stats(), before)
+        self.assertEqual(before[0], (self.leader.pk, 1, 0, 2, 1))
+
+
+class FunnelTest(TransactionTestCase):
+    """NumPy funnel against a plain Python computation of the same rows"""
+    databases = "__all__"
+    orders = [1, 2, 5]
+    # player, Level.order, is_completed, score, completed; order 7 is not in the catalog
+    rows = [
+        ("a", 1, True, 0, date(2025, 1, 1)), ("a", 2, True, 3, date(2025, 1, 4)), ("a", 5, False, 0, date(2025, 1, 4)),
+        ("b", 1, True, 1, date(2025, 1, 2)), ("b", 2, True, 100, date(2025, 1, 12)),
+        ("b", 5, True, 4, date(2025, 1, 13)), ("b", 7, False, 0, date(2025, 1, 13)),
+        ("c", 1, True, 2, date(2025, 1, 3)), ("c", 2, False, 0, date(2025, 1, 3)),
+        ("d", 7, False, 0, date(2025, 1, 1)),
+    ]
+
+    @staticmethod
+    def quantile(values, q):
+        values = sorted(values)
+        return next((value for i, value in enumerate(values, 1) if i >= q * len(values)), None)
+
+    def expected(self, rows):
+        rows = sorted(row for row in rows if row[1] in self.orders)
+        levels = []
+        for order in self.orders:
+            reached = [row for row in rows if row[1] == order]
+            done = [row[3] for row in reached if row[2]]
+            days = [cur[4].toordinal() - prev[4].toordinal() for prev, cur in zip(rows, rows[1:])
+                    if prev[0] == cur[0] and cur[1] == order and prev[2] and cur[2]]
+            score_bins = [math.ceil(math.log2(score + 1)) for score in done]
+            p50, p90 = (self.quantile(score_bins, q) for q in (0.5, 0.9))
+            levels.append({
+                "order": order, "reached": len(reached), "completed": len(done),
+                "completion_rate": round(len(done) / len(reached), 4),
+                "stuck": len(reached) - len(done), "drop_off_rate": round(1 - len(done) / len(reached), 4),
+                "share_of_start": round(len(reached) / len([row for row in rows if row[1] == self.orders[0]]), 4),
+                "score_mean": round(sum(done) / len(done), 4) if done else None,
+                "score_p50": None if p50 is None else 2 ** p50 - 1, "score_p90": None if p90 is None else 2 ** p90 - 1,
+                "days_mean": round(sum(days) / len(days), 4) if days else None,
+                "days_p50": self.quantile(days, 0.5), "days_p90": self.quantile(days, 0.9)})
+        return {"players": len({row[0] for row in rows}), "levels": levels}
+
+    @staticmethod
+    def comparable(result):
+        return {"players": result["players"], "levels": result["levels"]}
+
+    def test_chunks_match_plain_python(self):
+        by_player = [[row for row in self.rows if row[0] == player] for player in "abcd"]
+        single = FunnelAccumulator(self.orders)
+        shuffled = list(self.rows)
+        random.Random(1).shuffle(shuffled)
+        single.add(*zip(*shuffled))
+
+        # a player's rows stay in one chunk, chunks are also merged from other shards
+        chunked, other = FunnelAccumulator(self.orders), FunnelAccumulator(self.orders)
+        chunked.add(*zip(*reversed(by_player[0] + by_player[1])))
+        other.add(*zip(*(by_player[2] + by_player[3])))
+        chunked.merge(other)
+
+        expected = self.expected(self.rows)
+        self.assertEqual(self.comparable(single.result()), expected)
+        self.assertEqual(self.comparable(chunked.result()), expected)
+        self.assertEqual(single.result()["score_histogram"], [
+            {"min": 0, "max": 0, "count": 1}, {"min": 1, "max": 1, "count": 1}, {"min": 2, "max": 3, "count": 2},
+            {"min": 4, "max": 7, "count": 1}, {"min": 64, "max": 127, "count": 1}])
+
+    def create(self, alias):
+        levels = {order: Level(id=order, title=str(order), order=order) for order in self.orders}
+        Level.objects.using(alias).bulk_create(levels.values())
+        players = {name: Player(player_id=UUID(int=i + 1), player_name=name) for i, name in enumerate("abc")}
+        Player.objects.using(alias).bulk_create(players.values())
+        return levels, players
+
+    @override_settings(FUNNEL_CHUNK=1)
+    def test_archive_of_the_season(self):
+        levels, players = self.create("default")
+        reset = SeasonReset.objects.create(season="s0", finished=datetime.now() - timedelta(hours=1))
+        for name, order, done, score, completed in self.rows:
+            if name in players and order in levels:
+                PlayerLevelArchive.objects.create(player_level_id=0, player_id=players[name].pk, level_id=order,
+                                                  level_title=str(order), level_order=order, is_completed=done,
+                                                  score=score, completed=completed)
+        # archived before the reset: the previous season
+        PlayerLevelArchive.objects.filter(player_id=players["c"].pk).update(
+            archived=reset.finished - timedelta(days=1))
+
+        funnel = FunnelService.compute_alias("default", self.orders)
+        self.assertEqual(self.comparable(funnel.result()),
+                         self.expected([row for row in self.rows if row[0] in "ab"]))
+
+    @override_settings(REPLICA_DATABASES=["test_shard_1"])
+    async def test_view_reads_replica(self):
+        levels, players = await sync_to_async(self.create)("test_shard_1")
+        await PlayerLevel.objects.using("test_shard_1").abulk_create(
+            [PlayerLevel(player=players[name], level=levels[order], is_completed=done, score=score, completed=completed)
+             for name, order, done, score, completed in self.rows if name in players and order in levels])
+        cache._values.clear()
+
+        response = await AsyncClient().get("/players/analytics/funnel")
+        self.assertEqual(self.comparable(response.json()), self.expected(self.rows))
+
+
+@override_settings(ADMISSION_LIMITS={"test": {"limit": 1, "queue": 1, "timeout": 5, "per_key": 1}})
+class AdmissionTest(TransactionTestCase):
+    """Full queue answers 503, a player over its share 429, both with Retry-After; waiters leave no trace"""
+
+    class View:
+        def __init__(self):
+            self.release = asyncio.Event()
+
+        @admission.admission("test", per_player=True)
+        async def get(self, request, *args, **kwargs):
+            await self.release.wait()
+            return "done"
+
+    class Request:
+        path = "/test"
+
+    def setUp(self):
+        admission._limiters.clear()
+        self.addCleanup(admission._limiters.clear)
+        self.view = self.View()
+
+    def call(self, pk):
+        return asyncio.create_task(self.view.get(self.Request(), pk=pk))
+
+    async def test_full_queue(self):
+        running, waiting = self.call("a"), self.call("b")
+        await asyncio.sleep(0)
+        response = await self.view.get(self.Request(), pk="c")
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "1"))
+        self.view.release.set()
+        self.assertEqual(await asyncio.gather(running, waiting), ["done", "done"])
+
+    async def test_player_share(self):
+        running = self.call("a")
+        await asyncio.sleep(0)
+        response = await self.view.get(self.Request(), pk="a")
+        self.assertEqual((response.status_code, response["Retry-After"]), (429, "1"))
+        self.view.release.set()
+        self.assertEqual(await running, "done")
+
+    async def test_cancelled_waiter_releases_player(self):
+        limiter = admission.get_limiter("test")
+        running, waiting = self.call("a"), self.call("b")
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual((limiter.waiting, dict(limiter._keys)), (0, {"a": 1}))
+
+        self.view.release.set()
+        await running
+        self.assertEqual(await self.call("b"), "done")
+        self.assertEqual((limiter.active, dict(limiter._keys)), (0, {}))
+
+
+class DatabasePoolTest(TransactionTestCase):
+    """Pool statistics of every database of the worker"""
+    databases = "__all__"
+
+    @override_settings(PLAYER_SHARDS=["test_shard_1", "test_shard_2"], REPLICA_DATABASES=["test_shard_2"])
+    async def test_all_aliases(self):
+        for url in ("/players/db/pool", "/players/metrics"):
+            response = await AsyncClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            stats = response.json() if url.endswith("pool") else response.json()["db_pool"]
+            self.assertEqual([(row["alias"], row["pooled"]) for row in stats],
+                             [("default", False), ("test_shard_1", False), ("test_shard_2", False)])
@@ -1,14 +1,25 @@
 from django.urls import path
 from players.apps import PlayerConfig
-from players.views import PlayerView, BoostPlayerView, PlayerLevelUp, PlayerListView, PlayerCreateView, CSVApi
+from players.views import (PlayerView, BoostPlayerView, PlayerLevelUp, PlayerListView, PlayerCreateView, CSVApi,
+                           DatabasePoolView, MetricsView, BatchLevelUpView, PlayerSearchView,
+                           PlayerEventsView, AnalyticsView, PlayersByIdsView,
+                           LevelFunnelView)
 
 app_name = PlayerConfig.name
 
 urlpatterns = [
     path('all', PlayerListView.as_view(), name='players'),
     path('csv', CSVApi.as_view(), name='players_csv'),
+    path('search', PlayerSearchView.as_view(), name='players_search'),
+    path('by_ids', PlayersByIdsView.as_view(), name='players_by_ids'),
     path('player/create', PlayerCreateView.as_view(), name='player_create'),
     path('player/<uuid:pk>', PlayerView.as_view(), name='player'),
     path('player/<uuid:pk>/boost', BoostPlayerView.as_view(), name='boost_player'),
+    path('player/<uuid:pk>/events', PlayerEventsView.as_view(), name='player_events'),
     path('player/<uuid:pk>/level_up', PlayerLevelUp.as_view(), name='level_up_player'),
+    path('level_up/batch', BatchLevelUpView.as_view(), name='level_up_batch'),
+    path('analytics', AnalyticsView.as_view(), name='analytics'),
+    path('analytics/funnel', LevelFunnelView.as_view(), name='level_funnel'),
+    path('db/pool', DatabasePoolView.as_view(), name='db_pool'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,20 +1,81 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import aprefetch_related_objects
+from django.http import StreamingHttpResponse
 from adrf.views import APIView
 from adrf.generics import ListAPIView, RetrieveAPIView, CreateAPIView
 from rest_framework.exceptions import NotFound
-from players.serializers import (PlayerSerializer, PlayersListSerializer,
-                                 BoostCreateSerializer, BoostsListSerializer, PlayerCreateSerializer)
+from players.serializers import (PlayerSerializer, PlayersListSerializer, PlayerRowsSerializer,
+                                 BoostCreateSerializer, BoostsListSerializer, PlayerCreateSerializer,
+                                 BoostArchiveSerializer, PlayerLevelArchiveSerializer, BatchLevelUpSerializer,
+                                 PlayerSearchSerializer, AnalyticsQuerySerializer, PlayersByIdsSerializer)
 from rest_framework.response import Response
 from rest_framework.request import Request
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_503_SERVICE_UNAVAILABLE
-from players.services import PlayerService, BoostService, PlayerLevelService, CSVService, logger
+from rest_framework.status import (HTTP_200_OK, HTTP_201_CREATED, HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST,
+                                   HTTP_503_SERVICE_UNAVAILABLE)
+from players.admission import admission, limiters_stats
+from players.idempotency import idempotent
+from players.push import get_bus, sse_stream
+from players.routers import use_player_shard
+from players.services import (PlayerService, BoostService, PlayerLevelService, CSVService, DatabaseService,
+                              ETagService, ArchiveService, BatchLevelUpService, PlayerSearchService, OutboxService,
+                              AnalyticsService, FunnelService, logger)
 from uuid import uuid4
 
 
+def include_archive(request: Request) -> bool:
+    """?include_archive=1 adds archived history to the response"""
+    return request.query_params.get("include_archive") in ("1", "true")
+
+
 class PlayerListView(ListAPIView):
     """List of players"""
+    read_replica = True
     serializer_class = PlayersListSerializer
     queryset = PlayerService.get_players_list()
 
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        etag = ETagService.make(request, "players", await ETagService.players_version())
+        if ETagService.matches(request, etag):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if settings.FAST_SERIALIZATION:
+            rows = await PlayerService.get_all_players_rows()
+            return Response(PlayerRowsSerializer("player_level").data(*rows), status=HTTP_200_OK,
+                            headers={"ETag": etag})
+        players = await PlayerService.get_all_players()
+        serializer = self.get_serializer(players, many=True)
+        return Response(await serializer.adata, status=HTTP_200_OK, headers={"ETag": etag})
+
+
+class PlayerSearchView(APIView):
+    """Players by name prefix (?by=name), player_id prefix (?by=id) or name substring (?by=contains),
+    keyset pages: ?cursor= from ``next``"""
+    read_replica = True
+    http_method_names = ["get"]
+
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        req = PlayerSearchSerializer(data=request.query_params)
+        if not req.is_valid():
+            return Response(req.errors, status=HTTP_400_BAD_REQUEST)
+        return Response(await PlayerSearchService.search(**req.validated_data), status=HTTP_200_OK)
+
+
+class PlayersByIdsView(APIView):
+    """Many players by id in one request (friend lists, clans): ?ids=<uuid>,...&fields=...
+    Players in the order of ids, read only - no boost sweep and no login registration of PlayerView"""
+    read_replica = True
+    http_method_names = ["get"]
+
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        req = PlayersByIdsSerializer(data=request.query_params)
+        if not req.is_valid():
+            return Response(req.errors, status=HTTP_400_BAD_REQUEST)
+        ids, fields = req.validated_data["ids"], req.validated_data.get("fields")
+        rows = await PlayerService.get_players_rows_by_ids(ids, with_boosts=not fields or "boost" in fields,
+                                                           with_levels=not fields or "player_levels" in fields)
+        return Response(PlayerRowsSerializer().data_by_ids(ids, *rows, fields=fields), status=HTTP_200_OK)
+
 
 class PlayerCreateView(CreateAPIView):
     queryset = PlayerService.get_players_list()
@@ -23,7 +84,8 @@ class PlayerCreateView(CreateAPIView):
     async def post(self, request: Request, *args, **kwargs):
         uuid = uuid4()
         request.data.update([('player_id', uuid)])
-        resp = await super().post(request, *args, **kwargs)
+        with use_player_shard(uuid):
+            resp = await super().post(request, *args, **kwargs)
         try:
             await PlayerLevelService.set_levels_to_fresh_player(uuid)
         except AssertionError as e:
@@ -32,21 +94,47 @@ class PlayerCreateView(CreateAPIView):
 
 
 class PlayerView(RetrieveAPIView):
-    """Get all about player"""
+    """Get all about player. Not read from replicas: the read expires boosts and registers the login"""
     serializer_class = PlayerSerializer
 
     async def aget_object(self, *args, **kwargs):
         obj = await PlayerService.get_player(self.kwargs.get('pk'))
         if not obj:
             raise NotFound
+        await aprefetch_related_objects([obj], "stats")
         await PlayerService.check_last_entry(obj)
         return obj
 
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        resource = "player-archive" if include_archive(request) else "player"
+        state = await ETagService.player_version(kwargs.get("pk"))
+        if state is not None:
+            version, fresh = state
+            etag = ETagService.make(request, resource, version)
+            # not fresh: read will expire boosts, so version changes
+            if fresh and ETagService.matches(request, etag):
+                return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if settings.FAST_SERIALIZATION:
+            obj = await self.aget_object()
+            rows = await PlayerService.get_player_rows(obj)
+            response = Response(PlayerRowsSerializer().data(*rows)[0], status=HTTP_200_OK)
+        else:
+            response = await super().get(request, *args, **kwargs)
+        if include_archive(request):
+            archived = await ArchiveService.get_archived_levels(kwargs.get("pk"))
+            response.data["player_levels"] = (
+                await PlayerLevelArchiveSerializer(archived, many=True).adata + list(response.data["player_levels"]))
+        response["ETag"] = ETagService.make(request, resource, response.data["version"])
+        return response
+
 
 class BoostPlayerView(APIView):
     """Boost player"""
     http_method_names = ['post', 'get']
 
+    @admission("write", per_player=True)
+    @idempotent("boost")
     async def post(self, request: Request, *args, **kwargs):
         req = BoostCreateSerializer(data=request.data)
         if await PlayerService.get_player(self.kwargs.get('pk')) is None:
@@ -58,30 +146,81 @@ class BoostPlayerView(APIView):
         return Response(req.errors)
 
     async def get(self, request, *args, **kwargs):
+        state = await ETagService.player_version(kwargs.get("pk"))
+        if state is None:
+            raise NotFound
+        etag = ETagService.make(request, "boosts-archive" if include_archive(request) else "boosts", state[0])
+        if ETagService.matches(request, etag):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
         data = await BoostService.get_boosts_list(kwargs.get("pk"))
-        ser = BoostsListSerializer(instance=data, many=True)
-        return Response(data=await ser.adata, status=HTTP_200_OK)
+        boosts = await BoostsListSerializer(instance=data, many=True).adata
+        if include_archive(request):
+            archived = await ArchiveService.get_archived_boosts(kwargs.get("pk"))
+            boosts = await BoostArchiveSerializer(archived, many=True).adata + list(boosts)
+        return Response(data=boosts, status=HTTP_200_OK, headers={"ETag": etag})
+
+
+class PlayerEventsView(APIView):
+    """Server-sent events of the player: boost_granted, boost_expired, level_up, reward, season_reset.
+    A reconnecting client sends Last-Event-ID and gets the missed events first."""
+    http_method_names = ["get"]
+
+    async def get(self, request: Request, *args, **kwargs):
+        player_id = str(kwargs.get("pk"))
+        if await ETagService.player_version(player_id) is None:
+            raise NotFound
+        bus = get_bus()
+        if bus.connections() >= settings.PUSH_MAX_CONNECTIONS:
+            return Response({False: "Сервис перегружен, повторите позже"}, status=HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": str(int(settings.PUSH_HEARTBEAT))})
+
+        # subscribe before reading the outbox: nothing committed in between is lost, duplicates are skipped
+        subscription = await bus.subscribe(player_id)
+        last_event_id = request.headers.get("Last-Event-ID", "")
+        try:
+            missed = await OutboxService.events_after(player_id, int(last_event_id)) if last_event_id.isdigit() else []
+        except BaseException:
+            bus.unsubscribe(subscription)
+            raise
+        return StreamingHttpResponse(sse_stream(subscription, missed), content_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 class PlayerLevelUp(APIView):
     http_method_names = ["patch"]
 
+    @admission("write", per_player=True)
+    @idempotent("level_up")
     async def patch(self, request: Request, *args, **kwargs):
         boost = request.GET
-        result = await PlayerLevelService.level_up(kwargs.get("pk"))
-        if result.get("result"):
-            if not all([boost.get(i) for i in ['title', "description", "duration"]]):
-                boost = {"title": "boost", "description": "standard new level boost", "duration": 1}
-            await BoostService.create_boost(boost, kwargs.get("pk"))
+        if not all([boost.get(i) for i in ['title', "description", "duration"]]):
+            boost = {"title": "boost", "description": "standard new level boost", "duration": 1}
+        # one transaction: a failed boost doesn't leave a committed level up behind the released Idempotency-Key
+        result = await PlayerLevelService.level_up(kwargs.get("pk"), boost=boost)
         return Response(result, status=HTTP_200_OK)
 
 
+class BatchLevelUpView(APIView):
+    """Level up of many players at once (tournament results), result per player"""
+    http_method_names = ["post"]
+
+    @admission("export")
+    async def post(self, request: Request, *args, **kwargs):
+        req = BatchLevelUpSerializer(data=request.data)
+        if not req.is_valid():
+            return Response(req.errors, status=HTTP_400_BAD_REQUEST)
+        return Response(await BatchLevelUpService.level_up_many(req.items()), status=HTTP_200_OK)
+
+
 class CSVApi(APIView):
+    read_replica = True
     http_method_names = ["get"]
 
+    @admission("export")
     async def get(self, request: Request, *args, **kwargs) -> Response:
         try:
-            ready_csv = await CSVService.export_to_csv()
+            ready_csv = await CSVService.export_to_csv(include_archive(request))
             response = Response(ready_csv)
             response['Content-Type'] = 'text/csv'
             response['Content-Disposition'] = 'attachment; filename="players.csv"'
@@ -90,3 +229,42 @@ class CSVApi(APIView):
             logger.error("Something goes wrong in CSVApi", exc_info=True)
             return Response({False: "Сервис временно недоступен"}
                             , status=HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class AnalyticsView(APIView):
+    """New and active players per day and retention cohorts, ?since=&until= (last 30 days by default)"""
+    read_replica = True
+    http_method_names = ["get"]
+
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        req = AnalyticsQuerySerializer(data=request.query_params)
+        if not req.is_valid():
+            return Response(req.errors, status=HTTP_400_BAD_REQUEST)
+        return Response(await AnalyticsService.report(**req.validated_data), status=HTTP_200_OK)
+
+
+class LevelFunnelView(APIView):
+    """Completion rate, drop-off, scores and days between levels per Level.order of the current season"""
+    read_replica = True
+    http_method_names = ["get"]
+
+    @admission("export")
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        return Response(await FunnelService.get(), status=HTTP_200_OK)
+
+
+class DatabasePoolView(APIView):
+    """DB connection pool statistics of the worker, per database (default, shards, replicas)"""
+    http_method_names = ["get"]
+
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        return Response(await sync_to_async(DatabaseService.pools_stats)(), status=HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """Worker metrics: admission limiters and DB connection pool"""
+    http_method_names = ["get"]
+
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        return Response({"admission": limiters_stats(),
+                         "db_pool": await sync_to_async(DatabaseService.pools_stats)()}, status=HTTP_200_OK)